@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""Fill the database with past prices from the Octopus API, e.g. a year of them for
+working out what a tariff would have cost. The API hands these out a page at a time:
+each page is parsed as it arrives and then its slots are stored all at once, so the
+memory used is the same whatever the date range, and the database is only locked
+for as long as it takes to write one page, not to download it. Each page is
+committed along with the link to the next one, so a backfill that's interrupted
+carries on from the last page stored when it's run again with the same dates - or
+on a later day with the same --from, if --to was left to default to today.
+
+Carbon intensity has no paged history API, so carbon series are skipped."""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timedelta, timezone
+import eco_config
+import eco_db
+import eco_profile
+import eco_series
+import eco_stream
+import eco_timing
+import store_data
+
+PAGE_SIZE = 1500 # the most results the Octopus API will put on a page
+CHUNK_SIZE = 16384 # how many bytes of a page to read at a time
+
+# Store a slot unless the hour or day it's in has already counted it in the long-term
+# history (its bit is set in their slot_mask), which would then count it twice. Slots
+# that a rolled-up hour or day is missing are stored, and store_data.prune_data then
+# merges them into it.
+BACKFILL_UPSERT = ('INSERT INTO readings(series_id, valid_from, value) SELECT ?1, ?2, ?3 '
+                   'WHERE NOT EXISTS (SELECT 1 FROM readings_hourly '
+                   'WHERE series_id = ?1 AND period_start = ?2 / 3600 * 3600 '
+                   'AND slot_mask & (1 << ?2 % 86400 / 1800)) '
+                   'AND NOT EXISTS (SELECT 1 FROM readings_daily '
+                   'WHERE series_id = ?1 AND period_start = ?2 / 86400 * 86400 '
+                   'AND slot_mask & (1 << ?2 % 86400 / 1800)) '
+                   'ON CONFLICT(series_id, valid_from) DO UPDATE SET value=excluded.value')
+
+def parse_date(text: str) -> datetime:
+    """A YYYY-MM-DD date from the command line, as midnight UTC."""
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError('dates must be YYYY-MM-DD, not ' + text) from error
+
+def today() -> datetime:
+    """Midnight UTC at the start of today."""
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def first_page_uri(series: dict, api_base: str, period_from: datetime, period_to: datetime) -> str:
+    """The request for the first page of a series' slots between two times."""
+    return (api_base + series['path'] + '?page_size=' + str(PAGE_SIZE) +
+            '&period_from=' + period_from.strftime("%Y-%m-%dT%H:%M:%SZ") +
+            '&period_to=' + period_to.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+def page_rows(series_id: int, results):
+    """Turn the results on a page, as they're read, into rows for the database."""
+    for result in results:
+        yield series_id, store_data.iso_to_epoch(result['valid_from']), result['value_inc_vat']
+
+def backfill_series(conn: sqlite3.Connection, session, series: dict, api_base: str,
+                    period_from: datetime, period_to: datetime = None,
+                    not_before: datetime = None) -> int:
+    """Fetch and store every page of one series' slots between two times, leaving out
+    any before 'not_before', carrying on from where an earlier run with the same times
+    got to if there was one. Without a 'period_to' the slots go up to the end of today,
+    or, if an earlier run from the same time was left unfinished, up to where that one
+    was going, so it's carried on whichever day it's run again. Returns how many slots
+    were stored."""
+    import requests
+
+    series_id = eco_db.series_id(conn, series)
+    conn.commit()
+
+    if period_to is None:
+        row = conn.execute('SELECT MAX(period_to) FROM backfill_progress WHERE series_id = ? '
+                           'AND period_from = ?', (series_id, int(period_from.timestamp()))).fetchone()
+        if row[0] is None:
+            period_to = today() + timedelta(days=1)
+        else:
+            period_to = datetime.fromtimestamp(row[0], timezone.utc)
+    progress_key = (series_id, int(period_from.timestamp()), int(period_to.timestamp()))
+
+    row = conn.execute('SELECT next_uri FROM backfill_progress WHERE series_id = ? AND '
+                       'period_from = ? AND period_to = ?', progress_key).fetchone()
+    if row is not None:
+        print('Carrying on with ' + series['tariff'] + ' from where we got to last time...')
+        uri = row[0]
+    else:
+        uri = first_page_uri(series, api_base, max(period_from, not_before or period_from),
+                             period_to)
+
+    pages = stored = 0
+    while uri is not None:
+        try:
+            with eco_timing.Span('backfill_page', tariff=series['tariff']):
+                with session.get(uri, timeout=30, stream=True) as response:
+                    response.raise_for_status()
+                    page = eco_stream.StreamedObject(response.iter_content(CHUNK_SIZE), 'results')
+                    # at most PAGE_SIZE rows - read them all before taking the write lock,
+                    # so store_data.py and the daemon aren't locked out while we download
+                    rows = list(page_rows(series_id, page))
+                    # the rest of the page has been read now, including the link to the next one
+                    uri = page.fields.get('next')
+
+                conn.execute('BEGIN IMMEDIATE')
+                stored += conn.executemany(BACKFILL_UPSERT, rows).rowcount
+                if uri is None:
+                    conn.execute('DELETE FROM backfill_progress WHERE series_id = ? AND '
+                                 'period_from = ? AND period_to = ?', progress_key)
+                else:
+                    conn.execute('INSERT INTO backfill_progress VALUES (?, ?, ?, ?) '
+                                 'ON CONFLICT(series_id, period_from, period_to) '
+                                 'DO UPDATE SET next_uri=excluded.next_uri', progress_key + (uri,))
+                conn.commit()
+
+        except (requests.exceptions.RequestException, ValueError, KeyError, sqlite3.Error) as error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise SystemExit('Backfill of ' + series['tariff'] + ' stopped after ' + str(pages) +
+                             ' pages: ' + str(error) + '. Run the same command again to carry on '
+                             'from the last page stored.') from error
+
+        pages += 1
+        print(series['tariff'] + ': page ' + str(pages) + ' stored, ' + str(stored) + ' slots so far.')
+
+    return stored
+
+def main(argv: list = None):
+    """Backfill every configured Octopus series from the command line."""
+    parser = argparse.ArgumentParser(description=('Fill the database with past prices from the Octopus API'))
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    parser.add_argument('--from', dest='period_from', type=parse_date, required=True,
+                        help='the first day to fetch, YYYY-MM-DD')
+    parser.add_argument('--to', dest='period_to', type=parse_date,
+                        help='the last day to fetch, YYYY-MM-DD (default: today)')
+    eco_profile.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    conf_file = args.conf
+
+    os.chdir(sys.path[0])
+
+    with eco_profile.profiling(args.profile, 'backfill'):
+        config = eco_config.get_config(conf_file)
+
+        # up to the end of the last day - left to backfill_series if it's today, so that
+        # an unfinished backfill is still carried on when it's run again tomorrow
+        period_to = None
+        if args.period_to is not None:
+            period_to = args.period_to + timedelta(days=1)
+
+        # anything older than we keep daily history for would only be deleted again
+        oldest_kept = today() - timedelta(days=config['Retention']['DailyDays'])
+        if args.period_from < oldest_kept:
+            print('Only keeping ' + str(config['Retention']['DailyDays']) + ' days of history '
+                  '(Retention: DailyDays), so starting from ' + oldest_kept.strftime('%Y-%m-%d') + '.')
+
+        if (period_to or today() + timedelta(days=1)) <= max(args.period_from, oldest_kept):
+            raise SystemExit('Error: nothing to backfill between those dates.')
+
+        api_base = config.get('OctopusAPIBase', eco_series.OCTOPUS_API_BASE)
+
+        conn = store_data.open_database(config)
+        session = store_data.make_session(1)
+
+        try:
+            for series in eco_series.configured_series(config):
+                if series['source'] != 'octopus':
+                    print('Skipping ' + series['tariff'] + ' - there is no history to backfill it from.')
+                    continue
+                stored = backfill_series(conn, session, series, api_base, args.period_from,
+                                         period_to, oldest_kept)
+                print(series['tariff'] + ': ' + str(stored) + ' slots stored.')
+
+            # roll anything older than RawDays straight up into the long-term history
+            store_data.prune_data(conn, config, time.time())
+            # and today's slots may have been stored again too
+            store_data.update_summaries(conn, config, time.time())
+        finally:
+            session.close()
+            conn.close()
+            eco_timing.write_metrics(config, 'backfill')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""Draw the Inky pHAT views from made-up data on a virtual display, without any
+   hardware or database: time each phase of drawing, and check the frames against
+   the known-good images in images/golden."""
+
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+from math import sin, pi
+from statistics import mean
+import eco_indicator
+import eco_slots
+import eco_timing
+import eco_virtual
+
+GOLDEN_DIR = os.path.join('images', 'golden')
+
+# drawn as if it's ten past midday in London in winter, so local time is UTC and the
+# frames don't depend on when or where this is run
+CLOCK = 1705320600 # 2024-01-15 12:10:00 UTC
+TIMEZONE = 'Europe/London'
+
+HALF_HOUR = 1800
+ONE_DAY = 86400
+
+PHASES = ('data prep', 'bars', 'outline', 'text', 'rotate', 'show')
+
+def agile_prices(slots: int) -> list:
+    """A day-shaped Agile price curve: cheap (sometimes negative) overnight, a
+    4pm-7pm peak, and some wobble so no two slots tie."""
+    prices = []
+    for i in range(slots):
+        hour = ((CLOCK // HALF_HOUR + i) % 48) / 2
+        price = 18 + 6 * sin((hour - 9) * pi / 12) + 1.3 * sin(i * 1.7)
+        if 16 <= hour < 19:
+            price += 14
+        if 2 <= hour < 4:
+            price -= 20
+        prices.append(round(price, 2))
+    return prices
+
+def carbon_intensities(slots: int) -> list:
+    """Carbon intensity in gCO2/kWh, lowest in the small hours and around midday."""
+    return [float(round(170 + 70 * sin(i * pi / 24) + 30 * sin(i * pi / 7)))
+            for i in range(slots)]
+
+def slot_data(mode: str, hours: int) -> dict:
+    """Made-up data shaped like update_display.read_data()'s, starting at the current slot."""
+
+    if mode == 'tracker':
+        today = CLOCK // ONE_DAY * ONE_DAY
+        starts = [today + ONE_DAY, today] # newest first
+        return {'electricity': eco_slots.SlotSeries(starts, [24.61, 23.87]),
+                'gas': eco_slots.SlotSeries(starts, [5.83, 6.02])}
+
+    slots = hours * 2
+    starts = [CLOCK // HALF_HOUR * HALF_HOUR + i * HALF_HOUR for i in range(slots)]
+
+    if mode == 'carbon':
+        return {'carbon': eco_slots.SlotSeries(starts, carbon_intensities(slots))}
+    return {'electricity': eco_slots.SlotSeries(starts, agile_prices(slots))}
+
+def case_config(mode: str, hours: int, orientation: str) -> dict:
+    """The configuration get_config() would give us for a case."""
+    return {'DisplayType': 'inkyphat',
+            'Mode': mode,
+            'DNORegion': 'A',
+            'AgileCap': 101,
+            'InkyPHAT': {'HighPrice': 30.0,
+                         'HighIntensity': 200,
+                         'HighValue': 200 if mode == 'carbon' else 30.0,
+                         'LowSlotDuration': 3,
+                         'DataDuration': hours,
+                         'CountdownStep': 1,
+                         'DisplayOrientation': orientation}}
+
+def cases() -> list:
+    """Every combination of view, amount of data, display size and orientation."""
+    views = [(mode, hours) for mode in ('agile_import', 'agile_export', 'carbon')
+             for hours in (24, 48)] + [('tracker', None)]
+    return [(mode, hours, resolution, orientation)
+            for mode, hours in views
+            for resolution in eco_virtual.RESOLUTIONS
+            for orientation in ('standard', 'inverted')]
+
+def case_name(mode: str, hours: int, resolution: tuple, orientation: str) -> str:
+    """e.g. agile_import-24h-250x122-standard"""
+    parts = [mode] + ([str(hours) + 'h'] if hours else []) + [
+        '{}x{}'.format(*resolution), orientation]
+    return '-'.join(parts)
+
+def render(mode: str, hours: int, resolution: tuple, orientation: str, timer=None):
+    """Draw one case on a fresh virtual display and return the display."""
+    conf = case_config(mode, hours, orientation)
+    data = slot_data(mode, hours)
+    display = eco_virtual.VirtualInky(resolution)
+    draw = eco_indicator.update_inky_tracker if mode == 'tracker' else eco_indicator.update_inky
+
+    # the drawing code is chatty, and we only want to hear about timings here
+    with contextlib.redirect_stdout(io.StringIO()):
+        draw(conf, data, False, display, clock=lambda: CLOCK, timer=timer)
+    return display
+
+def compare(display, golden_file: str) -> str:
+    """Check a frame against its golden image, returning a short description."""
+    from PIL import Image, ImageChops
+
+    if not os.path.exists(golden_file):
+        return 'NO GOLDEN IMAGE'
+
+    frame = display.render()
+    golden = Image.open(golden_file).convert('RGB')
+    if golden.size != frame.size:
+        return 'DIFFERENT SIZE ' + str(golden.size)
+
+    diff = ImageChops.difference(frame, golden)
+    if diff.getbbox() is None:
+        return 'matches'
+    changed = sum(1 for pixel in diff.getdata() if pixel != (0, 0, 0))
+    return 'DIFFERS (' + str(changed) + ' pixels)'
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=('Benchmark drawing the Inky pHAT views on a '
+                                                  'virtual display and check them against '
+                                                  'known-good images'))
+    parser.add_argument('--repeat', '-r', type=int, default=10,
+                        help='how many times to draw each case for the timings')
+    parser.add_argument('--only', '-o', default='',
+                        help='only run cases whose name contains this, e.g. carbon or 212x104')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='save the frames as the new known-good images instead of checking them')
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR, help='where the known-good images are')
+
+    args = parser.parse_args()
+
+    os.chdir(sys.path[0])
+
+    os.environ['TZ'] = TIMEZONE
+    time.tzset()
+
+    if args.update_golden:
+        os.makedirs(args.golden_dir, exist_ok=True)
+
+    print('{:<38}'.format('case (ms per frame)') +
+          ''.join('{:>10}'.format(phase) for phase in PHASES) + '{:>10}'.format('total') +
+          '  golden image')
+
+    failures = 0
+
+    for case in cases():
+        name = case_name(*case)
+        if args.only not in name:
+            continue
+
+        timings = []
+        for _ in range(args.repeat):
+            timer = eco_timing.PhaseTimer()
+            display = render(*case, timer=timer)
+            timings.append(timer.totals)
+            # the drawing code keeps its timings as spans too, for write_metrics(), which
+            # never runs here - don't let them pile up
+            del eco_timing.SPANS[:]
+
+        golden_file = os.path.join(args.golden_dir, name + '.png')
+        if args.update_golden:
+            display.save(golden_file)
+            result = 'saved'
+        else:
+            result = compare(display, golden_file)
+            if result != 'matches':
+                failures += 1
+
+        phase_ms = [mean(totals.get(phase, 0) for totals in timings) * 1000 for phase in PHASES]
+        print('{:<38}'.format(name) + ''.join('{:>10.2f}'.format(ms) for ms in phase_ms) +
+              '{:>10.2f}'.format(sum(phase_ms)) + '  ' + result)
+
+    if failures:
+        raise SystemExit(str(failures) + " frame(s) differ from the known-good images, or don't "
+                         'have one.')
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,27 @@
 """Determine what type of display is connected and
    use the appropriate method to clear it."""
 
-import eco_indicator
 import argparse
+import eco_indicator
+import eco_config
+import eco_profile
+
+def main(argv: list = None):
+    """Clear the display from the command line."""
+    parser = argparse.ArgumentParser(description=('Clear the attached display'))
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    parser.add_argument('--cycles', '-n', type=int, default=None,
+                        help='how many times to cycle an Inky pHAT through its colours '
+                             '(default: ClearCycles from the config file)')
+    eco_profile.add_argument(parser)
 
-parser = argparse.ArgumentParser(description=('Clear the attached display'))
-parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    args = parser.parse_args(argv)
+    conf_file = args.conf
 
-args = parser.parse_args()
-conf_file = args.conf
+    with eco_profile.profiling(args.profile, 'clear'):
+        config = eco_config.get_config(conf_file)
 
-config = eco_indicator.get_config(conf_file)
+        eco_indicator.clear_display(config, cycles=args.cycles)
 
-eco_indicator.clear_display(config)
+if __name__ == '__main__':
+    main()
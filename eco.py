@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""One entry point for everything: ./eco.py store, ./eco.py display and so on.
+
+On a Pi Zero, starting Python and importing modules takes most of the time of each
+cron run, so only the module for the command given is imported, once we know which
+one it is - storing data never loads the display code, and vice versa. The commands'
+own heavy imports (requests, PIL, the display libraries) are left until they're
+actually needed. `./eco.py startup-check` keeps an eye on this: it times each
+command's imports with python -X importtime and fails if any has grown past budget."""
+
+import os
+import sys
+import argparse
+import importlib
+
+# command: (module whose main(argv) runs it, what it does)
+COMMANDS = {'store': ('store_data', 'fetch new data and store it in the database'),
+            'display': ('update_display', 'update the display from the database'),
+            'clear': ('clear_display', 'clear the display'),
+            'backfill': ('backfill', 'fill the database with past prices'),
+            'daemon': ('run_daemon', 'fetch data and update the display from one long-running process'),
+            'serve': ('serve', 'fetch data for other indicators and serve it to them'),
+            'profile-diff': ('eco_profile', 'compare two runs profiled with --profile')}
+
+# how long importing any one command may take, in milliseconds. This is for the
+# machine the check is run on: set it from a known-good run there with --budget.
+STARTUP_BUDGET_MS = 150
+
+def import_times(module: str, python: str = sys.executable) -> tuple:
+    """Import a module in a fresh interpreter with -X importtime. Returns how long it
+    took in microseconds, including everything it imported, and a list of
+    (microseconds, name) for each module that it imported directly."""
+    import subprocess
+
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise SystemExit('Unable to import ' + module + ':\n' + result.stderr)
+
+    # lines look like "import time:  self [us] | cumulative | imported package", with
+    # two more spaces before the package name for each level of nesting, and each
+    # module's line comes after those of the modules it imported
+    children = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        cumulative = int(parts[1])
+        if depth == 1:
+            children.append((cumulative, name.strip()))
+        elif depth == 0:
+            if name == module:
+                return cumulative, children
+            children = []
+
+    raise SystemExit('No import time found for ' + module)
+
+def startup_check(argv: list = None):
+    """Time each command's imports and fail if any is over budget."""
+    parser = argparse.ArgumentParser(prog='eco.py startup-check',
+                                     description=('Check how long each command takes to import'))
+    parser.add_argument('commands', nargs='*', default=list(COMMANDS),
+                        help='the commands to check (default: all of them)')
+    parser.add_argument('--budget', '-b', type=float, default=STARTUP_BUDGET_MS,
+                        help='the most milliseconds any command may take to import')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='how many times to time each command, keeping the fastest')
+
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for command in args.commands:
+        if command not in COMMANDS:
+            raise SystemExit('Unknown command: ' + command)
+        module = COMMANDS[command][0]
+
+        # the first import may also have to compile the module, so keep the fastest
+        total, children = min(import_times(module) for _ in range(max(args.repeat, 1)))
+        print('{:<10}{:>8.1f} ms  '.format(command, total / 1000) +
+              ', '.join('{} {:.1f}'.format(name, time / 1000)
+                        for time, name in sorted(children, reverse=True)[:5]))
+
+        if total / 1000 > args.budget:
+            over_budget.append(command)
+
+    if over_budget:
+        raise SystemExit('Over the startup budget of ' + str(args.budget) + ' ms: ' +
+                         ', '.join(over_budget))
+
+def main(argv: list = None):
+    """Run one of the commands, importing only what it needs."""
+    parser = argparse.ArgumentParser(
+        description=('Eco Indicator: ' + ', '.join(command + ' (' + description + ')'
+                                                  for command, (_, description) in COMMANDS.items()) +
+                     ', or startup-check (check how long each command takes to start)'),
+        epilog='Run e.g. "eco.py store --help" to see the options for a command.')
+    parser.add_argument('command', choices=list(COMMANDS) + ['startup-check'])
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='options for the command')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup-check':
+        startup_check(args.args)
+        return
+
+    # so the command's --help reads e.g. "usage: eco.py store [-h] ..."
+    sys.argv[0] = os.path.basename(sys.argv[0]) + ' ' + args.command
+
+    importlib.import_module(COMMANDS[args.command][0]).main(args.args)
+
+if __name__ == '__main__':
+    main()
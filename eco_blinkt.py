@@ -0,0 +1,189 @@
+"""
+Drive the Blinkt!: pick each pixel's colour from the configured levels and, when
+run from run_daemon.py, keep animating it between repaints.
+
+Animation runs as a frame loop that only sets the pixels that have changed and
+doesn't touch the LEDs at all when nothing has, so between transitions (and with
+pulsing turned off) it costs nothing.
+"""
+
+from bisect import bisect_right
+from functools import lru_cache
+from math import cos, pi
+import eco_stats
+
+PIXELS = 8
+FRAME_INTERVAL = 0.1 # seconds between frames while anything is moving
+PULSE_PERIOD = 4 # seconds for the current slot's pixel to fade down and back up
+PULSE_DEPTH = 0.6 # how much of its brightness it loses at the bottom of the pulse
+BRIGHTNESS_STEPS = 31 # the LEDs only have 31 brightness levels
+
+OFF = (0, 0, 0)
+
+# for each mode: the series shown, its unit, and which value in each colour level to use
+MODES = {'carbon': ('carbon', 'g', 'Carbon'),
+         'agile_import': ('electricity', 'p', 'Price'),
+         'agile_export': ('electricity', 'p', 'Export')}
+
+DATA_NAMES = ('Price', 'Carbon', 'Export')
+
+class ColourTable:
+    """The configured colour levels for one kind of value, sorted so that the level for
+    any value is found with a binary search: the level with the highest threshold that
+    the value reaches, or None if it's below all of them."""
+
+    __slots__ = ('thresholds', 'levels')
+
+    def __init__(self, levels: list):
+        """'levels' is a list of (threshold, name, (R, G, B)) tuples, in any order."""
+        self.levels = sorted(levels, key=lambda level: level[0])
+        self.thresholds = [level[0] for level in self.levels]
+
+    def lookup(self, value: float):
+        """The (threshold, name, (R, G, B)) level for a value, or None."""
+        index = bisect_right(self.thresholds, value) - 1
+        return self.levels[index] if index >= 0 else None
+
+def compile_colour_tables(colours: dict) -> dict:
+    """Check the Colours section of the config and turn it into a ColourTable for each
+    of Price, Carbon and Export that every level has a value for. Raises ValueError
+    describing the first problem found.
+
+    Levels must be listed from the highest threshold down, with no two levels sharing
+    a threshold - otherwise some levels could never be shown. Tables are cached, so
+    reading the same colours again (e.g. reloading the config) costs nothing."""
+
+    if not isinstance(colours, dict):
+        raise ValueError('Colours must be a list of named levels')
+
+    # something hashable to cache on, which also checks every level has what it needs
+    key = []
+    for level, data in colours.items():
+        if not isinstance(data, dict) or not isinstance(data.get('Name'), str):
+            raise ValueError('colour level ' + str(level) + ' needs a Name')
+        for channel in ('R', 'G', 'B'):
+            if not (isinstance(data.get(channel), int) and 0 <= data[channel] <= 255):
+                raise ValueError('colour level ' + str(level) + ' needs ' + channel +
+                                 ' between 0 and 255')
+        thresholds = []
+        for data_name in DATA_NAMES:
+            if data_name in data:
+                if isinstance(data[data_name], bool) or not isinstance(data[data_name], (int, float)):
+                    raise ValueError(data_name + ' for colour level ' + str(level) +
+                                     ' must be a number')
+                thresholds.append((data_name, data[data_name]))
+        key.append((str(level), data['Name'], (data['R'], data['G'], data['B']),
+                    tuple(thresholds)))
+
+    return _compile_colour_tables(tuple(key))
+
+@lru_cache(maxsize=16)
+def _compile_colour_tables(key: tuple) -> dict:
+    tables = {}
+    for data_name in DATA_NAMES:
+        if not all(data_name in dict(thresholds) for _, _, _, thresholds in key):
+            continue
+
+        levels = [(dict(thresholds)[data_name], name, rgb) for _, name, rgb, thresholds in key]
+        for (above, above_name, _), (below, below_name, _) in zip(levels, levels[1:]):
+            if below >= above:
+                raise ValueError(data_name + ' levels must be listed from highest to lowest '
+                                 'with no repeats, but ' + below_name + ' (' + str(below) +
+                                 ') comes after ' + above_name + ' (' + str(above) + ')')
+        tables[data_name] = ColourTable(levels)
+    return tables
+
+def blend(start: tuple, end: tuple, fraction: float) -> tuple:
+    """The colour 'fraction' of the way from 'start' to 'end'."""
+    return tuple(round(a + (b - a) * fraction) for a, b in zip(start, end))
+
+class BlinktAnimator:
+    """Everything on the Blinkt! for one configuration. Give it new data with
+    set_values() and call frame() until it says there's nothing more to do.
+
+    With animation on, a change of data fades from the old colours to the new over
+    TransitionSeconds, and Animation: pulse slowly pulses the current slot's pixel."""
+
+    def __init__(self, conf: dict, blinkt=None, animate: bool = True):
+        if blinkt is None:
+            import blinkt
+
+        if conf['Mode'] not in MODES:
+            raise SystemExit(conf['Mode'].capitalize() + " not yet implemented on Blinkt!")
+
+        self.blinkt = blinkt
+        self.role, self.short_unit, data_name = MODES[conf['Mode']]
+        self.table = conf['Blinkt']['ColourTables'][data_name]
+        self.slots_per_pixel = conf['Blinkt']['SlotsPerPixel']
+        self.brightness = conf['Blinkt']['Brightness'] / 100
+        self.transition = conf['Blinkt']['TransitionSeconds'] if animate else 0
+        self.pulse = animate and conf['Blinkt']['Animation'] == 'pulse'
+
+        self.start = [OFF] * PIXELS # colours at the start of the current transition...
+        self.target = [OFF] * PIXELS # ...and at the end of it
+        self.transition_start = None
+        self.shown = [None] * PIXELS # what's on each LED, as (R, G, B, brightness level)
+
+        blinkt.set_clear_on_exit(False)
+
+    def colours_at(self, now: float) -> list:
+        """Every pixel's colour at a moment in time, part way through a transition or not."""
+        if self.transition_start is None:
+            return list(self.target)
+        fraction = (now - self.transition_start) / self.transition
+        if fraction >= 1:
+            return list(self.target)
+        return [blend(start, end, max(fraction, 0)) for start, end in zip(self.start, self.target)]
+
+    def set_values(self, values, now: float):
+        """Show new data: the values for each slot, starting with the current one."""
+
+        print("Displaying " + str(self.slots_per_pixel) + " slots per Blinkt! pixel.")
+
+        # group data into however many slots we are using per pixel, using the mean of each group
+        pixel_values = [round(mean, 1) for mean in
+                        eco_stats.block_means(values, self.slots_per_pixel)][:PIXELS]
+
+        if len(pixel_values) < PIXELS:
+            print("Not enough data to fill the display - we will get dark pixels.")
+
+        target = [OFF] * PIXELS
+        for i, slot_data in enumerate(pixel_values):
+            level = self.table.lookup(slot_data)
+            if level is not None:
+                print(str(i) + ': ' + str(slot_data) + self.short_unit + ' -> ' + level[1])
+                target[i] = level[2]
+
+        self.start = self.colours_at(now)
+        self.target = target
+        self.transition_start = now if self.transition > 0 else None
+
+    def frame(self, now: float):
+        """Bring the LEDs up to date for this moment, sending only the pixels that have
+        changed. Returns when the next frame is due, or None if nothing is moving."""
+
+        colours = self.colours_at(now)
+        moving = self.transition_start is not None and colours != self.target
+        if not moving:
+            self.transition_start = None
+
+        changed = False
+        for i, colour in enumerate(colours):
+            brightness = self.brightness
+            if self.pulse and i == 0 and colour != OFF:
+                brightness *= 1 - PULSE_DEPTH * (1 - cos(2 * pi * now / PULSE_PERIOD)) / 2
+                brightness = max(brightness, 1.5 / BRIGHTNESS_STEPS) # dim, but never off
+
+            # compare the brightness level the LED would actually get, as blinkt works it out
+            pixel = colour + (int(brightness * BRIGHTNESS_STEPS),)
+            if pixel != self.shown[i]:
+                self.blinkt.set_pixel(i, *colour, brightness)
+                self.shown[i] = pixel
+                changed = True
+
+        if changed:
+            self.blinkt.show()
+
+        if moving or self.pulse:
+            return now + FRAME_INTERVAL
+        return None
@@ -0,0 +1,405 @@
+"""
+Read config.yaml, check it against the schema below and fill in any defaults.
+
+Importing and running the YAML parser is a good part of the start-up time of the
+short-lived scripts on a Pi Zero, and the config hardly ever changes. So the checked
+config is saved next to the file as a JSON snapshot, keyed on the file's modification time
+and size (and, if those have changed, a hash of its contents), and get_config() just
+loads the snapshot whenever the file is the same as last time. A long-running process
+can watch config_stamp() to notice the file being edited and reload it.
+"""
+
+import os
+import io
+import json
+
+# Blinkt! defaults
+DEFAULT_BRIGHTNESS = 10
+DEFAULT_SLOTSPERPIXEL = 1
+DEFAULT_ANIMATION = 'none'
+DEFAULT_TRANSITIONSECONDS = 2
+
+# Retention defaults
+DEFAULT_RAWDAYS = 3
+DEFAULT_HOURLYDAYS = 90
+DEFAULT_DAILYDAYS = 366
+DEFAULT_PRUNEEVERYHOURS = 24
+
+# Metrics defaults
+DEFAULT_LOGFILE = 'eco_metrics.log'
+DEFAULT_LOGMAXKB = 1024
+DEFAULT_LOGBACKUPS = 3
+
+# Inky pHAT defaults
+DEFAULT_ORIENTATION = 'standard'
+DEFAULT_HIGHPRICE = 30.0
+DEFAULT_HIGHINTENSITY = 200
+DEFAULT_LOWSLOTDURATION = 3
+DEFAULT_DATADURATION = 24
+DEFAULT_COUNTDOWNSTEP = 1
+DEFAULT_CLEARCYCLES = 1
+
+# the checked config is saved as e.g. config.yaml.cache
+SNAPSHOT_SUFFIX = '.cache'
+SNAPSHOT_VERSION = 2 # change this to throw away old snapshots
+
+# the code a snapshot depends on: this file's checks and defaults, and eco_blinkt's
+# colour tables, which are saved in it
+SNAPSHOT_SOURCES = (__file__, os.path.join(os.path.dirname(__file__), 'eco_blinkt.py'))
+
+class Option:
+    """One setting in a section of the config: the types it may be and either the range
+    it must be in or the values it may take. A setting that's missing gets its default.
+    One that's out of range is reported and gets its default too, but one that isn't
+    one of its choices stops us, as there's no telling what was meant."""
+
+    __slots__ = ('section', 'key', 'types', 'default', 'low', 'high', 'step', 'choices', 'rule')
+
+    def __init__(self, section: str, key: str, types: tuple, default, low=None, high=None,
+                 step=None, choices: tuple = None, rule: str = ''):
+        self.section = section
+        self.key = key
+        self.types = types
+        self.default = default
+        self.low = low
+        self.high = high
+        self.step = step
+        self.choices = choices
+        self.rule = rule
+
+    def valid(self, value) -> bool:
+        """Whether a value from the config file is allowed for this setting."""
+        if isinstance(value, bool) or not isinstance(value, self.types):
+            return False
+        if self.choices is not None:
+            return value in self.choices
+        if not self.low <= value <= self.high:
+            return False
+        return self.step is None or value % self.step == 0
+
+    def check(self, config: dict, filename: str):
+        """Check the setting in a config, replacing it with the default if need be."""
+        if not isinstance(config.get(self.section), dict):
+            config[self.section] = {}
+        section = config[self.section]
+        value = section.get(self.key)
+
+        if value is None:
+            section[self.key] = self.default
+        elif not self.valid(value):
+            if self.choices is not None:
+                raise SystemExit('Error: Unknown ' + self.key + ' found in ' + filename + ': ' +
+                                 str(value) + ' (must be one of ' + ', '.join(self.choices) + ')')
+            print('Misconfigured ' + self.key + ': ' + str(value) + ' (must be ' + self.rule +
+                  '). Using default of ' + str(self.default) + '.')
+            section[self.key] = self.default
+
+# the config section for each display type
+DISPLAY_SECTIONS = {'blinkt': 'Blinkt', 'inkyphat': 'InkyPHAT'}
+
+# every setting we check, by config section
+SCHEMA = {
+    'Retention': (
+        Option('Retention', 'RawDays', (int,), DEFAULT_RAWDAYS, 1, 60,
+               rule='a whole number of days between 1 and 60'),
+        Option('Retention', 'HourlyDays', (int,), DEFAULT_HOURLYDAYS, 1, 3660,
+               rule='a whole number of days between 1 and 3660'),
+        Option('Retention', 'DailyDays', (int,), DEFAULT_DAILYDAYS, 1, 3660,
+               rule='a whole number of days between 1 and 3660'),
+        Option('Retention', 'PruneEveryHours', (int,), DEFAULT_PRUNEEVERYHOURS, 1, 168,
+               rule='a whole number of hours between 1 and 168'),
+    ),
+    'Metrics': (
+        Option('Metrics', 'LogMaxKB', (int,), DEFAULT_LOGMAXKB, 16, 102400,
+               rule='a whole number of KB between 16 and 102400'),
+        Option('Metrics', 'LogBackups', (int,), DEFAULT_LOGBACKUPS, 0, 20,
+               rule='a whole number between 0 and 20'),
+    ),
+    'Blinkt': (
+        Option('Blinkt', 'Brightness', (int,), DEFAULT_BRIGHTNESS, 5, 100,
+               rule='a whole number between 5 and 100'),
+        Option('Blinkt', 'SlotsPerPixel', (int,), DEFAULT_SLOTSPERPIXEL, 1, 12,
+               rule='a whole number between 1 and 12'),
+        Option('Blinkt', 'Animation', (str,), DEFAULT_ANIMATION, choices=('none', 'pulse')),
+        Option('Blinkt', 'TransitionSeconds', (int, float), DEFAULT_TRANSITIONSECONDS, 0, 10,
+               rule='between 0 and 10 seconds'),
+    ),
+    'InkyPHAT': (
+        Option('InkyPHAT', 'DisplayOrientation', (str,), DEFAULT_ORIENTATION,
+               choices=('standard', 'inverted')),
+        Option('InkyPHAT', 'HighPrice', (int, float), DEFAULT_HIGHPRICE, 0, 35,
+               rule='between 0 and 35p'),
+        Option('InkyPHAT', 'HighIntensity', (int, float), DEFAULT_HIGHINTENSITY, 0, 1000,
+               rule='between 0 and 1000g'),
+        Option('InkyPHAT', 'LowSlotDuration', (int, float), DEFAULT_LOWSLOTDURATION, 0.5, 6,
+               step=0.5, rule='between 0.5 and 6 hours in half hour increments'),
+        Option('InkyPHAT', 'DataDuration', (int,), DEFAULT_DATADURATION, 12, 48,
+               rule='a whole number of hours between 12 and 48'),
+        Option('InkyPHAT', 'CountdownStep', (int,), DEFAULT_COUNTDOWNSTEP, 1, 30,
+               rule='a whole number of minutes between 1 and 30'),
+        Option('InkyPHAT', 'ClearCycles', (int,), DEFAULT_CLEARCYCLES, 1, 10,
+               rule='a whole number between 1 and 10'),
+    ),
+}
+
+def deep_get(this_dict: dict, keys: str, default=None):
+    """
+    Example:
+        this_dict = {'meta': {'status': 'OK', 'status_code': 200}}
+        deep_get(this_dict, ['meta', 'status_code'])          # => 200
+        deep_get(this_dict, ['garbage', 'status_code'])       # => None
+        deep_get(this_dict, ['meta', 'garbage'], default='-') # => '-'
+    """
+    assert isinstance(keys, list)
+    if this_dict is None:
+        return default
+    if not keys:
+        return this_dict
+    return deep_get(this_dict.get(keys[0]), keys[1:], default)
+
+def check_config(_config: dict, filename: str) -> dict:
+    """
+    Do some basic checks that a freshly read config has what we need.
+    If not, set sensible defaults or bail out.
+    """
+
+    if not isinstance(_config, dict) or 'DisplayType' not in _config:
+        raise SystemExit('Error: DisplayType not found in ' + filename)
+
+    if _config['DisplayType'] not in DISPLAY_SECTIONS:
+        raise SystemExit('Error: unknown DisplayType ' + str(_config['DisplayType']) +
+                         ' in ' + filename)
+
+    if _config['DisplayType'] == 'blinkt':
+        print('Blinkt! display selected.')
+
+        for option in SCHEMA['Blinkt']:
+            option.check(_config, filename)
+
+        if len(deep_get(_config, ['Blinkt', 'Colours']) or {}) < 2:
+            raise SystemExit('Error: Less than two colour levels found in ' + filename)
+
+        import eco_blinkt
+
+        # sorted, checked lookup tables for each kind of value, so the display code can
+        # find a value's colour with a binary search
+        try:
+            _config['Blinkt']['ColourTables'] = eco_blinkt.compile_colour_tables(
+                _config['Blinkt']['Colours'])
+        except ValueError as colour_err:
+            raise SystemExit('Error in Blinkt! colours in ' + filename + ': ' +
+                             str(colour_err)) from colour_err
+
+    elif _config['DisplayType'] == 'inkyphat':
+        print('Inky pHAT display selected.')
+
+        for option in SCHEMA['InkyPHAT']:
+            option.check(_config, filename)
+        print(_config['InkyPHAT']['DisplayOrientation'].capitalize() + ' display orientation.')
+
+        clear_times = []
+        for clear_at in deep_get(_config, ['InkyPHAT', 'ClearAt']) or []:
+            try:
+                hour, minute = (int(part) for part in str(clear_at).split(':'))
+                if not (0 <= hour < 24 and 0 <= minute < 60):
+                    raise ValueError
+            except ValueError as time_err:
+                raise SystemExit('Error: ClearAt times must be quoted "HH:MM" 24 hour times, found ' +
+                                 str(clear_at) + ' in ' + filename) from time_err
+            clear_times.append((hour, minute))
+        _config['InkyPHAT']['ClearAt'] = clear_times
+
+    if 'Mode' not in _config:
+        raise SystemExit('Error: Mode not found in ' + filename)
+
+    if _config['Mode'] == 'agile_import':
+        print('Working in Octopus Agile import mode.')
+
+        if 'AgileCap' not in _config:
+            raise SystemExit('Error: Agile cap not found in ' + filename)
+
+        if _config['AgileCap'] == 35:
+            print('Agile version set: 35p cap (pre July 2022)')
+        elif _config['AgileCap'] == 55:
+            print('Agile version set: 55p cap (July 2022 onwards)')
+        elif _config['AgileCap'] == 78:
+            print('Agile version set: 78p cap (August 2022 onwards)')
+        elif _config['AgileCap'] == 100:
+            print('Agile version set: £1 cap, new formula (October 2022 only)')
+        elif _config['AgileCap'] == 101:
+            print('Agile version set: £1 cap, new-new formula (current)')
+        else:
+            raise SystemExit('Error: Agile cap of ' + str(_config['AgileCap']) + ' refers to an unknown tariff.')
+
+    elif _config['Mode'] == 'agile_export':
+        print('Working in Octopus Agile export mode.')
+    elif _config['Mode'] == 'carbon':
+        print('Working in carbon intensity mode.')
+    elif _config['Mode'] == 'tracker':
+        print('Working in Octopus Tracker mode.')
+    else:
+        raise SystemExit('Error: Unknown mode found in ' + filename + ': ' + str(_config['Mode']))
+
+    if 'DNORegion' not in _config:
+        raise SystemExit('Error: DNORegion not found in ' + filename)
+
+    if 'DataServer' in _config:
+        server = str(_config['DataServer'])
+        if not server.startswith(('http://', 'unix:')):
+            raise SystemExit('Error: DataServer must be http://host:port or unix:/path/to/socket, '
+                             'found ' + server + ' in ' + filename)
+        _config['DataServer'] = server
+
+    for option in SCHEMA['Retention']:
+        option.check(_config, filename)
+
+    retention = _config['Retention']
+    if not retention['RawDays'] <= retention['HourlyDays'] <= retention['DailyDays']:
+        raise SystemExit('Error: Retention must keep hourly data at least as long as half '
+                         'hourly data (RawDays), and daily data at least as long as hourly '
+                         'data (HourlyDays), in ' + filename)
+
+    for option in SCHEMA['Metrics']:
+        option.check(_config, filename)
+
+    metrics = _config['Metrics']
+    if metrics.get('LogFile') is None:
+        metrics['LogFile'] = DEFAULT_LOGFILE
+    for key in ('LogFile', 'TextfileDir'):
+        if key in metrics and not isinstance(metrics[key], str):
+            raise SystemExit('Error: Metrics ' + key + ' must be a file name, found ' +
+                             str(metrics[key]) + ' in ' + filename)
+
+    if _config['DisplayType'] == 'blinkt':
+        import eco_blinkt # pylint: disable=reimported
+
+        if _config['Mode'] in eco_blinkt.MODES:
+            data_name = eco_blinkt.MODES[_config['Mode']][2]
+            if data_name not in _config['Blinkt']['ColourTables']:
+                raise SystemExit('Error: every Blinkt! colour level needs a value for ' +
+                                 data_name + ' in ' + _config['Mode'] + ' mode, in ' + filename)
+
+    if _config['DisplayType'] == 'inkyphat':
+        # the one threshold the Inky pHAT colours values by, for this mode
+        if _config['Mode'] == 'carbon':
+            _config['InkyPHAT']['HighValue'] = _config['InkyPHAT']['HighIntensity']
+        else:
+            _config['InkyPHAT']['HighValue'] = _config['InkyPHAT']['HighPrice']
+
+    return _config
+
+def compile_config(filename: str, text: bytes) -> tuple:
+    """Parse and check the contents of a config file. Returns the config and
+    everything checking it printed, so that can be printed again whenever the
+    snapshot is used instead."""
+
+    import contextlib
+    import yaml
+
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            try:
+                _config = yaml.safe_load(text)
+            except yaml.YAMLError as config_err:
+                raise SystemExit('Error reading configuration: ' + str(config_err)) from config_err
+            _config = check_config(_config, filename)
+    finally:
+        print(messages.getvalue(), end='')
+
+    return _config, messages.getvalue()
+
+def config_stamp(filename: str):
+    """Something that changes whenever the config file does - its modification time
+    and size - or None if it can't be found."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def snapshot_key() -> tuple:
+    """What a snapshot was made by: if any of SNAPSHOT_SOURCES has changed since, the
+    checks, defaults or colour tables may have too, so the snapshot is no good."""
+    return (SNAPSHOT_VERSION,) + tuple(os.stat(source).st_mtime_ns for source in SNAPSHOT_SOURCES)
+
+def load_snapshot(filename: str):
+    """The saved snapshot for a config file, or None if there isn't a usable one. It's
+    plain JSON, so reading it can't run anything, whoever wrote it."""
+    try:
+        with open(filename + SNAPSHOT_SUFFIX, encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        # missing or half written
+        return None
+    if (not isinstance(snapshot, dict) or snapshot.get('key') != list(snapshot_key()) or
+            not {'stamp', 'sha256', 'config', 'messages'} <= snapshot.keys() or
+            not isinstance(snapshot['config'], dict)):
+        return None
+
+    # the two things JSON can't keep as they were
+    _config = snapshot['config']
+    if _config.get('DisplayType') == 'inkyphat':
+        _config['InkyPHAT']['ClearAt'] = [tuple(clear_at) for clear_at in
+                                          _config['InkyPHAT']['ClearAt']]
+    if deep_get(_config, ['Blinkt', 'ColourTables']):
+        import eco_blinkt
+        _config['Blinkt']['ColourTables'] = {
+            data_name: eco_blinkt.ColourTable([(threshold, name, tuple(rgb))
+                                               for threshold, name, rgb in levels])
+            for data_name, levels in _config['Blinkt']['ColourTables'].items()}
+
+    snapshot['stamp'] = tuple(snapshot['stamp'])
+    return snapshot
+
+def save_snapshot(filename: str, snapshot: dict):
+    """Save a snapshot for a config file, if we can write next to it."""
+    _config = snapshot['config']
+    if deep_get(_config, ['Blinkt', 'ColourTables']):
+        # each table as its levels
+        _config = dict(_config, Blinkt=dict(_config['Blinkt'], ColourTables={
+            data_name: table.levels for data_name, table in _config['Blinkt']['ColourTables'].items()}))
+
+    snapshot_file = filename + SNAPSHOT_SUFFIX
+    try:
+        with open(snapshot_file + '.tmp', 'w', encoding='utf-8') as tmp_file:
+            json.dump(dict(snapshot, config=_config), tmp_file)
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+    except OSError as snapshot_err:
+        print('Unable to save ' + snapshot_file + ': ' + str(snapshot_err))
+
+def get_config(filename: str) -> dict:
+    """
+    Read config file and do some basic checks that we have what we need.
+    If not, set sensible defaults or bail out. Uses the saved snapshot if the
+    file hasn't changed since it was last checked.
+    """
+    stamp = config_stamp(filename)
+    if stamp is None:
+        raise SystemExit('Unable to find ' + filename)
+
+    snapshot = load_snapshot(filename)
+    if snapshot is not None and snapshot['stamp'] == stamp:
+        print(snapshot['messages'], end='')
+        return snapshot['config']
+
+    import hashlib
+
+    try:
+        with open(filename, 'rb') as config_file:
+            text = config_file.read()
+    except OSError as no_config:
+        raise SystemExit('Unable to read ' + filename) from no_config
+    digest = hashlib.sha256(text).hexdigest()
+
+    if snapshot is not None and snapshot['sha256'] == digest:
+        # touched, copied or saved without changes
+        print(snapshot['messages'], end='')
+    else:
+        _config, messages = compile_config(filename, text)
+        snapshot = {'key': snapshot_key(), 'sha256': digest, 'config': _config,
+                    'messages': messages}
+
+    snapshot['stamp'] = stamp
+    save_snapshot(filename, snapshot)
+    return snapshot['config']
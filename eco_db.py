@@ -0,0 +1,217 @@
+"""
+Open the SQLite database shared by store_data.py and update_display.py, and keep
+its schema up to date.
+
+The schema version is kept in SQLite's user_version. Each entry in MIGRATIONS takes
+the database from one version to the next, so existing databases are brought up to
+date automatically the first time they are opened by a newer version of this code.
+A migration is either a string of SQL or a function taking (conn, config).
+"""
+
+import sqlite3
+import eco_series
+
+DB_FILE = 'eco_indicator.sqlite'
+
+MIGRATIONS = [
+    # 0 -> 1: slot times as integer UNIX timestamps instead of text, in a WITHOUT ROWID
+    # table so rows are stored in time order, with a partial index per measure so
+    # "the slots we have prices for" doesn't need to look at the other rows at all.
+    # Databases from before versioning (or brand new ones) start here.
+    '''
+    CREATE TABLE IF NOT EXISTS eco (valid_from STRING PRIMARY KEY ON CONFLICT REPLACE,
+        value_inc_vat REAL, intensity REAL, gas_value_inc_vat REAL);
+    CREATE TABLE eco_new (valid_from INTEGER PRIMARY KEY NOT NULL,
+        value_inc_vat REAL, intensity REAL, gas_value_inc_vat REAL) WITHOUT ROWID;
+    INSERT INTO eco_new SELECT CAST(strftime('%s', valid_from) AS INTEGER),
+        value_inc_vat, intensity, gas_value_inc_vat FROM eco WHERE valid_from IS NOT NULL;
+    DROP TABLE eco;
+    ALTER TABLE eco_new RENAME TO eco;
+    CREATE INDEX eco_value_inc_vat ON eco(valid_from) WHERE value_inc_vat IS NOT NULL;
+    CREATE INDEX eco_intensity ON eco(valid_from) WHERE intensity IS NOT NULL;
+    CREATE INDEX eco_gas_value_inc_vat ON eco(valid_from) WHERE gas_value_inc_vat IS NOT NULL;
+    CREATE TABLE IF NOT EXISTS http_cache (uri TEXT PRIMARY KEY, etag TEXT,
+        last_modified TEXT, body TEXT, fetched_at INTEGER);
+    CREATE TABLE IF NOT EXISTS fetch_retries (upstream TEXT PRIMARY KEY,
+        failures INTEGER, next_attempt INTEGER, last_error TEXT);
+    ''',
+]
+
+# where each role's values used to live in the single-series eco table
+LEGACY_COLUMNS = {'electricity': 'value_inc_vat', 'carbon': 'intensity',
+                  'gas': 'gas_value_inc_vat'}
+
+def migrate_to_series(conn: sqlite3.Connection, config: dict):
+    """1 -> 2: one row per (series, slot) instead of one column per measure, so that
+    any number of tariffs and regions can share the database. The old table only ever
+    held whatever this indicator was configured for, so that's where its data goes -
+    which means that without a config there's no telling, and its data would be lost."""
+
+    if config is None and conn.execute('SELECT 1 FROM eco LIMIT 1').fetchone() is not None:
+        raise SystemExit('Error: the database holds data from an old version of this '
+                         'software - run store_data.py with your config to update it.')
+
+    # not executescript(), that would commit the transaction we're in
+    conn.execute('CREATE TABLE series (series_id INTEGER PRIMARY KEY, tariff TEXT NOT NULL, '
+                 'region TEXT NOT NULL, measure TEXT NOT NULL, UNIQUE (tariff, region, measure))')
+    conn.execute('CREATE TABLE readings (series_id INTEGER NOT NULL REFERENCES series, '
+                 'valid_from INTEGER NOT NULL, value REAL NOT NULL, '
+                 'PRIMARY KEY (series_id, valid_from)) WITHOUT ROWID')
+    conn.execute('CREATE INDEX readings_valid_from ON readings(valid_from)')
+
+    if config is not None:
+        for series in eco_series.display_series(config):
+            column = LEGACY_COLUMNS[series['role']]
+            conn.execute('INSERT INTO readings SELECT ?, valid_from, ' + column + ' FROM eco '
+                         'WHERE ' + column + ' IS NOT NULL', (series_id(conn, series),))
+
+    conn.execute('DROP TABLE eco')
+
+MIGRATIONS.append(migrate_to_series)
+
+MIGRATIONS.append(
+    # 2 -> 3: long-term history. Half hour slots older than Retention: RawDays are rolled
+    # up into hourly and then daily min/mean/max tables, so a year of history doesn't
+    # slow down the readings table that every run uses. 'maintenance' records when
+    # housekeeping like this was last done. Each rolled-up row keeps a mask of the half
+    # hours of the day it has counted, one bit each from 00:00 UTC, so a slot stored again
+    # after it's been rolled up isn't counted twice.
+    '''
+    CREATE TABLE readings_hourly (series_id INTEGER NOT NULL REFERENCES series,
+        period_start INTEGER NOT NULL, slots INTEGER NOT NULL, min_value REAL NOT NULL,
+        mean_value REAL NOT NULL, max_value REAL NOT NULL, slot_mask INTEGER NOT NULL,
+        PRIMARY KEY (series_id, period_start)) WITHOUT ROWID;
+    CREATE INDEX readings_hourly_period_start ON readings_hourly(period_start);
+    CREATE TABLE readings_daily (series_id INTEGER NOT NULL REFERENCES series,
+        period_start INTEGER NOT NULL, slots INTEGER NOT NULL, min_value REAL NOT NULL,
+        mean_value REAL NOT NULL, max_value REAL NOT NULL, slot_mask INTEGER NOT NULL,
+        PRIMARY KEY (series_id, period_start)) WITHOUT ROWID;
+    CREATE INDEX readings_daily_period_start ON readings_daily(period_start);
+    CREATE TABLE maintenance (task TEXT PRIMARY KEY, last_run INTEGER NOT NULL);
+    ''')
+
+MIGRATIONS.append(
+    # 3 -> 4: where each backfill.py run has got to - the next page to fetch for a
+    # series and date range - so an interrupted backfill can carry on where it stopped.
+    '''
+    CREATE TABLE backfill_progress (series_id INTEGER NOT NULL REFERENCES series,
+        period_from INTEGER NOT NULL, period_to INTEGER NOT NULL, next_uri TEXT NOT NULL,
+        PRIMARY KEY (series_id, period_from, period_to));
+    ''')
+
+MIGRATIONS.append(
+    # 4 -> 5: what the Inky pHAT shows about each stretch of upcoming slots - where its
+    # lowest and highest slots and windows are, and its average - worked out by
+    # store_data.py when new data arrives rather than on every redraw. Each summary is
+    # for a series, the slot the stretch starts at, the most slots it covers and how
+    # many slots long its windows are; 'count' and 'last_start' say which slots it was
+    # worked out from, so a display can tell that it's still about the slots it has.
+    '''
+    CREATE TABLE slot_summaries (series_id INTEGER NOT NULL REFERENCES series,
+        horizon_start INTEGER NOT NULL, slots INTEGER NOT NULL, window_slots INTEGER NOT NULL,
+        count INTEGER NOT NULL, last_start INTEGER NOT NULL,
+        min_index INTEGER NOT NULL, max_index INTEGER NOT NULL,
+        low_start INTEGER NOT NULL, low_mean REAL NOT NULL,
+        high_start INTEGER NOT NULL, high_mean REAL NOT NULL, trimmed_mean REAL NOT NULL,
+        PRIMARY KEY (series_id, horizon_start, slots, window_slots)) WITHOUT ROWID;
+    ''')
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn: sqlite3.Connection, config: dict = None):
+    """Bring the schema up to SCHEMA_VERSION, one migration at a time. Each migration
+    runs in its own transaction along with the version bump, so an interrupted
+    migration is simply run again next time."""
+
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+    if version > SCHEMA_VERSION:
+        raise SystemExit('Error: the database is from a newer version of this software '
+                         '(schema ' + str(version) + ', we understand ' +
+                         str(SCHEMA_VERSION) + ').')
+
+    for new_version in range(version + 1, SCHEMA_VERSION + 1):
+        print('Updating database to schema version ' + str(new_version) + '...')
+        migration = MIGRATIONS[new_version - 1]
+
+        if isinstance(migration, str):
+            conn.executescript('BEGIN IMMEDIATE;' + migration +
+                               'PRAGMA user_version = ' + str(new_version) + ';COMMIT;')
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn, config)
+            conn.execute('PRAGMA user_version = ' + str(new_version))
+            conn.commit()
+        except sqlite3.Error as error:
+            conn.rollback()
+            raise SystemExit('Error updating the database: ' + str(error)) from error
+        except SystemExit:
+            conn.rollback()
+            raise
+
+def series_id(conn: sqlite3.Connection, series: dict, create: bool = True):
+    """Look up the id a series is stored under, adding it if it's new (unless 'create'
+    is False, in which case None is returned for a series we've never stored)."""
+    key = eco_series.series_key(series)
+    row = conn.execute('SELECT series_id FROM series WHERE tariff = ? AND region = ? '
+                       'AND measure = ?', key).fetchone()
+    if row is not None:
+        return row[0]
+    if not create:
+        return None
+    return conn.execute('INSERT INTO series(tariff, region, measure) VALUES (?, ?, ?)',
+                        key).lastrowid
+
+def open_database(create: bool = True, config: dict = None) -> sqlite3.Connection:
+    """Connect to the database in the current directory, migrating it if needed.
+    If 'create' is False, a missing database is an error rather than created.
+    The config is used to work out which series data from old versions belongs to."""
+
+    try:
+        # connect to the database in rw mode so we can catch the error if it doesn't exist
+        # (urllib.request is slow to import, and this is the only thing we need it for)
+        from urllib.request import pathname2url
+        DB_URI = 'file:{}?mode=rw'.format(pathname2url(DB_FILE))
+        conn = sqlite3.connect(DB_URI, uri=True)
+        print('Connected to database...')
+
+    except sqlite3.OperationalError as error:
+        if not create:
+            # handle missing database case
+            raise SystemExit('Database not found - you need to run store_data.py first.') from error
+        print('No database found. Creating a new one...')
+        conn = sqlite3.connect(DB_FILE)
+
+    # write-ahead logging lets the display read while new data is being stored,
+    # and needs fewer writes to the SD card
+    conn.execute('PRAGMA journal_mode=WAL')
+    migrate(conn, config)
+
+    return conn
+
+def open_read_only() -> sqlite3.Connection:
+    """Connect to the existing database just to read from it, as the display does. It's
+    opened read-only and with query_only set, so reading never takes a write lock or
+    touches the file. Only a writer can migrate the schema, so it must be up to date."""
+
+    from urllib.request import pathname2url
+
+    try:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(DB_FILE)), uri=True)
+        conn.execute('PRAGMA query_only = ON')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+    except sqlite3.OperationalError as error:
+        raise SystemExit('Database not found - you need to run store_data.py first.') from error
+
+    if version != SCHEMA_VERSION:
+        conn.close()
+        if version > SCHEMA_VERSION:
+            raise SystemExit('Error: the database is from a newer version of this software '
+                             '(schema ' + str(version) + ', we understand ' +
+                             str(SCHEMA_VERSION) + ').')
+        raise SystemExit('The database needs updating - run store_data.py first.')
+
+    print('Connected to database (read only)...')
+    return conn
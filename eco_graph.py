@@ -0,0 +1,96 @@
+"""
+Draw the Inky pHAT's graph straight into a buffer of palette indices.
+
+Drawing a bar chart with PIL means a draw.rectangle() and two draw.line() calls per
+slot, and a draw.line() per dash of the average line, each of which has to be
+parsed and clipped. Here the bar for each pixel column is worked out in one go and
+every column is filled with a single strided slice assignment into a bytearray, which
+then becomes the PIL image (Image.frombuffer) for the text to be drawn on.
+
+The pixels are exactly the ones PIL drew: coordinates are truncated to whole pixels
+the way PIL truncates them, and both ends of every bar and line are included.
+"""
+
+class Canvas:
+    """A palette image as a bytearray, one byte per pixel, row by row."""
+
+    __slots__ = ('width', 'height', 'pixels')
+
+    def __init__(self, width: int, height: int, colour: int = 0):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray([colour]) * (width * height)
+
+    def hline(self, x_start: int, x_end: int, y_pos: int, colour: int):
+        """A horizontal line from x_start to x_end inclusive, clipped to the canvas."""
+        if not 0 <= y_pos < self.height:
+            return
+        x_start = max(x_start, 0)
+        x_end = min(x_end, self.width - 1)
+        if x_start <= x_end:
+            row = y_pos * self.width
+            self.pixels[row + x_start:row + x_end + 1] = bytes([colour]) * (x_end - x_start + 1)
+
+    def vline(self, x_pos: int, y_start: int, y_end: int, colour: int):
+        """A vertical line between y_start and y_end inclusive (either way round),
+        clipped to the canvas."""
+        if not 0 <= x_pos < self.width:
+            return
+        y_start, y_end = max(min(y_start, y_end), 0), min(max(y_start, y_end), self.height - 1)
+        if y_start <= y_end:
+            self.pixels[y_start * self.width + x_pos:y_end * self.width + x_pos + 1:self.width] = (
+                bytes([colour]) * (y_end - y_start + 1))
+
+    def image(self):
+        """The canvas as a PIL palette ("P") image, sharing our buffer rather than
+        copying it. PIL copies it the first time the image is drawn on."""
+        from PIL import Image
+        return Image.frombuffer('P', (self.width, self.height), self.pixels, 'raw', 'P', 0, 1)
+
+    def draw_over(self, image):
+        """Carry on drawing over 'image', e.g. one from image() that PIL has since
+        drawn text on."""
+        self.pixels[:] = image.tobytes()
+
+def bar_edges(slots: int, x_unit: float) -> list:
+    """The pixel column each slot's bar starts at, and then the one the last bar ends
+    at, when each slot is x_unit pixels wide. This needn't be a whole number: with 48
+    hours of slots a bar may be less than two pixels wide."""
+    return [int(slot * x_unit) for slot in range(slots + 1)]
+
+def column_slots(edges: list) -> list:
+    """Which slot each pixel column shows. Each bar covers the columns from its own
+    edge to the next one inclusive, so it shares its last column with the next bar,
+    which is drawn over it."""
+    slot_for_column = []
+    for slot in range(len(edges) - 1):
+        slot_for_column.extend([slot] * (edges[slot + 1] - edges[slot]))
+    if len(edges) > 1:
+        slot_for_column.append(len(edges) - 2) # nothing is drawn over the last bar
+    return slot_for_column
+
+def bar_tops(values, y_unit: float, bottom: float) -> list:
+    """The y position of the top of each value's bar, value * y_unit pixels above
+    'bottom' (or below it, for negative values)."""
+    return [int(bottom - value * y_unit) for value in values]
+
+def fill_bars(canvas: Canvas, edges: list, tops: list, bottom: int, colours: bytes):
+    """Fill in the bars, one pixel column at a time from the left: each column is the
+    colour of its slot (see column_slots()) between that slot's top and 'bottom'."""
+    for column, slot in enumerate(column_slots(edges)):
+        canvas.vline(column, tops[slot], bottom, colours[slot])
+
+def outline_bars(canvas: Canvas, edges: list, tops: list, colour: int):
+    """Trace the tops of the bars as a stepped line: across the top of each bar, and
+    then up or down to the next one at the edge they share."""
+    for slot in range(len(edges) - 1):
+        canvas.hline(edges[slot], edges[slot + 1], tops[slot], colour)
+        if slot > 0:
+            canvas.vline(edges[slot], tops[slot - 1], tops[slot], colour)
+
+def dashed_hline(canvas: Canvas, x_start: int, x_end: int, y_pos: int, colour: int,
+                 dash: int = 3, period: int = 6):
+    """A dashed horizontal line: a dash 'dash' pixels long starting at x_start and
+    then every 'period' pixels, up to (but not starting at or after) x_end."""
+    for x_pos in range(x_start, x_end, period):
+        canvas.hline(x_pos, x_pos + dash - 1, y_pos, colour)
@@ -2,21 +2,27 @@
 Functions to support operation of the Blinkt and Inky displays
 """
 
-import yaml
-
-# Blinkt! defaults
-DEFAULT_BRIGHTNESS = 10
-DEFAULT_SLOTSPERPIXEL = 1
-
-# Inky pHAT defaults
-DEFAULT_HIGHPRICE = 30.0
-DEFAULT_LOWSLOTDURATION = 3
-DEFAULT_DATADURATION = 24
-
-def update_blinkt(conf: dict, blinkt_data: dict, demo: bool):
+import os
+import time
+import hashlib
+import eco_stats
+import eco_blinkt
+import eco_layout
+import eco_graph
+import eco_timing
+
+# a fingerprint of what's on the Inky pHAT, so we can tell when there's nothing new to show
+FRAME_HASH_FILE = 'last_frame.sha256'
+
+def update_blinkt(conf: dict, blinkt_data: dict, demo: bool,
+                  animator: eco_blinkt.BlinktAnimator = None):
     """Recieve a parsed configuration file and price data from the database,
     as well as a flag indicating demo mode, and then update the Blinkt!
-    display appropriately."""
+    display appropriately. A long-running process passes in its BlinktAnimator,
+    which is given the new data to fade to rather than showing it straight away.
+
+    Notes: dict 'blinkt_data' as passed from update_display.py maps each role
+    ('electricity' or 'carbon') to an eco_slots.SlotSeries in time order."""
 
     import blinkt
 
@@ -33,88 +39,101 @@ def update_blinkt(conf: dict, blinkt_data: dict, demo: bool):
         blinkt.set_clear_on_exit(False)
         blinkt.show()
 
-    else:
-
-        if conf['Mode'] == "carbon":
-            tuple_idx = 2
-            short_unit = "g"
-            data_name = "Carbon"
-
-        if conf['Mode'] == "agile_import":
-            tuple_idx = 1
-            short_unit = "p"
-            data_name = "Price"
+    elif animator is not None:
+        # a long-running process: it carries on animating the new data in its own time
+        animator.set_values(blinkt_data[animator.role].values, time.time())
 
-        if conf['Mode'] == "agile_export":
-            tuple_idx = 1
-            short_unit = "p"
-            data_name = "Export"
+    else:
+        animator = eco_blinkt.BlinktAnimator(conf, blinkt, animate=False)
+        animator.set_values(blinkt_data[animator.role].values, time.time())
 
-        if conf['Mode'] == "tracker":
-            tuple_idx = 1
-            short_unit = "p"
-            data_name = "Tracker"
-            raise SystemExit("Tracker not yet implemented on Blinkt!")
+        print("Setting display...")
+        with eco_timing.Span('render_blinkt'):
+            animator.frame(time.time())
 
-        slots_per_pixel = conf['Blinkt']['SlotsPerPixel']
+def get_inky_display():
+    """Check an Inky pHAT is attached and return a handle to it, detecting
+    the display type automatically."""
 
-        print("Displaying " + str(slots_per_pixel) + " slots per Blinkt! pixel.")
+    from inky.auto import auto
+    from inky.eeprom import read_eeprom
 
-        # group data into however many slots we are using per pixel
-        blinkt_data = [blinkt_data[i:i + slots_per_pixel] for i in range(0, len(blinkt_data), slots_per_pixel)]
+    inky_eeprom = read_eeprom()
 
-        # calculate the mean for the grouped data and replace the group with one list item
-        new_data = []
+    if inky_eeprom is None:
+        raise SystemExit("Error: Inky pHAT display not found")
 
-        for group in blinkt_data:
+    try:
+        # detect display type automatically
+        return auto(ask_user=False, verbose=True)
+    except TypeError as inky_version:
+        raise TypeError("You need to update the Inky library to >= v1.1.0") from inky_version
 
-            total_sum = sum(item[tuple_idx] for item in group)
-            mean = round(total_sum / len(group),1)
+def frame_hash(img, border=None) -> str:
+    """Fingerprint a finished frame: its size, every pixel's palette index and the
+    border colour, which between them are everything the display gets sent."""
+    digest = hashlib.sha256(repr((img.mode, img.size, border)).encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
 
-            first_item = list(group[0])
-            first_item[tuple_idx] = mean
+def show_frame(inky_display, img, border=None) -> bool:
+    """Send a frame to the Inky display and refresh it, unless it's identical to the
+    last frame we sent, in which case leave the panel alone: a refresh takes tens of
+    seconds, flickers and wears the panel. Returns whether the display was refreshed.
+    Delete FRAME_HASH_FILE to force the next frame to be shown regardless. A display
+    can keep its own hash file (or none at all) by setting 'frame_hash_file'."""
 
-            new_data.append([tuple(first_item)])
+    hash_file_name = getattr(inky_display, 'frame_hash_file', FRAME_HASH_FILE)
+    new_hash = frame_hash(img, border)
 
-        blinkt_data = new_data
+    try:
+        with open(hash_file_name, 'r') as hash_file:
+            last_hash = hash_file.read().strip()
+    except (OSError, TypeError):
+        last_hash = None
 
-        if len(blinkt_data) < 8:
-            print("Not enough data to fill the display - we will get dark pixels.")
+    if new_hash == last_hash:
+        print("Display already up to date, not refreshing it.")
+        return False
 
-        blinkt.clear()
-        i = 0
-        for row in blinkt_data:
-            for level, data in conf['Blinkt']['Colours'].items():
-                slot_data = row[0][tuple_idx]
-                if slot_data >= data[data_name]:
-                    print(str(i) + ': ' + str(slot_data) + short_unit + ' -> ' + data['Name'])
-                    blinkt.set_pixel(i, data['R'], data['G'], data['B'],
-                                     conf['Blinkt']['Brightness']/100)
-                    break
-            i += 1
-            if i == 8:
-                break
+    if border is not None:
+        inky_display.set_border(border)
+    inky_display.set_image(img)
+    inky_display.show()
 
-        print("Setting display...")
-        blinkt.set_clear_on_exit(False)
-        blinkt.show()
+    # only once it's actually on the panel, and atomically so a crash can't leave half a hash
+    if hash_file_name is not None:
+        with open(hash_file_name + '.new', 'w') as hash_file:
+            hash_file.write(new_hash + '\n')
+        os.replace(hash_file_name + '.new', hash_file_name)
+    return True
+
+def forget_frame(inky_display=None):
+    """Forget what's on the Inky display, e.g. after clearing it, so the next frame is
+    always shown. Uses the display's own hash file if it has one, as show_frame does."""
+    hash_file_name = getattr(inky_display, 'frame_hash_file', FRAME_HASH_FILE)
+    if hash_file_name is None:
+        return
+    try:
+        os.remove(hash_file_name)
+    except FileNotFoundError:
+        pass
 
-def update_inky_tracker(conf: dict, inky_data: dict, demo: bool):
+def update_inky_tracker(conf: dict, inky_data: dict, demo: bool, inky_display=None,
+                        clock=time.time, timer: eco_timing.PhaseTimer = None):
     """Recieve a parsed configuration file and price/carbon data from the database,
     as well as a flag indicating demo mode, and then update the Inky
-    display appropriately.
+    display appropriately. An existing display handle from get_inky_display()
+    may be passed in to save detecting the display again, and a PhaseTimer to
+    find out how long each part of drawing took.
 
-    Notes: list 'inky_data' as passed from update_display.py is an ordered
-    list of tuples. In each tuple, index [0] is the time in SQLite date
-    format, index [1] is the electricity price in p/kWh as a float, index [2]
-    is blank as it would be the carbon intensity, and index [3] is the gas price."""
+    Notes: dict 'inky_data' as passed from update_display.py maps 'electricity'
+    and 'gas' to an eco_slots.SlotSeries of daily prices in p/kWh, newest day
+    first. A day with no price yet has no value (see SlotSeries.has_value)."""
 
     from datetime import datetime
     from datetime import timedelta
-    from PIL import Image, ImageFont, ImageDraw
-    from font_roboto import RobotoMedium, RobotoBlack
-    from inky.auto import auto
-    from inky.eeprom import read_eeprom
+    from PIL import Image, ImageDraw
 
     def price_diff_to_symbol(price_today: float, price_tomorrow: float) -> tuple[str, int]:
 
@@ -137,37 +156,24 @@ def update_inky_tracker(conf: dict, inky_data: dict, demo: bool):
     if demo:
         raise SystemExit("Demo mode not implemented!")
 
-    inky_eeprom = read_eeprom()
+    if inky_display is None:
+        inky_display = get_inky_display()
 
-    if inky_eeprom is None:
-        raise SystemExit("Error: Inky pHAT display not found")
+    if timer is None:
+        timer = eco_timing.PhaseTimer()
 
-    try:
-        # detect display type automatically
-        inky_display = auto(ask_user=False, verbose=True)
-    except TypeError as inky_version:
-        raise TypeError("You need to update the Inky library to >= v1.1.0") from inky_version
+    layout = eco_layout.inky_layout(inky_display.resolution)
 
     img = Image.new("P", (inky_display.WIDTH, inky_display.HEIGHT))
     draw = ImageDraw.Draw(img)
 
-    # deal with scaling for newer SSD1608 pHATs
-    if inky_display.resolution == (250, 122):
-        font_scale_factor = 1.2
-        x_scale_factor = 1.25
-        y_scale_factor = 1.25
-
-    # original Inky pHAT
-    if inky_display.resolution == (212, 104):
-        font_scale_factor = 1
-        x_scale_factor = 1
-        y_scale_factor = 1
-
-    today = datetime.now().date()
+    today = datetime.fromtimestamp(clock()).date()
     print("Today is " + today.strftime("%a %-d %b %Y"))
 
-    tracker_latest_date = datetime.strptime(inky_data[0][0], "%Y-%m-%d %H:%M:%S") + timedelta(hours = 12)
-    tracker_latest_date = tracker_latest_date.date()
+    elec = inky_data['electricity']
+    gas = inky_data['gas']
+
+    tracker_latest_date = (elec.local_times[0] + timedelta(hours = 12)).date()
     datedif = tracker_latest_date - today
 
     check = 0 # 0 = nothing for tomorrow.
@@ -180,20 +186,20 @@ def update_inky_tracker(conf: dict, inky_data: dict, demo: bool):
 
     elif datedif.days == 0: # no database entry for today so no data yet at all
         print("We don't have any data for tomorrow yet.")
-        elec_tracker_price_today = inky_data[0][1]
-        gas_tracker_price_today = inky_data[0][3]
+        elec_tracker_price_today = elec.values[0]
+        gas_tracker_price_today = gas.values[0]
         check = 0
 
     elif datedif.days == 1: # there is either gas, electricity, or both.
-        elec_tracker_price_tomorrow = inky_data[0][1]
-        elec_tracker_price_today = inky_data[1][1]
-        gas_tracker_price_tomorrow = inky_data[0][3]
-        gas_tracker_price_today = inky_data[1][3]
+        elec_tracker_price_tomorrow = elec.values[0]
+        elec_tracker_price_today = elec.values[1]
+        gas_tracker_price_tomorrow = gas.values[0]
+        gas_tracker_price_today = gas.values[1]
 
-        if isinstance(elec_tracker_price_tomorrow, float):
+        if elec.has_value(0):
             check = check + 1
 
-        if isinstance(gas_tracker_price_tomorrow, float):
+        if gas.has_value(0):
             check = check + 2
 
         if check == 0:
@@ -202,321 +208,284 @@ def update_inky_tracker(conf: dict, inky_data: dict, demo: bool):
     else:
         raise SystemExit("Epic Fail. If we got here, mathematics itself is broken.")
 
+    timer.lap('data prep')
+
     # draw info and today's date
 
-    font = ImageFont.truetype(RobotoMedium, size=int(20 * font_scale_factor))
-    x_pos = 4 * x_scale_factor
-    y_pos = 0 * y_scale_factor
-    draw.text((x_pos, y_pos), "Gas", inky_display.BLACK, font)
-    x_pos = (inky_display.WIDTH) - (40 * x_scale_factor)
-    draw.text((x_pos, y_pos), "Elec", inky_display.BLACK, font)
+    font = layout.font('medium', 20)
+    draw.text((layout.gas_x, 0), "Gas", inky_display.BLACK, font)
+    draw.text((layout.elec_label_x, 0), "Elec", inky_display.BLACK, font)
 
-    font = ImageFont.truetype(RobotoBlack, size=int(15 * font_scale_factor))
+    font = layout.font('black', 15)
     date_string = today.strftime("%a %-d %b")
     width, height = draw.textsize(date_string, font)
     x_pos = (inky_display.WIDTH / 2) - (width / 2)
-    draw.text((x_pos, y_pos), date_string, inky_display.BLACK, font)
+    draw.text((x_pos, 0), date_string, inky_display.BLACK, font)
 
     # draw separator line
 
     x_pos = inky_display.WIDTH / 2
-    draw.line((x_pos, 20 * y_scale_factor, x_pos, inky_display.HEIGHT - 5),
+    draw.line((x_pos, layout.divider_top, x_pos, inky_display.HEIGHT - 5),
           fill=inky_display.BLACK, width=2)
 
     # draw today's prices
 
-    font = ImageFont.truetype(RobotoBlack, size=int(35 * font_scale_factor))
-    x_pos = 4 * x_scale_factor
-    y_pos = 20 * y_scale_factor
-    draw.text((x_pos, y_pos), "{:.1f}p".format(gas_tracker_price_today), inky_display.RED, font)
-    x_pos = inky_display.WIDTH - (95 * x_scale_factor)
-    draw.text((x_pos, y_pos), "{:.1f}p".format(elec_tracker_price_today), inky_display.RED, font)
+    font = layout.font('black', 35)
+    draw.text((layout.gas_x, layout.today_y), "{:.1f}p".format(gas_tracker_price_today),
+              inky_display.RED, font)
+    draw.text((layout.elec_x, layout.today_y), "{:.1f}p".format(elec_tracker_price_today),
+              inky_display.RED, font)
     print("Electricity Tracker price today: {:.2f}p".format(elec_tracker_price_today))
     print("Gas Tracker price today: {:.2f}p".format(gas_tracker_price_today))
 
     # draw "Tomorrow" labels
 
-    font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
-    x_pos = 4 * x_scale_factor
-    y_pos = 60 * y_scale_factor
-    draw.text((x_pos, y_pos), "Tomorrow:", inky_display.BLACK, font)
-    x_pos = inky_display.WIDTH - (95 * x_scale_factor)
-    draw.text((x_pos, y_pos), "Tomorrow:", inky_display.BLACK, font)
+    font = layout.font('medium', 15)
+    draw.text((layout.gas_x, layout.tomorrow_label_y), "Tomorrow:", inky_display.BLACK, font)
+    draw.text((layout.elec_x, layout.tomorrow_label_y), "Tomorrow:", inky_display.BLACK, font)
 
     # draw tomorrow's data or draw a placeholder
 
+    symbol_dx, symbol_dy = layout.symbol_offset
+
     if check == 1 or check == 3: # we have electricity data for tomorrow
-        font = ImageFont.truetype(RobotoMedium, size=int(20 * font_scale_factor))
-        x_pos = inky_display.WIDTH - (95 * x_scale_factor)
-        y_pos = 75 * y_scale_factor
-        draw.text((x_pos, y_pos), "{:.1f}p".format(elec_tracker_price_tomorrow), inky_display.BLACK, font)
+        x_pos = layout.elec_x
+        y_pos = layout.tomorrow_y
+        draw.text((x_pos, y_pos), "{:.1f}p".format(elec_tracker_price_tomorrow),
+                  inky_display.BLACK, layout.font('medium', 20))
         symbol, colour = price_diff_to_symbol(elec_tracker_price_today, elec_tracker_price_tomorrow)
-        font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
-        draw.text((x_pos + 60 * x_scale_factor, y_pos + 3 * y_scale_factor), symbol, colour, font)
+        draw.text((x_pos + symbol_dx, y_pos + symbol_dy), symbol, colour, layout.font('medium', 15))
         print("Electricity Tracker price tomorrow: {:.2f}p".format(elec_tracker_price_tomorrow))
 
     if check == 2 or check == 3: # we have gas data for tomorrow
-        font = ImageFont.truetype(RobotoMedium, size=int(20 * font_scale_factor))
-        x_pos = 4 * x_scale_factor
-        y_pos = 75 * y_scale_factor
-        draw.text((x_pos, y_pos), "{:.1f}p".format(gas_tracker_price_tomorrow), inky_display.BLACK, font)
+        x_pos = layout.gas_x
+        y_pos = layout.tomorrow_y
+        draw.text((x_pos, y_pos), "{:.1f}p".format(gas_tracker_price_tomorrow),
+                  inky_display.BLACK, layout.font('medium', 20))
         symbol, colour = price_diff_to_symbol(gas_tracker_price_today, gas_tracker_price_tomorrow)
-        font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
-        draw.text((x_pos + 60 * x_scale_factor, y_pos + 3 * y_scale_factor), symbol, colour, font)
+        draw.text((x_pos + symbol_dx, y_pos + symbol_dy), symbol, colour, layout.font('medium', 15))
         print("Gas Tracker price tomorrow: {:.2f}p".format(gas_tracker_price_tomorrow))
 
-    font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
+    font = layout.font('medium', 15)
 
     if check == 0 or check == 1: # we don't have gas data for tomorrow
-        x_pos = 4 * x_scale_factor
-        y_pos = 75 * y_scale_factor
-        draw.text((x_pos, y_pos), "No data yet.", inky_display.BLACK, font)
+        draw.text((layout.gas_x, layout.tomorrow_y), "No data yet.", inky_display.BLACK, font)
         print("No gas data for tomorrow yet.")
 
     if check == 0 or check == 2: # we don't have electricity data for tomorrow
-        x_pos = inky_display.WIDTH - (95 * x_scale_factor)
-        y_pos = 75 * y_scale_factor
-        draw.text((x_pos, y_pos), "No data yet.", inky_display.BLACK, font)
+        draw.text((layout.elec_x, layout.tomorrow_y), "No data yet.", inky_display.BLACK, font)
         print("No electricity data for tomorrow yet.")
 
+    timer.lap('text')
+
     if conf['InkyPHAT']['DisplayOrientation'] == 'inverted':
         img=img.rotate(180)
 
-    inky_display.set_image(img)
-    inky_display.show()
+    timer.lap('rotate')
+    show_frame(inky_display, img)
+    timer.lap('show')
+    timer.record('render')
 
-def update_inky(conf: dict, inky_data: dict, demo: bool):
+def update_inky(conf: dict, inky_data: dict, demo: bool, inky_display=None,
+                clock=time.time, timer: eco_timing.PhaseTimer = None, stats: dict = None):
     """Recieve a parsed configuration file and price/carbon data from the database,
     as well as a flag indicating demo mode, and then update the Inky
-    display appropriately.
+    display appropriately. An existing display handle from get_inky_display()
+    may be passed in to save detecting the display again, a PhaseTimer to
+    find out how long each part of drawing took, and the summary store_data.py
+    worked out for these slots (as from eco_stats.window_stats) to save working
+    it out again.
 
-    Notes: list 'inky_data' as passed from update_display.py is an ordered
-    list of tuples. In each tuple, index [0] is the time in SQLite date
-    format and index [1] is the price in p/kWh as a float. index [2] is
-    the carbon intensity as an integer."""
+    Notes: dict 'inky_data' as passed from update_display.py maps each role
+    ('electricity' or 'carbon') to an eco_slots.SlotSeries in time order,
+    starting with the current slot. Prices are in p/kWh and carbon intensity
+    in gCO2/kWh."""
 
     if demo:
         raise SystemExit("Demo mode not implemented!")
 
     from math import ceil
     from datetime import datetime, timedelta
-    import pytz
-    from tzlocal import get_localzone
-    from PIL import Image, ImageFont, ImageDraw
-    from font_roboto import RobotoMedium, RobotoBlack
-    from inky.auto import auto
-    from inky.eeprom import read_eeprom
-
-    inky_eeprom = read_eeprom()
+    from PIL import ImageDraw
 
-    if inky_eeprom is None:
-        raise SystemExit("Error: Inky pHAT display not found")
-
-    local_tz = get_localzone()
-
-    try:
-        # detect display type automatically
-        inky_display = auto(ask_user=False, verbose=True)
-    except TypeError as inky_version:
-        raise TypeError("You need to update the Inky library to >= v1.1.0") from inky_version
+    if inky_display is None:
+        inky_display = get_inky_display()
 
-    img = Image.new("P", (inky_display.WIDTH, inky_display.HEIGHT))
-    draw = ImageDraw.Draw(img)
+    if timer is None:
+        timer = eco_timing.PhaseTimer()
 
-    # deal with scaling for newer SSD1608 pHATs
-    if inky_display.resolution == (250, 122):
-        font_scale_factor = 1.2
-        x_scale_factor = 1.25
-        y_scale_factor = 1.25
-        graph_x_width = 126 * x_scale_factor
+    now = clock()
 
-    # original Inky pHAT
-    if inky_display.resolution == (212, 104):
-        font_scale_factor = 1
-        x_scale_factor = 1
-        y_scale_factor = 1
-        graph_x_width = 126 * x_scale_factor
+    layout = eco_layout.inky_layout(inky_display.resolution)
 
     data_duration = conf['InkyPHAT']['DataDuration']
-    graph_x_unit = graph_x_width / (data_duration * 2) # half hour slots!
+    graph_x_unit = layout.graph_x_width / (data_duration * 2) # half hour slots!
 
     if conf['Mode'] == "carbon":
-        tuple_idx = 2
+        role = 'carbon'
         short_unit = "g"
         descriptor = "Carbon at "
-        high_value = conf['InkyPHAT']['HighIntensity']
         format_str = "{:.0f}"
 
     if conf['Mode'] == "agile_import":
-        tuple_idx = 1
+        role = 'electricity'
         short_unit = "p"
         descriptor = "Price from "
-        high_value = conf['InkyPHAT']['HighPrice']
         format_str = "{0:.1f}"
 
 
     if conf['Mode'] == "agile_export":
-        tuple_idx = 1
+        role = 'electricity'
         short_unit = "p"
         descriptor = "Export at "
-        high_value = conf['InkyPHAT']['HighPrice']
         format_str = "{0:.1f}"
 
-    # figure out highest priced slots
+    high_value = conf['InkyPHAT']['HighValue']
+
+    # work out the cheapest/dearest windows, min/max slots and average all in one go,
+    # unless that's been done already
     high_slot_duration = conf['InkyPHAT']['LowSlotDuration']
     num_high_slots = int(2 * high_slot_duration)
-    inky_data_only = [slot_data[tuple_idx] for slot_data in inky_data]
-    high_slots_list = []
-    for i in range(0, len(inky_data_only) - num_high_slots - 1):
-        high_slots_list.append(sum(inky_data_only[i:i+num_high_slots])/num_high_slots)
-    high_slots_start_idx = high_slots_list.index(max(high_slots_list))
-    high_slots_average = format_str.format(max(high_slots_list))
+    series = inky_data[role]
+    inky_data_only = series.values
+    if len(inky_data_only) < num_high_slots:
+        raise SystemExit("Error: not enough data to find the best " +
+                         str(high_slot_duration) + " hours.")
+    if stats is None:
+        stats = eco_stats.window_stats(inky_data_only, num_high_slots)
+
+    # figure out highest priced slots
+    high_slots_start_idx, high_slots_mean = stats['highest_windows'][0]
+    high_slots_average = format_str.format(high_slots_mean)
 
-    high_slots_start_time = str(datetime.strftime(pytz.utc.localize(
-        datetime.strptime(inky_data[high_slots_start_idx][0], "%Y-%m-%d %H:%M:%S"),
-        is_dst=None).astimezone(local_tz), "%H:%M"))
+    high_slots_start_time = series.hhmm(high_slots_start_idx)
 
     print("Highest " + str(high_slot_duration) + " hours: average " +
           high_slots_average + short_unit + "/kWh at " + high_slots_start_time + ".")
 
-    max_slot = max(inky_data, key=lambda inky_data: inky_data[tuple_idx])
-    max_slot_value = str(max_slot[tuple_idx])
-    max_slot_time = str(datetime.strftime(pytz.utc.localize(datetime.strptime(
-        max_slot[0], "%Y-%m-%d %H:%M:%S"), is_dst=None).astimezone(local_tz), "%H:%M"))
+    max_slot_value = str(inky_data_only[stats['max_index']])
+    max_slot_time = series.hhmm(stats['max_index'])
 
     print("Highest value slot: " + max_slot_value + short_unit + " at " + max_slot_time + ".")
 
     # figure out cheapest/lowest slots
-    low_slot_duration = conf['InkyPHAT']['LowSlotDuration']
-    num_low_slots = int(2 * low_slot_duration)
-    inky_data_only = [slot_data[tuple_idx] for slot_data in inky_data]
-    low_slots_list = []
-    for i in range(0, len(inky_data_only) - num_low_slots - 1):
-        low_slots_list.append(sum(inky_data_only[i:i+num_low_slots])/num_low_slots)
-    low_slots_start_idx = low_slots_list.index(min(low_slots_list))
-    low_slots_average = format_str.format(min(low_slots_list))
-
-    low_slots_start_time = str(datetime.strftime(pytz.utc.localize(
-        datetime.strptime(inky_data[low_slots_start_idx][0], "%Y-%m-%d %H:%M:%S"),
-        is_dst=None).astimezone(local_tz), "%H:%M"))
+    low_slot_duration = high_slot_duration
+    num_low_slots = num_high_slots
+    low_slots_start_idx, low_slots_mean = stats['lowest_windows'][0]
+    low_slots_average = format_str.format(low_slots_mean)
+
+    low_slots_start_time = series.hhmm(low_slots_start_idx)
 
     print("Lowest " + str(low_slot_duration) + " hours: average " +
           low_slots_average + short_unit + "/kWh at " + low_slots_start_time + ".")
 
-    min_slot = min(inky_data, key=lambda inky_data: inky_data[tuple_idx])
-    min_slot_value = str(min_slot[tuple_idx])
-    min_slot_time = str(datetime.strftime(pytz.utc.localize(datetime.strptime(
-        min_slot[0], "%Y-%m-%d %H:%M:%S"), is_dst=None).astimezone(local_tz), "%H:%M"))
+    min_slot = inky_data_only[stats['min_index']]
+    min_slot_value = str(min_slot)
+    min_slot_time = series.hhmm(stats['min_index'])
 
     print("Lowest value slot: " + min_slot_value + short_unit + " at " + min_slot_time + ".")
 
+    # scale the y-axis
+    max_slot_value = inky_data_only[stats['max_index']]
+    graph_y_unit = (inky_display.HEIGHT / 2.5) / max_slot_value
+
+    # shift axis for negative prices
+    if min_slot < 0:
+        graph_bottom = layout.graph_bottom + min_slot * graph_y_unit
+    else:
+        graph_bottom = layout.graph_bottom
+
+    # colour the lowest slots (highest when exporting) black and high ones red/yellow
+    if conf['Mode'] == "agile_export":
+        best_start_idx, num_best_slots = high_slots_start_idx, num_high_slots
+    else:
+        best_start_idx, num_best_slots = low_slots_start_idx, num_low_slots
+
+    bar_colours = bytes(inky_display.BLACK if best_start_idx <= i < best_start_idx + num_best_slots
+                        else inky_display.RED if slot_data > high_value
+                        else inky_display.WHITE
+                        for i, slot_data in enumerate(inky_data_only))
+
+    # don't scribble on the small text
+    graph_slots = next((i for i in range(len(inky_data_only))
+                        if (i + 1) * graph_x_unit > layout.graph_x_limit), len(inky_data_only))
+
+    timer.lap('data prep')
+
+    canvas = eco_graph.Canvas(inky_display.WIDTH, inky_display.HEIGHT, inky_display.WHITE)
+    img = canvas.image()
+    draw = ImageDraw.Draw(img)
+
     # draw current price, in colour if it's high...
     # also highlight display with a coloured border if current price is high
-    font = ImageFont.truetype(RobotoBlack, size=int(45 * font_scale_factor))
-    message = format_str.format(inky_data[0][tuple_idx]) + short_unit
-    x_pos = 4 * x_scale_factor
-    y_pos = 8 * y_scale_factor
-
-    slot_start = str(datetime.strftime(pytz.utc.localize(datetime.strptime(
-        inky_data[0][0], "%Y-%m-%d %H:%M:%S"), is_dst=None).astimezone(
-            local_tz), "%H:%M"))
-
-    if inky_data[0][tuple_idx] > high_value:
-        draw.text((x_pos, y_pos), message, inky_display.RED, font)
-        inky_display.set_border(inky_display.RED)
+    font = layout.font('black', 45)
+    message = format_str.format(inky_data_only[0]) + short_unit
+
+    slot_start = series.hhmm(0)
+
+    if inky_data_only[0] > high_value:
+        draw.text(layout.current_pos, message, inky_display.RED, font)
+        border = inky_display.RED
         print("Current value from " + slot_start + ": " + message + " (High)")
     else:
-        draw.text((x_pos, y_pos), message, inky_display.BLACK, font)
-        inky_display.set_border(inky_display.WHITE)
+        draw.text(layout.current_pos, message, inky_display.BLACK, font)
+        border = inky_display.WHITE
         print("Current value from " + slot_start + ": " + message)
 
-    # scale the y-axis
-    selected_inky_data = inky_data[:data_duration*2]
-    max_slot = max(selected_inky_data, key=lambda selected_inky_data: selected_inky_data[tuple_idx])
-    max_slot_value = max_slot[tuple_idx]
-    graph_y_unit = (inky_display.HEIGHT / 2.5) / max_slot_value
+    timer.lap('text')
 
-    # draw graph solid bars...
-    # shift axis for negative prices
-    if min_slot[tuple_idx] < 0:
-        graph_bottom = (inky_display.HEIGHT + min_slot[1]
-                        * graph_y_unit) - 13 * y_scale_factor
-    else:
-        graph_bottom = inky_display.HEIGHT - 13 * y_scale_factor
-
-    i = 0
-    for slot_data in inky_data:
-        # draw the lowest slots in black and the highest in red/yellow
-
-        if (i + 1) * graph_x_unit > 127 * x_scale_factor:
-            break # don't scribble on the small text
-
-        if conf['Mode'] == "agile_import" or conf['Mode'] == "carbon":
-            if low_slots_start_idx <= i < low_slots_start_idx + num_low_slots:
-                colour = inky_display.BLACK
-            elif slot_data[tuple_idx] > high_value:
-                colour = inky_display.RED
-            else:
-                colour = inky_display.WHITE
-
-        if conf['Mode'] == "agile_export":
-            if high_slots_start_idx <= i < high_slots_start_idx + num_high_slots:
-                colour = inky_display.BLACK
-            elif slot_data[tuple_idx] > high_value:
-                colour = inky_display.RED
-            else:
-                colour = inky_display.WHITE
-
-        bar_y_height = slot_data[tuple_idx] * graph_y_unit
-
-        draw.rectangle(((i + 1) * graph_x_unit, graph_bottom,
-                        (((i + 1) * graph_x_unit) - graph_x_unit),
-                        (graph_bottom - bar_y_height)), colour)
-        i += 1
-    # graph solid bars finished
+    # draw graph solid bars, over the current price...
+    canvas.draw_over(img)
+    bar_edges = eco_graph.bar_edges(graph_slots, graph_x_unit)
+    bar_tops = eco_graph.bar_tops(inky_data_only, graph_y_unit, graph_bottom)
+    eco_graph.fill_bars(canvas, bar_edges, bar_tops, int(graph_bottom), bar_colours)
+
+    timer.lap('bars')
+
+    # the rest of the text goes over the bars, and then the outline over the text
+    img = canvas.image()
+    draw = ImageDraw.Draw(img)
 
     # draw time info above current price...
-    font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
+    font = layout.font('medium', 15)
     message = descriptor + slot_start + "    " # trailing spaces prevent text clipping
-    x_pos = 4 * x_scale_factor
-    y_pos = 0 * y_scale_factor
-    draw.text((x_pos, y_pos), message, inky_display.BLACK, font)
+    draw.text(layout.descriptor_pos, message, inky_display.BLACK, font)
 
-    mins_until_next_slot = ceil((pytz.utc.localize(datetime.strptime(
-        inky_data[1][0], "%Y-%m-%d %H:%M:%S"), is_dst=None) - datetime.now(
-            pytz.timezone("UTC"))).total_seconds() / 60)
+    mins_until_next_slot = ceil((series.starts[1] - now) / 60)
+
+    # rounded up to CountdownStep minutes, so that (with a big enough step) the countdown
+    # alone doesn't make the frame different every time we draw it
+    countdown_step = conf['InkyPHAT']['CountdownStep']
+    mins_until_next_slot = countdown_step * ceil(mins_until_next_slot / countdown_step)
 
     print(str(mins_until_next_slot) + " mins until next slot.")
 
     # draw next 3 slot times...
-    font = ImageFont.truetype(RobotoMedium, size=int(15 * font_scale_factor))
-    x_pos = 130 * x_scale_factor
-    for i in range(3):
+    x_pos = layout.next_slot_x
+    for i, y_pos in enumerate(layout.next_slot_y):
         message = "+" + str(mins_until_next_slot + (i * 30)) + ":    "
         # trailing spaces prevent text clipping
-        y_pos = i * 18 * y_scale_factor + 3 * y_scale_factor
         draw.text((x_pos, y_pos), message, inky_display.BLACK, font)
 
     # draw next 3 slot prices...
-    x_pos = 163 * x_scale_factor
-    for i in range(3):
-        message = format_str.format(inky_data[i+1][tuple_idx]) + short_unit + "    "
+    x_pos = layout.next_value_x
+    for i, y_pos in enumerate(layout.next_slot_y):
+        message = format_str.format(inky_data_only[i+1]) + short_unit + "    "
         # trailing spaces prevent text clipping
-        y_pos = i * 18 * y_scale_factor + 3 * y_scale_factor
-        if inky_data[i+1][tuple_idx] > high_value:
+        if inky_data_only[i+1] > high_value:
             draw.text((x_pos, y_pos), message, inky_display.RED, font)
         else:
             draw.text((x_pos, y_pos), message, inky_display.BLACK, font)
 
     # draw separator line...
-    ypos = 5 * y_scale_factor + (3 * 18 * y_scale_factor)
-    draw.line((130 * x_scale_factor, ypos, inky_display.WIDTH - 5, ypos),
+    ypos = layout.separator_y
+    draw.line((layout.next_slot_x, ypos, inky_display.WIDTH - 5, ypos),
               fill=inky_display.BLACK, width=2)
 
     # draw lowest slots info...
-    x_pos = 130 * x_scale_factor
-    y_pos = 10 * y_scale_factor + (3 * 18 * y_scale_factor)
-    font = ImageFont.truetype(RobotoMedium, size=int(13 * font_scale_factor))
+    x_pos = layout.next_slot_x
+    y_pos = layout.window_y
+    font = layout.font('medium', 13)
 
     if conf['Mode'] == "agile_import" or conf['Mode'] == "carbon":
         if '.' in str(low_slot_duration):
@@ -527,19 +496,16 @@ def update_inky(conf: dict, inky_data: dict, demo: bool):
         draw.text((x_pos, y_pos), lsd_text + "h @" + low_slots_average + short_unit + "    ",
                   inky_display.BLACK, font)
 
-        min_slot_timedelta = datetime.strptime(
-            inky_data[low_slots_start_idx][0],
-            "%Y-%m-%d %H:%M:%S") - datetime.strptime(inky_data[0][0], "%Y-%m-%d %H:%M:%S")
+        min_slot_seconds = series.starts[low_slots_start_idx] - series.starts[0]
 
-        y_pos = 16 * (y_scale_factor * 0.6) + (4 * 18 * y_scale_factor)
+        y_pos = layout.window_time_y
 
-        if min_slot_timedelta.total_seconds() > 1800:
+        if min_slot_seconds > 1800:
             draw.text((x_pos, y_pos), low_slots_start_time + "/" +
-                      str(min_slot_timedelta.total_seconds() / 3600) +
+                      str(min_slot_seconds / 3600) +
                       "h    ", inky_display.BLACK, font)
         else:
-            font = ImageFont.truetype(RobotoMedium, size=int(16 * font_scale_factor))
-            draw.text((x_pos, y_pos), "NOW!", inky_display.RED, font)
+            draw.text((x_pos, y_pos), "NOW!", inky_display.RED, layout.font('medium', 16))
 
     if conf['Mode'] == "agile_export":
         if '.' in str(high_slot_duration):
@@ -554,89 +520,63 @@ def update_inky(conf: dict, inky_data: dict, demo: bool):
             colour = inky_display.RED
         else:
             colour = inky_display.BLACK
-        draw.text((x_pos + (30 * x_scale_factor), y_pos), high_slots_average + short_unit + "    ",
+        draw.text((x_pos + layout.window_value_dx, y_pos), high_slots_average + short_unit + "    ",
                   colour, font)
 
-        max_slot_timedelta = datetime.strptime(
-            inky_data[high_slots_start_idx][0],
-            "%Y-%m-%d %H:%M:%S") - datetime.strptime(inky_data[0][0], "%Y-%m-%d %H:%M:%S")
+        max_slot_seconds = series.starts[high_slots_start_idx] - series.starts[0]
 
-        y_pos = 16 * (y_scale_factor * 0.6) + (4 * 18 * y_scale_factor)
+        y_pos = layout.window_time_y
 
-        if max_slot_timedelta.total_seconds() > 1800:
+        if max_slot_seconds > 1800:
             draw.text((x_pos, y_pos), high_slots_start_time + "/" +
-                      str(max_slot_timedelta.total_seconds() / 3600) +
+                      str(max_slot_seconds / 3600) +
                       "h    ", inky_display.BLACK, font)
         else:
-            font = ImageFont.truetype(RobotoMedium, size=int(16 * font_scale_factor))
-            draw.text((x_pos, y_pos), "NOW!", inky_display.RED, font)
-
-    # draw graph outline (last so it's over the top of everything else)
-    i = 0
-    for i, slot_data in enumerate(inky_data):
-        colour = inky_display.BLACK
-        bar_y_height = slot_data[tuple_idx] * graph_y_unit
-        prev_bar_y_height = inky_data[i-1][tuple_idx] * graph_y_unit
-
-        if (i + 1) * graph_x_unit > 127 * x_scale_factor: # don't scribble on the small text
-            break
-
-        # horizontal lines...
-        draw.line(((i + 1) * graph_x_unit, graph_bottom - bar_y_height,
-                   ((i + 1) * graph_x_unit) - graph_x_unit,
-                   graph_bottom - bar_y_height), colour)
-
-        # vertical lines...
-        if i == 0: # skip the first vertical line
-            continue
-        draw.line((i * graph_x_unit, graph_bottom - bar_y_height,
-                   i * graph_x_unit, graph_bottom - prev_bar_y_height), colour)
-
-        i += 1
-
-    # draw graph x axis
-    draw.line((0, graph_bottom, 126 * x_scale_factor, graph_bottom), inky_display.BLACK)
+            draw.text((x_pos, y_pos), "NOW!", inky_display.RED, layout.font('medium', 16))
 
     # draw graph hour marker text... XXX FIXME XXX
+    font = layout.font('medium', 10)
     for i in range(2, data_duration, ceil(data_duration / 8)):
         colour = inky_display.BLACK
-        font = ImageFont.truetype(RobotoMedium, size=int(10 * font_scale_factor))
         x_pos = i * graph_x_unit * 2 # it's half hour slots!!
-        hours = datetime.strftime(datetime.now() + timedelta(hours=i), "%H")
+        hours = datetime.strftime(datetime.fromtimestamp(now) + timedelta(hours=i), "%H")
         hours_w, hours_h = font.getsize(hours) # we want to centre the labels
         y_pos = graph_bottom + 1
-        if x_pos + hours_w / 2 > 128 * x_scale_factor:
+        if x_pos + hours_w / 2 > layout.marker_x_limit:
             break # don't draw past the end of the x axis
         draw.text((x_pos - hours_w / 2, y_pos + 1), hours + "  ", inky_display.BLACK, font)
         # and the tick marks for each one
-        draw.line((x_pos, y_pos + 2 * y_scale_factor, x_pos, graph_bottom),
+        draw.line((x_pos, y_pos + layout.marker_tick, x_pos, graph_bottom),
                   inky_display.BLACK)
 
-    # draw average line...
-    # extract just values from the list of tuples and put in descending order
-    slot_data_list = sorted(list(zip(*inky_data))[tuple_idx], reverse=True)
-    # now slice off the first (highest) 6 entries
-    del slot_data_list[:6]
-    # and calculate the mean
-    average_slot_data = sum(slot_data_list) / len(slot_data_list)
+    timer.lap('text')
+
+    # draw graph outline, x axis and average line (the mean leaving out the highest 6 slots)
+    canvas.draw_over(img)
+    eco_graph.outline_bars(canvas, bar_edges, bar_tops, inky_display.BLACK)
+    canvas.hline(0, int(layout.graph_x_width), int(graph_bottom), inky_display.BLACK)
 
-    average_line_ypos = graph_bottom - average_slot_data * graph_y_unit
+    average_line_ypos = int(graph_bottom - stats['trimmed_mean'] * graph_y_unit)
+    eco_graph.dashed_hline(canvas, 2, int(layout.graph_x_width), average_line_ypos,
+                           inky_display.BLACK) # repeat every 6 pixels starting at 2
+    img = canvas.image()
 
-    for x_pos in range(0, int(126 * x_scale_factor)):
-        if x_pos % 6 == 2: # repeat every 6 pixels starting at 2
-            draw.line((x_pos, average_line_ypos, x_pos + 2, average_line_ypos),
-                      inky_display.BLACK)
+    timer.lap('outline')
 
     # Flip orientation if option is set
     if conf['InkyPHAT']['DisplayOrientation'] == 'inverted':
         img=img.rotate(180)
 
-    inky_display.set_image(img)
-    inky_display.show()
+    timer.lap('rotate')
+    show_frame(inky_display, img, border)
+    timer.lap('show')
+    timer.record('render')
 
-def clear_display(conf: dict):
+def clear_display(conf: dict, inky_display=None, cycles: int = None):
     """Determine what type of display is connected and
-    use the appropriate method to clear it."""
+    use the appropriate method to clear it. An existing Inky display handle
+    may be passed in, and the number of times to cycle an Inky pHAT through
+    all its colours (to shake off ghosting) overrides ClearCycles from the config."""
     if conf['DisplayType'] == 'blinkt':
 
         import blinkt
@@ -648,149 +588,26 @@ def clear_display(conf: dict):
 
     elif conf['DisplayType'] == 'inkyphat':
 
-        from inky.auto import auto
-        from inky.eeprom import read_eeprom
         from PIL import Image
 
-        inky_eeprom = read_eeprom()
-        if inky_eeprom is None:
-            raise SystemExit('Error: Inky pHAT display not found')
+        if inky_display is None:
+            inky_display = get_inky_display()
+
+        if cycles is None:
+            cycles = conf['InkyPHAT']['ClearCycles']
 
         print('Clearing Inky pHAT display...')
-        inky_display = auto(ask_user=True, verbose=True)
+
+        # one solid frame per colour, ending on white
         colours = (inky_display.RED, inky_display.BLACK, inky_display.WHITE)
-        img = Image.new("P", (inky_display.WIDTH, inky_display.HEIGHT))
+        frames = [Image.new("P", (inky_display.WIDTH, inky_display.HEIGHT), colour)
+                  for colour in colours]
 
-        for colour in colours:
-            inky_display.set_border(colour)
-            for x_pos in range(inky_display.WIDTH):
-                for y_pos in range(inky_display.HEIGHT):
-                    img.putpixel((x_pos, y_pos), colour)
-            inky_display.set_image(img)
-            inky_display.show()
+        for _ in range(cycles):
+            for colour, img in zip(colours, frames):
+                inky_display.set_border(colour)
+                inky_display.set_image(img)
+                inky_display.show()
 
+        forget_frame(inky_display)
         print('Done.')
-
-def deep_get(this_dict: dict, keys: str, default=None):
-    """
-    Example:
-        this_dict = {'meta': {'status': 'OK', 'status_code': 200}}
-        deep_get(this_dict, ['meta', 'status_code'])          # => 200
-        deep_get(this_dict, ['garbage', 'status_code'])       # => None
-        deep_get(this_dict, ['meta', 'garbage'], default='-') # => '-'
-    """
-    assert isinstance(keys, list)
-    if this_dict is None:
-        return default
-    if not keys:
-        return this_dict
-    return deep_get(this_dict.get(keys[0]), keys[1:], default)
-
-def get_config(filename: str) -> dict:
-    """
-    Read config file and do some basic checks that we have what we need.
-    If not, set sensible defaults or bail out.
-    """
-    try:
-        config_file = open(filename, 'r')
-    except FileNotFoundError as no_config:
-        raise SystemExit('Unable to find ' + filename) from no_config
-
-    try:
-        _config = yaml.safe_load(config_file)
-    except yaml.YAMLError as config_err:
-        raise SystemExit('Error reading configuration: ' + str(config_err)) from config_err
-
-    if 'DisplayType' not in _config:
-        raise SystemExit('Error: DisplayType not found in ' + filename)
-
-    if _config['DisplayType'] == 'blinkt':
-        print('Blinkt! display selected.')
-
-        conf_brightness = deep_get(_config, ['Blinkt', 'Brightness'])
-        if not (isinstance(conf_brightness, int) and 5 <= conf_brightness <= 100):
-            print('Misconfigured brightness value: ' + str(conf_brightness) +
-                  '. Using default of ' + str(DEFAULT_BRIGHTNESS) + '.')
-            _config['Blinkt']['Brightness'] = DEFAULT_BRIGHTNESS
-
-        conf_slotsperpixel = deep_get(_config, ['Blinkt', 'SlotsPerPixel'])
-        if not (isinstance(conf_slotsperpixel, int) and 1 <= conf_slotsperpixel <= 12):
-            print('Misconfigured slots per pixel value: ' + str(conf_slotsperpixel) +
-                  '. Using default of ' + str(DEFAULT_SLOTSPERPIXEL) + '.')
-            _config['Blinkt']['SlotsPerPixel'] = DEFAULT_SLOTSPERPIXEL
-
-        if len(_config['Blinkt']['Colours'].items()) < 2:
-            raise SystemExit('Error: Less than two colour levels found in ' + filename)
-
-    elif _config['DisplayType'] == 'inkyphat':
-        print('Inky pHAT display selected.')
-
-        if 'DisplayOrientation' not in _config['InkyPHAT']:
-            _config['InkyPHAT']['DisplayOrientation'] = 'standard'
-            print('Standard display orientation.')
-        elif _config['InkyPHAT']['DisplayOrientation'] == 'standard':
-            print('Standard display orientation.')
-        elif _config['InkyPHAT']['DisplayOrientation'] == 'inverted':
-            print('Inverted display orientation.')
-        else:
-            raise SystemExit('Error: Unknown display orientation found in ' + 
-                  filename + ': ' + _config['InkyPHAT']['DisplayOrientation'])
-
-        conf_highprice = deep_get(_config, ['InkyPHAT', 'HighPrice'])
-        if not (isinstance(conf_highprice, (int, float)) and 0 <= conf_highprice <= 35):
-            print('Misconfigured high price value: ' + str(conf_highprice) +
-                  '. Using default of ' + str(DEFAULT_HIGHPRICE) + '.')
-            _config['InkyPHAT']['HighPrice'] = DEFAULT_HIGHPRICE
-
-        conf_lowslotduration = deep_get(_config, ['InkyPHAT', 'LowSlotDuration'])
-        if not (conf_lowslotduration % 0.5 == 0 and 0.5 <= conf_lowslotduration <= 6):
-            print('Low slot duration misconfigured: ' + str(conf_lowslotduration) +
-                  ' (must be between 0.5 and 6 hours in half hour increments).' +
-                  ' Using default of ' + str(DEFAULT_LOWSLOTDURATION) + '.')
-            _config['InkyPHAT']['LowSlotDuration'] = DEFAULT_LOWSLOTDURATION
-
-        conf_dataduration = deep_get(_config, ['InkyPHAT', 'DataDuration'])
-        if not (isinstance(conf_dataduration, (int)) and 12 <= conf_highprice <= 48):
-            print('Data duration misconfigured: ' + str(conf_dataduration) +
-                  ' (must be between 12 and 48 hours).' +
-                  ' Using default of ' + str(DEFAULT_DATADURATION) + '.')
-            _config['InkyPHAT']['DataDuration'] = DEFAULT_DATADURATION
-
-    else:
-        raise SystemExit('Error: unknown DisplayType ' + _config['DisplayType'] + ' in ' + filename)
-
-    if 'Mode' not in _config:
-        raise SystemExit('Error: Mode not found in ' + filename)
-
-    if _config['Mode'] == 'agile_import':
-        print('Working in Octopus Agile import mode.')
-
-        if 'AgileCap' not in _config:
-            raise SystemExit('Error: Agile cap not found in ' + filename)
-
-        if _config['AgileCap'] == 35:
-            print('Agile version set: 35p cap (pre July 2022)')
-        elif _config['AgileCap'] == 55:
-            print('Agile version set: 55p cap (July 2022 onwards)')
-        elif _config['AgileCap'] == 78:
-            print('Agile version set: 78p cap (August 2022 onwards)')
-        elif _config['AgileCap'] == 100:
-            print('Agile version set: £1 cap, new formula (October 2022 only)')
-        elif _config['AgileCap'] == 101:
-            print('Agile version set: £1 cap, new-new formula (current)')
-        else:
-            raise SystemExit('Error: Agile cap of ' + str(_config['AgileCap']) + ' refers to an unknown tariff.')
-
-    elif _config['Mode'] == 'agile_export':
-        print('Working in Octopus Agile export mode.')
-    elif _config['Mode'] == 'carbon':
-        print('Working in carbon intensity mode.')
-    elif _config['Mode'] == 'tracker':
-        print('Working in Octopus Tracker mode.')
-    else:
-        raise SystemExit('Error: Unknown mode found in ' + filename + ': ' + _config['Mode'])
-
-    if 'DNORegion' not in _config:
-        raise SystemExit('Error: DNORegion not found in ' + filename)
-
-    return _config
@@ -0,0 +1,77 @@
+"""
+Fonts and positions for drawing on the Inky pHAT, worked out once per display
+resolution.
+
+Loading a TrueType font is one of the slowest parts of drawing a frame on a Pi Zero,
+so each face and size is loaded only once and kept for the life of the process, and
+all the scaled coordinates the drawing code needs are calculated up front.
+"""
+
+from functools import lru_cache
+
+# (font scale, x scale, y scale) for each panel, relative to the original 212x104 one
+INKY_SCALES = {(250, 122): (1.2, 1.25, 1.25), # newer SSD1608 pHATs
+               (212, 104): (1, 1, 1)}         # original Inky pHAT
+
+@lru_cache(maxsize=None)
+def load_font(face: str, size: int):
+    """Load a font at a given size, or return the one we loaded last time."""
+    from PIL import ImageFont
+    return ImageFont.truetype(face, size=size)
+
+class InkyLayout:
+    """Everything about where things go on one size of Inky pHAT. Use inky_layout()
+    rather than making these directly, so they're only worked out once."""
+
+    def __init__(self, resolution: tuple):
+        from font_roboto import RobotoMedium, RobotoBlack
+
+        if resolution not in INKY_SCALES:
+            raise SystemExit('Error: unsupported Inky display resolution ' + str(resolution))
+
+        font_scale, x_scale, y_scale = INKY_SCALES[resolution]
+        self.width, self.height = resolution
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+
+        faces = {'medium': RobotoMedium, 'black': RobotoBlack}
+        self.fonts = {(face, size): load_font(faces[face], int(size * font_scale))
+                      for face, size in (('medium', 10), ('medium', 13), ('medium', 15),
+                                         ('medium', 16), ('medium', 20), ('black', 15),
+                                         ('black', 35), ('black', 45))}
+
+        # Agile/carbon: current value on the left, graph beneath it, next few slots
+        # and the best window down the right hand side
+        self.descriptor_pos = (4 * x_scale, 0)
+        self.current_pos = (4 * x_scale, 8 * y_scale)
+        self.graph_x_width = 126 * x_scale
+        self.graph_x_limit = 127 * x_scale # bars stop here so they don't scribble on the text
+        self.marker_x_limit = 128 * x_scale
+        self.graph_bottom = self.height - 13 * y_scale
+        self.marker_tick = 2 * y_scale
+        self.next_slot_x = 130 * x_scale
+        self.next_value_x = 163 * x_scale
+        self.next_slot_y = [i * 18 * y_scale + 3 * y_scale for i in range(3)]
+        self.separator_y = 5 * y_scale + (3 * 18 * y_scale)
+        self.window_y = 10 * y_scale + (3 * 18 * y_scale)
+        self.window_time_y = 16 * (y_scale * 0.6) + (4 * 18 * y_scale)
+        self.window_value_dx = 30 * x_scale
+
+        # Tracker: gas on the left, electricity on the right
+        self.gas_x = 4 * x_scale
+        self.elec_label_x = self.width - 40 * x_scale
+        self.elec_x = self.width - 95 * x_scale
+        self.divider_top = 20 * y_scale
+        self.today_y = 20 * y_scale
+        self.tomorrow_label_y = 60 * y_scale
+        self.tomorrow_y = 75 * y_scale
+        self.symbol_offset = (60 * x_scale, 3 * y_scale)
+
+    def font(self, face: str, size: int):
+        """The font for a face ('medium' or 'black') at its size on the original pHAT."""
+        return self.fonts[face, size]
+
+@lru_cache(maxsize=None)
+def inky_layout(resolution: tuple) -> InkyLayout:
+    """The layout for a display resolution, e.g. inky_display.resolution."""
+    return InkyLayout(resolution)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""Profile a run of one of the scripts phase by phase, and compare two such runs.
+
+A Pi Zero is so much slower than a desktop, and slow in different places, that
+hot spots need finding on the device itself. Run e.g. ./store_data.py --profile
+and everything it does is profiled with cProfile and tracemalloc, split into the
+same phases that eco_timing times: each Span (API requests, database writes and
+queries...), each phase of drawing, and 'main' for everything in between. The
+results go in a new directory, e.g. profiles/store-20240601-163000:
+
+    all.prof            cProfile stats for the whole run (for pstats, snakeviz...)
+    <phase>.prof        cProfile stats for each phase
+    phases.json         each phase's time, how often it ran, and its peak memory
+    report.txt          the same, with each phase's slowest functions and the
+                        lines that allocated the most memory
+
+Then ./eco.py profile-diff OLD NEW shows what changed between two runs, e.g. a Pi
+and a desktop, or before and after a change.
+"""
+
+import os
+import time
+import argparse
+import eco_timing
+
+PROFILE_DIR = 'profiles'
+TOP_FUNCTIONS = 15 # how many of each phase's slowest functions go in the report
+TOP_ALLOCATIONS = 10 # how many of each phase's biggest allocations go in the report
+
+def add_argument(parser: argparse.ArgumentParser):
+    """Give a script's command line the --profile option."""
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, default=None, metavar='DIR',
+                        help='profile this run with cProfile and tracemalloc, writing the '
+                             'results to a new directory in DIR (default: ' + PROFILE_DIR + ')')
+
+class Profiler:
+    """Profile everything from start() to stop(), or in a with block, phase by phase.
+    eco_timing tells it where each phase starts and ends: the work since the last
+    boundary is charged to the phase named, and each phase's time, profile and memory
+    add up over every time it runs. Each phase's profiles are merged into one set of
+    stats as they're made, so a long-running process's profile doesn't keep growing.
+    Work done in other threads (e.g. fetching) is left out of the profiles, but does
+    count towards peak memory."""
+
+    def __init__(self, directory: str):
+        from threading import get_ident
+
+        self.get_ident = get_ident
+        self.directory = directory
+        self.thread = get_ident()
+        self.stack = ['main']
+        self.phases = {}
+        self.profile = None
+        self.started = None
+        self.snapshot = None
+
+    def start(self):
+        """Start profiling, in the phase called 'main'."""
+        import tracemalloc
+
+        tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self._begin()
+
+    def _begin(self):
+        import cProfile
+
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profile.enable()
+
+    def _end(self, name: str):
+        """Charge everything since the last boundary to phase 'name'."""
+        import pstats
+        import tracemalloc
+
+        self.profile.disable()
+        seconds = time.perf_counter() - self.started
+
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+        allocations = [stat for stat in snapshot.compare_to(self.snapshot, 'lineno')
+                       if stat.size_diff > 0][:TOP_ALLOCATIONS]
+        tracemalloc.reset_peak()
+        self.snapshot = snapshot
+
+        phase = self.phases.setdefault(name, {'seconds': 0, 'count': 0, 'peak_bytes': 0,
+                                              'stats': None, 'allocations': []})
+        phase['seconds'] += seconds
+        phase['count'] += 1
+        # an empty profile would give pstats nothing to work with
+        if self.profile.getstats():
+            if phase['stats'] is None:
+                phase['stats'] = pstats.Stats(self.profile)
+            else:
+                phase['stats'].add(self.profile)
+        if peak >= phase['peak_bytes']:
+            # the allocations made on the phase's hungriest run
+            phase['peak_bytes'] = peak
+            phase['allocations'] = [str(stat) for stat in allocations]
+
+    def enter(self, name: str):
+        """A span called 'name' is starting."""
+        if self.get_ident() == self.thread:
+            self._end(self.stack[-1])
+            self.stack.append(name)
+            self._begin()
+
+    def exit(self):
+        """The innermost span has finished."""
+        if self.get_ident() == self.thread and len(self.stack) > 1:
+            self._end(self.stack.pop())
+            self._begin()
+
+    def lap(self, name: str = None):
+        """The work since the last boundary was phase 'name' (by default, whichever
+        phase we're in), as for eco_timing.PhaseTimer.lap."""
+        if self.get_ident() == self.thread:
+            self._end(name or self.stack[-1])
+            self._begin()
+
+    def stop(self):
+        """Stop profiling and write everything out."""
+        import json
+        import pstats
+        import tracemalloc
+
+        self._end(self.stack[-1])
+        tracemalloc.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        merged = pstats.Stats()
+        summary = {}
+        with open(os.path.join(self.directory, 'report.txt'), 'w', encoding='utf-8') as report:
+            for name, phase in sorted(self.phases.items(), key=lambda item: -item[1]['seconds']):
+                summary[name] = {'seconds': phase['seconds'], 'count': phase['count'],
+                                 'peak_bytes': phase['peak_bytes']}
+                report.write('{} - {:.3f} s over {} run(s), peak memory {:.1f} KiB\n'.format(
+                    name, phase['seconds'], phase['count'], phase['peak_bytes'] / 1024))
+                report.write('\nBiggest allocations:\n')
+                report.write(''.join('    ' + line + '\n' for line in phase['allocations']) or
+                             '    (none)\n')
+
+                stats = phase['stats']
+                if stats is None:
+                    report.write('\n')
+                    continue
+                merged.add(stats)
+
+                stats.dump_stats(os.path.join(self.directory, file_name(name) + '.prof'))
+                stats.stream = report
+                stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        if merged.stats:
+            merged.dump_stats(os.path.join(self.directory, 'all.prof'))
+        with open(os.path.join(self.directory, 'phases.json'), 'w', encoding='utf-8') as phases_file:
+            json.dump(summary, phases_file, indent=1)
+
+        print('Profile written to ' + self.directory)
+
+    def __enter__(self):
+        eco_timing.PROFILER = self
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        eco_timing.PROFILER = None
+        self.stop()
+        return False
+
+def file_name(phase: str) -> str:
+    """A phase name that's safe to use as a file name."""
+    return ''.join(char if char.isalnum() or char in '-_' else '_' for char in phase)
+
+def profiling(directory: str, command: str):
+    """Something to profile a with block if 'directory' isn't None, writing the results
+    to a new directory in it named after the command and the time."""
+    if directory is None:
+        from contextlib import nullcontext
+        return nullcontext()
+    return Profiler(os.path.join(directory, command + '-' + time.strftime('%Y%m%d-%H%M%S')))
+
+def function_times(directory: str) -> dict:
+    """The time spent in each function itself in a profiled run, by (file name,
+    function name), so that runs of slightly different code on different machines
+    can be compared."""
+    import pstats
+
+    times = {}
+    for (filename, _, function), (_, _, own_time, _, _) in \
+            pstats.Stats(os.path.join(directory, 'all.prof')).stats.items():
+        key = (os.path.basename(filename), function)
+        times[key] = times.get(key, 0) + own_time
+    return times
+
+def load_phases(directory: str) -> dict:
+    """The phases.json from a profiled run."""
+    import json
+
+    try:
+        with open(os.path.join(directory, 'phases.json'), encoding='utf-8') as phases_file:
+            return json.load(phases_file)
+    except (OSError, ValueError) as error:
+        raise SystemExit('Error: ' + directory + " doesn't look like a profile: " +
+                         str(error)) from error
+
+def change(old: float, new: float) -> str:
+    """How much bigger or smaller 'new' is than 'old'."""
+    if old == 0:
+        return 'new' if new else ''
+    return '{:+.0f}%'.format((new - old) / old * 100)
+
+def main(argv: list = None):
+    """Compare two profiled runs from the command line."""
+    parser = argparse.ArgumentParser(description=('Compare two runs profiled with --profile'))
+    parser.add_argument('old', help='the profile directory to compare against')
+    parser.add_argument('new', help='the profile directory to compare')
+    parser.add_argument('--top', '-n', type=int, default=20,
+                        help='how many of the functions that changed most to show')
+
+    args = parser.parse_args(argv)
+
+    old_phases = load_phases(args.old)
+    new_phases = load_phases(args.new)
+
+    print('{:<20}{:>10}{:>10}{:>8}{:>12}{:>12}{:>8}'.format(
+        'phase', 'old s', 'new s', '', 'old KiB', 'new KiB', ''))
+    for name in sorted(set(old_phases) | set(new_phases),
+                       key=lambda name: -new_phases.get(name, old_phases.get(name))['seconds']):
+        old = old_phases.get(name, {'seconds': 0, 'peak_bytes': 0})
+        new = new_phases.get(name, {'seconds': 0, 'peak_bytes': 0})
+        print('{:<20}{:>10.3f}{:>10.3f}{:>8}{:>12.1f}{:>12.1f}{:>8}'.format(
+            name[:19], old['seconds'], new['seconds'], change(old['seconds'], new['seconds']),
+            old['peak_bytes'] / 1024, new['peak_bytes'] / 1024,
+            change(old['peak_bytes'], new['peak_bytes'])))
+
+    try:
+        old_times = function_times(args.old)
+        new_times = function_times(args.new)
+    except OSError as error:
+        raise SystemExit('Error: unable to read a profile: ' + str(error)) from error
+
+    print('\n{:<50}{:>10}{:>10}{:>8}'.format('function (own time)', 'old ms', 'new ms', ''))
+    keys = sorted(set(old_times) | set(new_times),
+                  key=lambda key: -abs(new_times.get(key, 0) - old_times.get(key, 0)))
+    for filename, function in keys[:args.top]:
+        old = old_times.get((filename, function), 0)
+        new = new_times.get((filename, function), 0)
+        print('{:<50}{:>10.2f}{:>10.2f}{:>8}'.format(
+            (filename + ':' + function)[:49], old * 1000, new * 1000, change(old, new)))
+
+if __name__ == '__main__':
+    main()
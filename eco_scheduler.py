@@ -0,0 +1,107 @@
+"""
+Work out when a long-running process should fetch new data and repaint the display.
+
+This encodes the same timings that install_crontab.sh sets up for each mode, but as
+plain functions of the current time, so they can be checked with a fake clock.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+SLOT_SECONDS = 1800 # half hour slots
+
+# When a fetch or repaint fails for some reason other than the API (e.g. the database
+# is locked while a backfill writes to it) we try again after a minute, doubling the
+# wait with each failure in a row, but never waiting longer than a slot.
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = SLOT_SECONDS
+
+# Octopus publish the next day's Agile prices at some point between 16:00 and 20:00,
+# so we look for them a few times within that window.
+AGILE_FETCH_HOURS = (16, 18, 20)
+
+class Scheduler:
+    """Decide the next fetch and repaint times for a given mode.
+
+    Fetches are spread out with a random offset (just like the cron jobs) so that
+    a fleet of indicators doesn't hit the APIs at the same moment. Repaints always
+    happen exactly on slot boundaries. All times are UNIX timestamps; 'tz' is only
+    needed to override the local timezone, e.g. when testing."""
+
+    def __init__(self, mode: str, rng: random.Random = None, tz=None):
+        if rng is None:
+            rng = random.Random()
+
+        self.mode = mode
+        self.tz = tz
+
+        if mode == 'carbon':
+            # a random number of seconds past every half hour
+            self.fetch_offset = rng.randrange(60)
+        elif mode in ('agile_import', 'agile_export'):
+            # a random minute in the second half of each fetch hour
+            self.fetch_offset = 30 + rng.randrange(29)
+        elif mode == 'tracker':
+            # a random minute past every hour
+            self.fetch_offset = rng.randrange(58)
+        else:
+            raise SystemExit('Error: Unknown mode for scheduler: ' + mode)
+
+    def _local(self, timestamp: float) -> datetime:
+        if self.tz is None:
+            return datetime.fromtimestamp(timestamp).astimezone()
+        return datetime.fromtimestamp(timestamp, self.tz)
+
+    def _at(self, day, hour: int, minute: int) -> float:
+        naive = datetime(day.year, day.month, day.day, hour, minute)
+        if self.tz is None:
+            return naive.astimezone().timestamp()
+        return naive.replace(tzinfo=self.tz).timestamp()
+
+    def next_repaint(self, now: float) -> float:
+        """The start of the next half hour slot strictly after 'now'."""
+        return (int(now) // SLOT_SECONDS + 1) * SLOT_SECONDS
+
+    def next_retry(self, now: float, failures: int) -> float:
+        """When to try again after 'failures' attempts in a row have failed."""
+        return now + min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**(failures - 1))
+
+    def next_fetch(self, now: float) -> float:
+        """The next time strictly after 'now' that we should ask the API for data."""
+
+        if self.mode == 'carbon':
+            slot_start = int(now) // SLOT_SECONDS * SLOT_SECONDS
+            fetch_time = slot_start + self.fetch_offset
+            if fetch_time <= now:
+                fetch_time += SLOT_SECONDS
+            return fetch_time
+
+        today = self._local(now).date()
+
+        if self.mode == 'tracker':
+            candidates = [(day, hour) for day in (today, today + timedelta(days=1))
+                          for hour in range(24)]
+        else:
+            candidates = [(day, hour) for day in (today, today + timedelta(days=1))
+                          for hour in AGILE_FETCH_HOURS]
+
+        for day, hour in candidates:
+            fetch_time = self._at(day, hour, self.fetch_offset)
+            if fetch_time > now:
+                return fetch_time
+
+        # not reachable - there is always a candidate tomorrow
+        raise SystemExit('Error: unable to schedule the next fetch.')
+
+    def next_clear(self, now: float, clear_times: list) -> float:
+        """The next of the local (hour, minute) times in 'clear_times' strictly after
+        'now', or None if there aren't any."""
+
+        if not clear_times:
+            return None
+
+        today = self._local(now).date()
+        return min(clear_time for clear_time in
+                   (self._at(day, hour, minute) for day in (today, today + timedelta(days=1))
+                    for hour, minute in clear_times)
+                   if clear_time > now)
@@ -0,0 +1,121 @@
+"""
+Work out which data series an indicator needs and where each one comes from.
+
+A series is identified by its (tariff, region, measure) key, so one database can hold
+prices and intensities for several tariffs and regions side by side, and several
+displays can share one fetcher.
+"""
+
+OCTOPUS_API_BASE = 'https://api.octopus.energy/v1/products/'
+
+AGILE_IMPORT_35 = 'AGILE-18-02-21/electricity-tariffs/E-1R-AGILE-18-02-21-'
+AGILE_IMPORT_55 = 'AGILE-22-07-22/electricity-tariffs/E-1R-AGILE-22-07-22-'
+AGILE_IMPORT_78 = 'AGILE-22-08-31/electricity-tariffs/E-1R-AGILE-22-08-31-'
+AGILE_IMPORT_VAR_100 = 'AGILE-VAR-22-10-19/electricity-tariffs/E-1R-AGILE-VAR-22-10-19-'
+AGILE_IMPORT_FLEX_100 = 'AGILE-24-04-03/electricity-tariffs/E-1R-AGILE-24-04-03-'
+
+AGILE_IMPORT_CAPS = {35: AGILE_IMPORT_35,
+                     55: AGILE_IMPORT_55,
+                     78: AGILE_IMPORT_78,
+                     100: AGILE_IMPORT_VAR_100,
+                     101: AGILE_IMPORT_FLEX_100}
+
+AGILE_EXPORT = 'AGILE-OUTGOING-19-05-13/electricity-tariffs/E-1R-AGILE-OUTGOING-19-05-13-'
+
+AGILE_REGIONS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'P', 'N', 'J', 'H', 'K', 'L', 'M']
+
+AGILE_API_TAIL = "/standard-unit-rates/"
+
+TRACKER_ELECTRICITY = 'SILVER-VAR-22-10-21/electricity-tariffs/E-1R-SILVER-VAR-22-10-21-'
+TRACKER_GAS = 'SILVER-VAR-22-10-21/gas-tariffs/G-1R-SILVER-VAR-22-10-21-'
+
+CARBON_API_BASE = 'https://api.carbonintensity.org.uk'
+
+CARBON_TARIFF = 'carbon-intensity' # not really a tariff, but it keys the series the same way
+
+CARBON_REGIONS = {'A': '/regional/intensity/{from_time}/fw48h/regionid/10',
+                  'B': '/regional/intensity/{from_time}/fw48h/regionid/9',
+                  'C': '/regional/intensity/{from_time}/fw48h/regionid/13',
+                  'D': '/regional/intensity/{from_time}/fw48h/regionid/6',
+                  'E': '/regional/intensity/{from_time}/fw48h/regionid/8',
+                  'F': '/regional/intensity/{from_time}/fw48h/regionid/4',
+                  'G': '/regional/intensity/{from_time}/fw48h/regionid/3',
+                  'P': '/regional/intensity/{from_time}/fw48h/regionid/1',
+                  'N': '/regional/intensity/{from_time}/fw48h/regionid/2',
+                  'J': '/regional/intensity/{from_time}/fw48h/regionid/14',
+                  'H': '/regional/intensity/{from_time}/fw48h/regionid/12',
+                  'K': '/regional/intensity/{from_time}/fw48h/regionid/7',
+                  'L': '/regional/intensity/{from_time}/fw48h/regionid/11',
+                  'M': '/regional/intensity/{from_time}/fw48h/regionid/5',
+                  'Z': '/intensity/{from_time}/fw48h'}
+
+HALF_HOUR = 1800 # seconds
+ONE_DAY = 86400 # seconds
+
+def octopus_series(path: str, region: str, kind: str, role: str, slot_length: int) -> dict:
+    """Describe one Octopus tariff's unit rates for a region."""
+    return {'tariff': path.rsplit('/', 1)[1] + region,
+            'region': region,
+            'measure': 'value_inc_vat',
+            'source': 'octopus',
+            'kind': kind,
+            'role': role,
+            'path': path + region + AGILE_API_TAIL,
+            'slot_length': slot_length}
+
+def mode_series(mode: str, region: str, agile_cap: int = None) -> list:
+    """Return the series that a given mode displays, for a given DNO region."""
+
+    if mode == 'carbon':
+        if region not in CARBON_REGIONS:
+            raise SystemExit('Error: DNO region ' + region + ' is not a valid choice.')
+        return [{'tariff': CARBON_TARIFF,
+                 'region': region,
+                 'measure': 'intensity',
+                 'source': 'carbon',
+                 'kind': 'carbon',
+                 'role': 'carbon',
+                 'path': CARBON_REGIONS[region],
+                 'slot_length': HALF_HOUR}]
+
+    if region not in AGILE_REGIONS:
+        raise SystemExit('Error: DNO region ' + region + ' is not a valid choice.')
+
+    if mode == 'agile_import':
+        if agile_cap not in AGILE_IMPORT_CAPS:
+            raise SystemExit('Error: Agile cap of ' + str(agile_cap) + ' refers to an unknown tariff.')
+        return [octopus_series(AGILE_IMPORT_CAPS[agile_cap], region, 'agile', 'electricity',
+                               HALF_HOUR)]
+
+    if mode == 'agile_export':
+        return [octopus_series(AGILE_EXPORT, region, 'agile', 'electricity', HALF_HOUR)]
+
+    if mode == 'tracker':
+        return [octopus_series(TRACKER_ELECTRICITY, region, 'tracker', 'electricity', ONE_DAY),
+                octopus_series(TRACKER_GAS, region, 'tracker', 'gas', ONE_DAY)]
+
+    raise SystemExit('Error: Invalid mode ' + mode)
+
+def series_key(series: dict) -> tuple:
+    """The (tariff, region, measure) key a series is stored under."""
+    return series['tariff'], series['region'], series['measure']
+
+def display_series(config: dict) -> list:
+    """The series this indicator's own display needs."""
+    return mode_series(config['Mode'], config['DNORegion'], config.get('AgileCap'))
+
+def configured_series(config: dict) -> list:
+    """Every series this indicator should fetch: the ones its own display needs, plus
+    any listed under ExtraSeries for other displays sharing the same database."""
+
+    all_series = display_series(config)
+
+    for extra in config.get('ExtraSeries') or []:
+        all_series += mode_series(extra['Mode'], extra['DNORegion'], extra.get('AgileCap'))
+
+    # the same series may well be asked for more than once
+    unique_series = {}
+    for series in all_series:
+        unique_series.setdefault(series_key(series), series)
+
+    return list(unique_series.values())
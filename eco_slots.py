@@ -0,0 +1,55 @@
+"""
+A compact, pre-parsed form of the slots read from the database.
+
+Rows are turned into a SlotSeries once, when they are read, so that the display code
+never has to parse a date string or convert a timezone itself.
+"""
+
+from array import array
+from datetime import datetime, timezone
+from math import isnan
+
+MISSING = float('nan') # a slot with no value, e.g. tomorrow's gas price before it's published
+
+class SlotSeries:
+    """One series of slots in time order (or reverse time order, for Tracker).
+
+    starts: slot start times as UNIX timestamps (array of int64)
+    values: the value for each slot (array of float64), MISSING where there isn't one
+    local_times: the slot start times as timezone-aware datetimes in local time
+    """
+
+    __slots__ = ('starts', 'values', 'local_times')
+
+    def __init__(self, starts, values):
+        self.starts = array('q', starts)
+        self.values = array('d', values)
+        self.local_times = [datetime.fromtimestamp(start, timezone.utc).astimezone()
+                            for start in self.starts]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def has_value(self, index: int) -> bool:
+        """Whether there's a value for this slot."""
+        return not isnan(self.values[index])
+
+    def hhmm(self, index: int) -> str:
+        """The local start time of a slot as HH:MM."""
+        return self.local_times[index].strftime("%H:%M")
+
+def from_rows(rows, columns: int) -> list:
+    """Split rows of (valid_from, value, value, ...) as read from the database into one
+    SlotSeries per value column, sharing the same slot times. NULLs become MISSING.
+
+    'rows' is only read once, straight into arrays, so it can be a database cursor
+    and the rows never need to be held as a list of tuples."""
+
+    starts = array('q')
+    values = [array('d') for _ in range(columns)]
+    for row in rows:
+        starts.append(row[0])
+        for column, column_values in enumerate(values, 1):
+            value = row[column]
+            column_values.append(MISSING if value is None else value)
+    return [SlotSeries(starts, column_values) for column_values in values]
@@ -0,0 +1,76 @@
+"""
+Summary statistics over a series of half-hourly values, shared by the Blinkt! and
+Inky pHAT displays.
+
+Everything here works from running (prefix) sums, so the mean of any window of
+slots is one subtraction rather than a fresh sum, however long the window is.
+"""
+
+from heapq import nlargest
+from itertools import accumulate
+
+def prefix_sums(values: list) -> list:
+    """Running totals with a leading zero, so that the sum of values[i:j]
+    is sums[j] - sums[i]."""
+    return list(accumulate(values, initial=0))
+
+def window_means(values: list, window: int, sums: list = None) -> list:
+    """The mean of every run of 'window' consecutive values, in order of where the run
+    starts. This includes the run ending at the last value."""
+    if sums is None:
+        sums = prefix_sums(values)
+    return [(sums[i + window] - sums[i]) / window for i in range(len(values) - window + 1)]
+
+def block_means(values: list, block: int, sums: list = None) -> list:
+    """The mean of each consecutive block of 'block' values, e.g. to group slots
+    into pixels. The last block may be shorter if the values don't divide evenly."""
+    if sums is None:
+        sums = prefix_sums(values)
+    means = []
+    for start in range(0, len(values), block):
+        end = min(start + block, len(values))
+        means.append((sums[end] - sums[start]) / (end - start))
+    return means
+
+def best_windows(means: list, window: int, top_k: int, highest: bool) -> list:
+    """Pick up to 'top_k' windows with the lowest (or highest) mean which don't overlap
+    each other, best first. Returns a list of (start index, mean) tuples. Where windows
+    tie, the earliest one wins."""
+    sign = -1 if highest else 1
+    order = sorted(range(len(means)), key=lambda i: (sign * means[i], i))
+
+    chosen = []
+    for start in order:
+        if all(abs(start - other) >= window for other, _ in chosen):
+            chosen.append((start, means[start]))
+            if len(chosen) == top_k:
+                break
+    return chosen
+
+def window_stats(values: list, window: int, top_k: int = 1, trim_highest: int = 6) -> dict:
+    """Work out everything the displays need to know about a series in one go:
+
+    lowest_windows / highest_windows: up to top_k non-overlapping (start index, mean)
+        tuples for the cheapest/dearest runs of 'window' slots, best first
+    min_index / max_index: where the single lowest/highest value is (first if tied)
+    trimmed_mean: the mean once the 'trim_highest' highest values are left out, so a
+        short evening peak doesn't drag the average line up
+    """
+
+    sums = prefix_sums(values)
+    means = window_means(values, window, sums)
+
+    min_index = min(range(len(values)), key=values.__getitem__)
+    max_index = max(range(len(values)), key=values.__getitem__)
+
+    if len(values) > trim_highest:
+        trimmed_mean = ((sums[-1] - sum(nlargest(trim_highest, values))) /
+                        (len(values) - trim_highest))
+    else:
+        trimmed_mean = sums[-1] / len(values)
+
+    return {'lowest_windows': best_windows(means, window, top_k, False),
+            'highest_windows': best_windows(means, window, top_k, True),
+            'min_index': min_index,
+            'max_index': max_index,
+            'trimmed_mean': trimmed_mean}
@@ -0,0 +1,104 @@
+"""
+Read a JSON object from the network a piece at a time.
+
+An API page such as Octopus's {"count": ..., "next": ..., "results": [...]} is
+parsed as its bytes arrive, and the items of its big list are handed out one at a
+time, so only a chunk of text and the item being read are ever held in memory, no
+matter how big the page is. This only uses the standard library's JSON decoder, one
+value at a time.
+"""
+
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+
+_DECODER = json.JSONDecoder()
+
+class StreamedObject:
+    """A JSON object read from an iterable of byte chunks (e.g. a requests response's
+    iter_content()). Iterating over it gives the items of the list under 'array_key'
+    as they're read; once that's finished, 'fields' holds the object's other members.
+    Raises ValueError if the JSON is broken or isn't an object."""
+
+    def __init__(self, chunks, array_key: str):
+        self.chunks = iter(chunks)
+        self.array_key = array_key
+        self.fields = {}
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.finished = False
+
+    def _more(self) -> bool:
+        """Read the next chunk onto the end of the buffer, dropping what's already been
+        parsed from the start of it. Returns False if there's nothing left to read."""
+        if self.finished:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.finished = True
+            chunk = b''
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.finished)
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """The next character that isn't whitespace, or '' at the end."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._more():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        """Step over the next character, which must be one of 'chars'."""
+        char = self._peek()
+        if char == '' or char not in chars:
+            raise ValueError('Expected one of ' + repr(chars) + ' in JSON, found ' +
+                             (repr(char) if char else 'the end'))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next whole JSON value, reading as much as it takes."""
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+            # a number at the very end of the buffer might carry on in the next chunk
+            if end == len(self.buffer) and self._more():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == self.array_key:
+                self._expect('[')
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.fields[key] = self._value()
+
+            if self._expect(',}') == '}':
+                return
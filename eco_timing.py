@@ -0,0 +1,155 @@
+"""
+Lightweight timing of the phases of a piece of work, e.g. drawing a frame, and of the
+spans of work done by each run - API requests, database writes and queries, drawing.
+
+Timing a span only costs two clock readings and adding it to a list, so the scripts
+time everything all the time. write_metrics() then writes the spans out once a run
+(or a round of a long-running process) is over: as JSON lines to a log file that's
+rotated once it gets big, and, if Metrics: TextfileDir is set in the config, as a
+Prometheus textfile that node_exporter's textfile collector can pick up.
+"""
+
+import os
+from time import perf_counter, time
+
+# spans timed since they were last written out, as (name, UNIX start time, seconds,
+# fields). Appending is safe from the fetching threads too.
+SPANS = []
+
+# while a run is being profiled, the eco_profile.Profiler to tell where each phase
+# starts and ends
+PROFILER = None
+
+# for the textfile: each span's (count, seconds, errors, end time) on the last run
+# that had any, so a long-running process's fetches aren't forgotten as it repaints
+LATEST = {}
+
+class PhaseTimer:
+    """Split elapsed time between named phases. Each call to lap() charges the time
+    since the previous lap (or since the timer was made) to the phase named, so work
+    that's done in several separate pieces adds up under one name."""
+
+    def __init__(self):
+        self.totals = {}
+        if PROFILER is not None:
+            PROFILER.lap()
+        self._last = perf_counter()
+
+    def lap(self, phase: str):
+        """Charge the time since the last lap to 'phase'."""
+        now = perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0) + now - self._last
+        if PROFILER is not None:
+            PROFILER.lap(phase)
+        self._last = perf_counter() if PROFILER is not None else now
+
+    def record(self, prefix: str):
+        """Keep each phase's total as a span named e.g. 'render_data_prep'."""
+        for phase, seconds in self.totals.items():
+            record(prefix + '_' + phase.replace(' ', '_'), seconds)
+
+class Span:
+    """Time the work done in a with block, e.g.
+
+        with eco_timing.Span('db_query', mode='carbon') as span:
+            ...
+            span.fields['rows'] = len(rows)
+
+    If the block raises, the span is kept with the error in its 'error' field."""
+
+    __slots__ = ('name', 'fields', 'start', '_began')
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+        self._began = None
+
+    def __enter__(self):
+        if PROFILER is not None:
+            PROFILER.enter(self.name)
+        self.start = time()
+        self._began = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.fields['error'] = str(exc) or exc_type.__name__
+        SPANS.append((self.name, self.start, perf_counter() - self._began, self.fields))
+        if PROFILER is not None:
+            PROFILER.exit()
+        return False
+
+def record(name: str, seconds: float, **fields):
+    """Keep a span that was timed some other way, ending now."""
+    SPANS.append((name, time() - seconds, seconds, fields))
+
+def rotate(filename: str, max_bytes: int, backups: int):
+    """If a log has grown past max_bytes, move it to filename.1, that to filename.2 and
+    so on, keeping 'backups' old logs."""
+    try:
+        if os.path.getsize(filename) < max_bytes:
+            return
+    except OSError:
+        return # no log yet
+    if backups == 0:
+        os.remove(filename)
+        return
+    for backup in range(backups - 1, 0, -1):
+        if os.path.exists(filename + '.' + str(backup)):
+            os.replace(filename + '.' + str(backup), filename + '.' + str(backup + 1))
+    os.replace(filename, filename + '.1')
+
+def textfile(command: str) -> str:
+    """The latest timings of every span, in the Prometheus text format."""
+    def label(name: str) -> str:
+        return '{command="' + command + '",span="' + name + '"}'
+
+    lines = []
+    for metric, description, column in (
+            ('eco_indicator_span_seconds', 'Seconds spent in each span on its last run.', 1),
+            ('eco_indicator_span_count', 'How many times each span ran on its last run.', 0),
+            ('eco_indicator_span_errors', 'How many times each span failed on its last run.', 2),
+            ('eco_indicator_span_last_run_timestamp_seconds', 'When each span last ran.', 3)):
+        lines.append('# HELP ' + metric + ' ' + description)
+        lines.append('# TYPE ' + metric + ' gauge')
+        for name, latest in sorted(LATEST.items()):
+            lines.append(metric + label(name) + ' ' + repr(round(latest[column], 6)))
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(config: dict, command: str):
+    """Write out the spans timed since last time, for the command named (e.g. 'store'),
+    as the config's Metrics section says, and forget them."""
+    import json
+
+    spans = SPANS[:]
+    del SPANS[:len(spans)]
+    if not spans or config is None:
+        return
+
+    metrics = config['Metrics']
+    run = {}
+    for name, start, seconds, fields in spans:
+        count, total, errors, _ = run.get(name, (0, 0, 0, 0))
+        run[name] = (count + 1, total + seconds, errors + ('error' in fields), start + seconds)
+    LATEST.update(run)
+
+    try:
+        if metrics['LogFile']:
+            rotate(metrics['LogFile'], metrics['LogMaxKB'] * 1024, metrics['LogBackups'])
+            with open(metrics['LogFile'], 'a', encoding='utf-8') as log_file:
+                log_file.write(''.join(
+                    json.dumps(dict({'time': round(start, 3), 'command': command, 'span': name,
+                                     'seconds': round(seconds, 6)}, **fields),
+                               separators=(',', ':'), default=str) + '\n'
+                    for name, start, seconds, fields in spans))
+
+        if metrics.get('TextfileDir'):
+            # written whole and then renamed, so the collector never reads half a file
+            prom_file = os.path.join(metrics['TextfileDir'], 'eco_indicator_' + command + '.prom')
+            with open(prom_file + '.tmp', 'w', encoding='utf-8') as tmp_file:
+                tmp_file.write(textfile(command))
+            os.replace(prom_file + '.tmp', prom_file)
+
+    except OSError as error:
+        print('Unable to write metrics: ' + str(error))
@@ -0,0 +1,80 @@
+"""
+A stand-in for an Inky pHAT that only needs PIL, for drawing frames without the
+hardware: to look at them, benchmark them or check them against known-good images.
+
+It has the parts of the Inky library's interface that the drawing code uses, so it
+can be passed anywhere an inky_display from get_inky_display() is accepted.
+"""
+
+# the Inky pHAT's palette indices, and the colours to save them as
+WHITE = 0
+BLACK = 1
+RED = 2
+YELLOW = 2 # red and yellow pHATs use the same index for their third colour
+
+PALETTES = {'red': (255, 255, 255, 0, 0, 0, 200, 0, 0),
+            'yellow': (255, 255, 255, 0, 0, 0, 220, 180, 0)}
+
+RESOLUTIONS = ((212, 104), (250, 122))
+
+BORDER_WIDTH = 4 # pixels of border colour around a saved frame, like the real panel
+
+class VirtualInky:
+    """An Inky pHAT that keeps the frames it's asked to show instead of showing them."""
+
+    WHITE = WHITE
+    BLACK = BLACK
+    RED = RED
+    YELLOW = YELLOW
+
+    def __init__(self, resolution: tuple = (250, 122), colour: str = 'red'):
+        if resolution not in RESOLUTIONS:
+            raise ValueError('Unsupported Inky pHAT resolution ' + str(resolution))
+        if colour not in PALETTES:
+            raise ValueError('Unsupported Inky pHAT colour ' + colour)
+
+        self.resolution = resolution
+        self.WIDTH, self.HEIGHT = resolution
+        self.colour = colour
+        self.border_colour = WHITE
+        self.image = None
+        self.shown = None       # the last frame show() was called for...
+        self.shown_border = None # ...and the border it was shown with
+        self.show_count = 0
+        self.frame_hash_file = None # always show every frame, see eco_indicator.show_frame()
+
+    def set_border(self, colour: int):
+        """Set the colour of the border around the display area."""
+        self.border_colour = colour
+
+    def set_image(self, image):
+        """Set the frame to show next, a palette image the size of the display."""
+        if image.size != self.resolution:
+            raise ValueError('Image is ' + str(image.size) + ', display is ' + str(self.resolution))
+        self.image = image.copy()
+
+    def show(self):
+        """'Refresh' the display with the frame from set_image()."""
+        if self.image is None:
+            raise ValueError('No image set')
+        self.shown = self.image
+        self.shown_border = self.border_colour
+        self.show_count += 1
+
+    def render(self):
+        """The last frame shown as an RGB image, as it would look on the panel,
+        border included."""
+        from PIL import ImageOps
+
+        if self.shown is None:
+            raise ValueError('Nothing has been shown yet')
+
+        palette = PALETTES[self.colour]
+        frame = self.shown.copy()
+        frame.putpalette(palette)
+        border_rgb = tuple(palette[self.shown_border * 3:self.shown_border * 3 + 3])
+        return ImageOps.expand(frame.convert('RGB'), border=BORDER_WIDTH, fill=border_rgb)
+
+    def save(self, filename: str):
+        """Save the last frame shown, e.g. as a PNG."""
+        self.render().save(filename)
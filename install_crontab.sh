@@ -22,6 +22,11 @@ function parse_yaml {
    }'
 }
 
+# every job appends to the log, so start a new one each night, keeping the day before's
+function install_log_rotation {
+    (crontab -l 2>/dev/null; echo "0 0 * * * /bin/mv -f $LOG_FILE $LOG_FILE.1") | crontab -
+}
+
 if crontab -l 2>/dev/null | grep -q $INSTALL_DIR; then
     echo "It looks like our crontab may already exist. Aborting..."
     exit 1
@@ -38,22 +43,24 @@ if [ "$CONF_Mode" = "carbon" ]; then
     DELAY=$(( RANDOM % 60 ))
 	DELAYPLUS=$(( DELAY + 10 ))
     echo "Installing pi-eco-indicator cron jobs for $CONF_Mode mode..."
-	(crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
-	(crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep $DELAY; $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-	(crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep $DELAYPLUS; $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
+	(crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+	(crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep $DELAY; $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+	(crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep $DELAYPLUS; $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+	install_log_rotation
 	echo "Done."
 	exit 0
 
 elif [ "$CONF_Mode" = "agile_import" ] || [ "$CONF_Mode" = "agile_export" ]; then
     MINUTES=$(( 30 + RANDOM % 29 ))
     echo "Installing pi-eco-indicator cron jobs for $CONF_Mode mode..."
-    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep 5; $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "$MINUTES 16 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "$MINUTES 18 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "$MINUTES 20 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "*/30 * * * * /bin/sleep 5; $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "$MINUTES 16 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "$MINUTES 18 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "$MINUTES 20 * * * $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    install_log_rotation
     echo "Done."
     exit 0
 
@@ -61,10 +68,11 @@ elif [ "$CONF_Mode" = "tracker" ]; then
     MINUTES=$(( RANDOM % 58 ))
     MINUTESPLUS=$(( MINUTES + 1 ))
     echo "Installing pi-eco-indicator cron jobs for $CONF_Mode mode..."
-    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "$MINUTES * * * * $PYTHON_BIN $INSTALL_DIR/store_data.py > $LOG_FILE 2>&1") | crontab -
-    (crontab -l 2>/dev/null; echo "$MINUTESPLUS * * * * $PYTHON_BIN $INSTALL_DIR/update_display.py > $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 30; $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "@reboot /bin/sleep 40; $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "$MINUTES * * * * $PYTHON_BIN $INSTALL_DIR/store_data.py >> $LOG_FILE 2>&1") | crontab -
+    (crontab -l 2>/dev/null; echo "$MINUTESPLUS * * * * $PYTHON_BIN $INSTALL_DIR/update_display.py >> $LOG_FILE 2>&1") | crontab -
+    install_log_rotation
     echo "Done."
     exit 0
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""Run as a single long-lived process instead of the cron jobs installed by
+install_crontab.sh. Fetches data on the same timetable as the cron jobs and repaints
+the display exactly on slot boundaries, reusing one database connection, one HTTP
+session and one display handle for its whole lifetime."""
+
+import os
+import sys
+import time
+import argparse
+import eco_indicator
+import eco_config
+import eco_blinkt
+import eco_profile
+import eco_scheduler
+import eco_timing
+import store_data
+import update_display
+
+CONFIG_CHECK_SECONDS = 5 # how often to look for changes to the config file
+
+def failed(what: str, error: BaseException):
+    """Log something going wrong that we can carry on from."""
+    if isinstance(error, SystemExit):
+        print(what + ' failed: ' + str(error))
+    else:
+        print(what + ' failed: ' + type(error).__name__ + ': ' + str(error))
+
+def fetch(conn, config: dict, session) -> bool:
+    """Fetch and store new data, carrying on if the API gives up on us or anything
+    else goes wrong, e.g. the database is locked. Returns whether it worked."""
+    try:
+        store_data.fetch_and_store(conn, config, session)
+    except (SystemExit, Exception) as error: # pylint: disable=broad-except
+        failed('Fetch', error)
+        return False
+    return True
+
+def repaint(conn, config: dict, inky_display, demo: bool, animator=None) -> bool:
+    """Redraw the display from the database, carrying on if there's nothing to show yet
+    or anything else goes wrong. Returns whether it worked."""
+    try:
+        slots = update_display.read_data(conn, config)
+        stats = update_display.read_summary(conn, config, slots)
+        update_display.update_display(config, slots, demo, inky_display, animator, stats)
+    except (SystemExit, Exception) as error: # pylint: disable=broad-except
+        failed('Display update', error)
+        return False
+    return True
+
+def clear(config: dict, inky_display):
+    """Clear the display to get rid of any ghosting, carrying on if that fails."""
+    try:
+        eco_indicator.clear_display(config, inky_display)
+    except (SystemExit, Exception) as error: # pylint: disable=broad-except
+        failed('Clearing the display', error)
+
+def reload_config(conf_file: str, config: dict, animator, now: float) -> tuple:
+    """Read the config file again after it's been edited. Returns the new config and
+    Blinkt! animator, or the old ones if the new config is broken or can't be switched
+    to without a restart."""
+
+    print('Config file changed, reloading...')
+    try:
+        new_config = eco_config.get_config(conf_file)
+        if new_config['DisplayType'] != config['DisplayType']:
+            raise SystemExit('restart to change DisplayType.')
+        if animator is not None:
+            # carry on from the colours that are showing now
+            new_animator = eco_blinkt.BlinktAnimator(new_config, animator.blinkt)
+            new_animator.target = animator.colours_at(now)
+            new_animator.shown = animator.shown
+            animator = new_animator
+    except SystemExit as error:
+        print('Keeping the old config: ' + str(error))
+        return config, animator
+    return new_config, animator
+
+def run(conn, config: dict, session, inky_display, scheduler: eco_scheduler.Scheduler,
+        demo: bool = False, clock=time.time, sleep=time.sleep,
+        animator: eco_blinkt.BlinktAnimator = None, conf_file: str = None):
+    """Loop forever, fetching, repainting and clearing whenever the scheduler says so,
+    and running the Blinkt! animator's frames in between if there is one. A fetch or
+    repaint that fails is tried again with the scheduler's backoff. Given the name of
+    the config file, picks up any changes to it as it goes.
+    'clock' and 'sleep' can be replaced to drive the loop from a fake clock."""
+
+    def clear_times():
+        if config['DisplayType'] == 'inkyphat':
+            return config['InkyPHAT']['ClearAt']
+        return []
+
+    config_stamp = eco_config.config_stamp(conf_file) if conf_file is not None else None
+
+    now = clock()
+    next_fetch = now # get fresh data straight away, just like the @reboot cron job
+    next_repaint = now
+    next_clear = scheduler.next_clear(now, clear_times())
+    fetch_failures = repaint_failures = 0
+
+    while True:
+        now = clock()
+
+        if conf_file is not None and eco_config.config_stamp(conf_file) != config_stamp:
+            config_stamp = eco_config.config_stamp(conf_file)
+            new_config, animator = reload_config(conf_file, config, animator, now)
+            if new_config is not config:
+                if new_config['Mode'] != config['Mode']:
+                    scheduler = eco_scheduler.Scheduler(new_config['Mode'], tz=scheduler.tz)
+                config = new_config
+                next_clear = scheduler.next_clear(now, clear_times())
+                next_fetch = now # the data we need may have changed too
+                next_repaint = now
+
+        if next_clear is not None and now >= next_clear:
+            clear(config, inky_display)
+            next_clear = scheduler.next_clear(clock(), clear_times())
+            next_repaint = now # and put the data straight back up
+
+        if now >= next_fetch:
+            if fetch(conn, config, session):
+                fetch_failures = 0
+                next_fetch = scheduler.next_fetch(clock())
+                # come back sooner if a failed request is waiting to be retried
+                retry = store_data.next_retry(conn)
+                if retry is not None and clock() < retry < next_fetch:
+                    next_fetch = retry
+            else:
+                fetch_failures += 1
+                next_fetch = min(scheduler.next_fetch(clock()),
+                                 scheduler.next_retry(clock(), fetch_failures))
+
+        if now >= next_repaint:
+            next_repaint = scheduler.next_repaint(clock())
+            if repaint(conn, config, inky_display, demo, animator):
+                repaint_failures = 0
+            else:
+                repaint_failures += 1
+                next_repaint = min(next_repaint, scheduler.next_retry(clock(), repaint_failures))
+
+        eco_timing.write_metrics(config, 'daemon')
+
+        wake = min(next_fetch, next_repaint)
+        if next_clear is not None:
+            wake = min(wake, next_clear)
+        if conf_file is not None:
+            wake = min(wake, now + CONFIG_CHECK_SECONDS)
+
+        if animator is not None:
+            next_frame = animator.frame(clock())
+            if next_frame is not None:
+                wake = min(wake, next_frame)
+        sleep(max(0, wake - clock()))
+
+def main(argv: list = None):
+    """Set everything up once and then hand over to the scheduler loop."""
+    parser = argparse.ArgumentParser(description=('Fetch data and update the display from one long-running process'))
+    parser.add_argument('--demo', '-d', action='store_true', help='display demo data')
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    eco_profile.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    conf_file = args.conf
+
+    os.chdir(sys.path[0])
+
+    with eco_profile.profiling(args.profile, 'daemon'):
+        config = eco_config.get_config(conf_file)
+
+        conn = store_data.open_database(config)
+        session = store_data.make_session()
+
+        inky_display = None
+        animator = None
+
+        if config['DisplayType'] == 'inkyphat':
+            inky_display = eco_indicator.get_inky_display()
+        elif config['DisplayType'] == 'blinkt' and not args.demo:
+            animator = eco_blinkt.BlinktAnimator(config)
+
+        scheduler = eco_scheduler.Scheduler(config['Mode'])
+
+        try:
+            run(conn, config, session, inky_display, scheduler, args.demo, animator=animator,
+                conf_file=conf_file)
+        except KeyboardInterrupt:
+            print('Stopping.')
+        finally:
+            session.close()
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+
+"""Fetch data for a whole fleet of indicators in one place and hand it out to them.
+
+This runs store_data.py's fetching on the same timetable as the cron jobs, for every
+series in its config (list the other indicators' modes and regions under ExtraSeries),
+so each region is fetched from the APIs once however many indicators show it. The
+slots each display needs - exactly the rows update_display.py reads from its own
+database - are served over HTTP or a Unix socket as JSON, e.g.
+
+    GET /slots?mode=agile_import&region=B&cap=101&limit=48
+
+Each answer has an ETag, and is kept until new data is stored or the current slot
+moves on, so an indicator that already has the latest data (see DataServer in
+config.yaml.default) gets a 304 Not Modified without its slots being selected again."""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import eco_config
+import eco_db
+import eco_profile
+import eco_scheduler
+import eco_series
+import eco_timing
+import run_daemon
+import store_data
+import update_display
+
+DEFAULT_PORT = 8080
+MAX_LIMIT = 1000 # the most slots anyone can ask for at once
+MAX_ANSWERS = 64 # how many different answers to keep at once
+
+class SlotCache:
+    """The answers to the latest queries made since the data or the current slot last
+    changed, up to MAX_ANSWERS of them, least recently asked for first. Only used from
+    the server's own thread."""
+
+    def __init__(self):
+        self.conn = None
+        self.stamp = None
+        self.answers = {}
+
+    def answer(self, query: dict) -> tuple:
+        """The (ETag, JSON body) answering a query for a mode, region, AgileCap and
+        number of slots. Raises ValueError if the query doesn't make sense, or
+        LookupError if there's no data for it."""
+
+        try:
+            mode = query['mode']
+            region = query['region']
+            cap = int(query['cap']) if 'cap' in query else None
+            limit = int(query['limit'])
+        except (KeyError, ValueError) as error:
+            raise ValueError('need mode, region, limit and, for agile_import, cap') from error
+        if not 0 < limit <= MAX_LIMIT:
+            raise ValueError('limit must be from 1 to ' + str(MAX_LIMIT))
+
+        try:
+            series_list = eco_series.mode_series(mode, region, cap)
+        except SystemExit as error:
+            raise ValueError(str(error)) from error
+
+        if self.conn is None:
+            self.conn = eco_db.open_read_only()
+
+        # data_version changes whenever another connection (the fetching) commits
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        stamp = (data_version, int(time.time()) // eco_series.HALF_HOUR)
+        if stamp != self.stamp:
+            # every answer we have is out of date
+            self.answers.clear()
+            self.stamp = stamp
+
+        key = (mode, region, cap, limit)
+        cached = self.answers.pop(key, None)
+        if cached is not None:
+            self.answers[key] = cached # now the most recently asked for
+            return cached
+
+        try:
+            roles, cursor = update_display.select_slots(self.conn, series_list,
+                                                        mode == 'tracker', limit)
+        except SystemExit as error:
+            raise LookupError(str(error)) from error
+
+        body = json.dumps({'roles': roles, 'rows': cursor.fetchall()},
+                          separators=(',', ':')).encode('utf-8')
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+        self.answers[key] = (etag, body)
+        if len(self.answers) > MAX_ANSWERS:
+            del self.answers[next(iter(self.answers))]
+        return etag, body
+
+class SlotHandler(BaseHTTPRequestHandler):
+    """Answers GET /slots?... from the server's SlotCache."""
+
+    server_version = 'EcoIndicator/1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """Send the slots asked for, or just 304 if the asker has them already."""
+        url = urlsplit(self.path)
+        if url.path != '/slots':
+            self.send_error(404, 'Only /slots is served here')
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            etag, body = self.server.slot_cache.answer(query)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+        except LookupError as error:
+            self.send_error(404, str(error))
+            return
+
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # there's no address for a client on a Unix socket
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTPServer's job, over a Unix socket."""
+
+    def server_bind(self):
+        # a socket file left behind by an earlier run would stop us binding
+        if os.path.exists(self.server_address) and not os.path.isfile(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+def make_server(listen: str):
+    """An HTTP server listening on unix:/path/to/socket, or on [host]:port."""
+    if listen.startswith('unix:'):
+        server = UnixHTTPServer(listen[len('unix:'):], SlotHandler)
+    else:
+        host, _, port = listen.rpartition(':')
+        try:
+            server = HTTPServer((host, int(port)), SlotHandler)
+        except ValueError as error:
+            raise SystemExit('Error: listen on host:port or unix:/path/to/socket, not ' +
+                             listen) from error
+        except OSError as error:
+            raise SystemExit('Error: unable to listen on ' + listen + ': ' + str(error)) from error
+    server.slot_cache = SlotCache()
+    return server
+
+def main(argv: list = None):
+    """Serve slots from a background thread while fetching in the foreground."""
+    parser = argparse.ArgumentParser(description=('Fetch data for every configured series and '
+                                                  'serve it to other indicators'))
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    parser.add_argument('--listen', '-l', default=':' + str(DEFAULT_PORT),
+                        help='[host]:port or unix:/path/to/socket to serve on '
+                             '(default: port ' + str(DEFAULT_PORT) + ' on every interface)')
+    eco_profile.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    conf_file = args.conf
+
+    os.chdir(sys.path[0])
+
+    with eco_profile.profiling(args.profile, 'serve'):
+        config = eco_config.get_config(conf_file)
+
+        conn = store_data.open_database(config)
+        session = store_data.make_session()
+
+        # the fetching has to keep to the timetable of every mode being served
+        modes = {series_config['Mode'] for series_config in [config] + (config.get('ExtraSeries') or [])}
+        schedulers = [eco_scheduler.Scheduler(mode) for mode in sorted(modes)]
+
+        server = make_server(args.listen)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print('Serving ' + ', '.join(series['tariff'] for series in eco_series.configured_series(config)) +
+              ' on ' + args.listen)
+
+        failures = 0
+        try:
+            while True:
+                fetched = run_daemon.fetch(conn, config, session)
+                eco_timing.write_metrics(config, 'serve')
+                now = time.time()
+                next_fetch = min(scheduler.next_fetch(now) for scheduler in schedulers)
+                if fetched:
+                    failures = 0
+                    # come back sooner if a failed request is waiting to be retried
+                    retry = store_data.next_retry(conn)
+                    if retry is not None and now < retry < next_fetch:
+                        next_fetch = retry
+                else:
+                    failures += 1
+                    next_fetch = min(next_fetch, schedulers[0].next_retry(now, failures))
+                time.sleep(max(0, next_fetch - time.time()))
+        except KeyboardInterrupt:
+            print('Stopping.')
+        finally:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server, UnixHTTPServer):
+                try:
+                    os.remove(server.server_address)
+                except OSError:
+                    pass
+            session.close()
+            conn.close()
+
+if __name__ == '__main__':
+    main()
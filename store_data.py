@@ -3,378 +3,685 @@
 
 """Use the public Octopus Energy API to request the half-hourly rates for the Agile tariff
 for a particular region, and insert these into an SQLite database, dealing with duplicate
-requests and pruning old data so that the DB doesn't grow infinitely."""
+requests and pruning old data so that the DB doesn't grow infinitely.
+
+Every series in the config is fetched in the same run - the one for this indicator's
+own display plus any listed under ExtraSeries for other displays sharing the database."""
 
 import sqlite3
+import json
 import os
 import sys
 import time
+import random
 from reprlib import Repr
-from datetime import datetime, timedelta
-from urllib.request import pathname2url
-import pytz
-import requests
+from datetime import datetime, timedelta, timezone
+from calendar import timegm
 import argparse
-import eco_indicator
+import eco_config
+import eco_db
+import eco_profile
+import eco_series
+import eco_stats
+import eco_timing
+
+# When an API request fails we don't wait around for it, we record when to try again
+# and leave it to the next run. The delay doubles with each consecutive failure, with
+# some random jitter so that lots of indicators don't all retry at the same moment.
+RETRY_BASE_DELAY = 60 # seconds
+RETRY_MAX_DELAY = 2**14 # seconds, approx 4.5 hours
+
+# After this many consecutive failures we stop asking that API altogether (the circuit
+# breaker "opens") and only try again once the cool-off period has passed.
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_COOL_OFF = 2**14 # seconds
+
+MAX_FEEDS = 8 # the most requests we'll make at once, e.g. electricity, gas, carbon and export
+
+HTTP_CACHE_AGE = 3 * 24 * 3600 # forget cached API responses after this many seconds
+
+# How far ahead each tariff publishes. Agile prices run until 23:00 (local time) and
+# tomorrow's arrive between 16:00 and 20:00; Tracker prices are for a whole day.
+AGILE_PUBLISH_HOUR = 16
+AGILE_LAST_SLOT_END_HOUR = 23
+
+ONE_DAY = 86400 # seconds
+
+# Roll rows that are past their tier's cut-off up into the next tier. Each rolled-up row
+# keeps a mask of the half hours of the day it has counted (bit 0 for 00:00-00:30 UTC up
+# to bit 47), so that if slots it already counted turn up again, e.g. stored again by a
+# later fetch, they're left out rather than counted twice. If a period is already there
+# the slots it hasn't counted yet are combined with it.
+MERGE_ROLLUP = (' ON CONFLICT(series_id, period_start) DO UPDATE SET '
+                'slots = slots + excluded.slots, '
+                'min_value = MIN(min_value, excluded.min_value), '
+                'mean_value = (mean_value * slots + excluded.mean_value * excluded.slots) '
+                '/ (slots + excluded.slots), '
+                'max_value = MAX(max_value, excluded.max_value), '
+                'slot_mask = slot_mask | excluded.slot_mask')
+
+HOURLY_ROLLUP = ('INSERT INTO readings_hourly '
+                 '(series_id, period_start, slots, min_value, mean_value, max_value, slot_mask) '
+                 'SELECT r.series_id, r.valid_from / 3600 * 3600, COUNT(*), MIN(r.value), '
+                 'AVG(r.value), MAX(r.value), SUM(1 << r.valid_from % 86400 / 1800) '
+                 'FROM readings AS r LEFT JOIN readings_hourly AS h '
+                 'ON h.series_id = r.series_id AND h.period_start = r.valid_from / 3600 * 3600 '
+                 'WHERE r.valid_from < ? '
+                 'AND (h.slot_mask IS NULL OR h.slot_mask & (1 << r.valid_from % 86400 / 1800) = 0) '
+                 'GROUP BY 1, 2' + MERGE_ROLLUP)
+
+# An hour whose slots overlap those a day has already counted is left out altogether:
+# its own min/mean/max can't be split up slot by slot.
+DAILY_ROLLUP = ('INSERT INTO readings_daily '
+                '(series_id, period_start, slots, min_value, mean_value, max_value, slot_mask) '
+                'SELECT h.series_id, h.period_start / 86400 * 86400, SUM(h.slots), '
+                'MIN(h.min_value), SUM(h.mean_value * h.slots) / SUM(h.slots), '
+                'MAX(h.max_value), SUM(h.slot_mask) '
+                'FROM readings_hourly AS h LEFT JOIN readings_daily AS d '
+                'ON d.series_id = h.series_id AND d.period_start = h.period_start / 86400 * 86400 '
+                'WHERE h.period_start < ? AND (d.slot_mask IS NULL OR h.slot_mask & d.slot_mask = 0) '
+                'GROUP BY 1, 2' + MERGE_ROLLUP)
+
+class APIRetryLater(Exception):
+    """The API request failed in a way that is worth retrying on a later run."""
+
+def load_cached_response(conn: sqlite3.Connection, _request_uri: str):
+    """Look up a previous response for this URI. Returns a tuple of
+    (etag, last_modified, body) or None if we haven't seen it before."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT etag, last_modified, body FROM http_cache WHERE uri = ?',
+                   (_request_uri,))
+    return cursor.fetchone()
+
+def store_cached_response(conn: sqlite3.Connection, _request_uri: str, response):
+    """Keep the body and validators of a successful response so that next time we
+    can ask the API whether anything has changed rather than downloading it again."""
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag is None and last_modified is None:
+        return # nothing to revalidate with, so no point keeping it
+
+    now = int(time.time())
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO http_cache(uri, etag, last_modified, body, fetched_at) '
+                   'VALUES (?, ?, ?, ?, ?) ON CONFLICT(uri) DO UPDATE SET '
+                   'etag=excluded.etag, last_modified=excluded.last_modified, '
+                   'body=excluded.body, fetched_at=excluded.fetched_at;',
+                   (_request_uri, etag, last_modified, response.text, now))
+    cursor.execute('DELETE FROM http_cache WHERE fetched_at < ?', (now - HTTP_CACHE_AGE,))
+
+def make_session(pool_size: int = MAX_FEEDS):
+    """Create a requests.Session whose connection pool is big enough to keep a
+    connection alive to each API for every feed we might fetch at once."""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_data_from_api(_request_uri: str, session=None, print_data: bool = False,
+                      cached: tuple = None) -> tuple:
+    """using the provided URI, request data from the API and return a JSON object.
+    Errors which are worth retrying later raise APIRetryLater. If a requests.Session
+    is passed in, its pooled connection is reused rather than opening a new one.
+    If a cached (etag, last_modified, body) tuple is passed in, the request is made
+    conditional on it and the cached body is used if nothing has changed.
 
-AGILE_API_BASE = ('https://api.octopus.energy/v1/products/')
+    Returns a tuple of (data, response), where response is None if the cached copy was
+    used. This doesn't touch the database, so it is safe to call from worker threads."""
 
-AGILE_IMPORT_FLEX_100 = ('AGILE-24-04-03/electricity-tariffs/E-1R-AGILE-24-04-03-')
+    import requests
 
-AGILE_EXPORT = ('AGILE-OUTGOING-19-05-13/electricity-tariffs/E-1R-AGILE-OUTGOING-19-05-13-')
+    if session is None:
+        session = requests
 
-AGILE_REGIONS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'P', 'N', 'J', 'H', 'K', 'L', 'M']
+    headers = {}
+    if cached:
+        etag, last_modified, cached_body = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
 
-AGILE_API_TAIL = "/standard-unit-rates/"
+    # Try to handle issues with the API - rare but do happen. Rather than sleeping here
+    # and holding up everything else, we give up straight away and let the caller
+    # schedule a retry for a later run.
 
-TRACKER_ELECTRICITY = 'SILVER-VAR-22-10-21/electricity-tariffs/E-1R-SILVER-VAR-22-10-21-'
-TRACKER_GAS = 'SILVER-VAR-22-10-21/gas-tariffs/G-1R-SILVER-VAR-22-10-21-'
+    my_repr = Repr()
+    my_repr.maxstring = 80 # let's avoid truncating our error messages too much
 
-CARBON_API_BASE = ('https://api.carbonintensity.org.uk')
+    try:
+        response = session.get(_request_uri, headers=headers, timeout=5)
+        response.raise_for_status()
 
-CARBON_REGIONS = {'A': '/regional/intensity/{from_time}/fw48h/regionid/10',
-                  'B': '/regional/intensity/{from_time}/fw48h/regionid/9',
-                  'C': '/regional/intensity/{from_time}/fw48h/regionid/13',
-                  'D': '/regional/intensity/{from_time}/fw48h/regionid/6',
-                  'E': '/regional/intensity/{from_time}/fw48h/regionid/8',
-                  'F': '/regional/intensity/{from_time}/fw48h/regionid/4',
-                  'G': '/regional/intensity/{from_time}/fw48h/regionid/3',
-                  'P': '/regional/intensity/{from_time}/fw48h/regionid/1',
-                  'N': '/regional/intensity/{from_time}/fw48h/regionid/2',
-                  'J': '/regional/intensity/{from_time}/fw48h/regionid/14',
-                  'H': '/regional/intensity/{from_time}/fw48h/regionid/12',
-                  'K': '/regional/intensity/{from_time}/fw48h/regionid/7',
-                  'L': '/regional/intensity/{from_time}/fw48h/regionid/11',
-                  'M': '/regional/intensity/{from_time}/fw48h/regionid/5',
-                  'Z': '/intensity/{from_time}/fw48h'}
+    except requests.exceptions.HTTPError as error:
+        raise APIRetryLater('API HTTP error ' + str(error.response.status_code)) from error
 
-MAX_RETRIES = 15 # give up once we've tried this many times to get the prices from the API
+    except requests.exceptions.ConnectionError as error:
+        raise APIRetryLater('API connection error: ' + my_repr.repr(str(error))) from error
 
-parser = argparse.ArgumentParser(description=('Read data from a remote API and store it in a local SQlite database'))
-parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
-parser.add_argument('--print', '-p', action='store_true', help='print data which was retrieved (JSON format)')
+    except requests.exceptions.Timeout as error:
+        raise APIRetryLater('API request timeout') from error
 
-args = parser.parse_args()
-conf_file = args.conf
+    except requests.exceptions.RequestException as error:
+        raise SystemExit('API Request error: ' + str(error)) from error
 
-def get_data_from_api(_request_uri: str) -> dict:
-    """using the provided URI, request data from the API and return a JSON object.
-    Try to handle errors gracefully with retries when appropriate."""
+    if response.status_code == 304 and cached:
+        print('API data not modified since last time, using our cached copy.')
+        data = json.loads(cached_body)
+        if print_data: print(data)
+        return data, None
 
-    # Try to handle issues with the API - rare but do happen, using an
-    # exponential sleep time up to 2**14 (16384) seconds, approx 4.5 hours.
-    # We will keep trying for over 9 hours and then give up.
+    if response.status_code // 100 != 2:
+        raise APIRetryLater('API returned unexpected status ' + str(response.status_code))
 
-    retry_count = 0
-    my_repr = Repr()
-    my_repr.maxstring = 80 # let's avoid truncating our error messages too much
+    try:
+        data = response.json()
+    except ValueError as error:
+        # e.g. an HTML error page, or a body cut off part way through
+        raise APIRetryLater('API returned something other than JSON: ' +
+                            my_repr.repr(response.text)) from error
+
+    print('API request successful, status ' + str(response.status_code) + '.')
+    if print_data: print(data)
+    return data, response
+
+def fetch_feeds(feeds: list, session=None, print_data: bool = False):
+    """Fetch every planned feed at the same time, so that the total time taken is that of
+    the slowest API rather than the sum of all of them. Fills in 'data' and 'response'
+    for each feed, or 'error' if it needs to be retried later. Whatever goes wrong with
+    one feed is only that feed's error, so the others are still stored and every
+    feed's retry is still kept track of."""
+
+    def fetch(feed: dict):
+        with eco_timing.Span('api_request', upstream=feed['upstream']) as span:
+            try:
+                data, response = get_data_from_api(feed['uri'], session, print_data, feed['cached'])
+            except APIRetryLater as error:
+                span.fields['error'] = str(error)
+                return None, None, str(error)
+            except (SystemExit, Exception) as error: # pylint: disable=broad-except
+                span.fields['error'] = str(error) or type(error).__name__
+                return None, None, 'API request failed: ' + span.fields['error']
+            span.fields['cached'] = response is None
+            return data, response, None
+
+    if len(feeds) == 1:
+        results = [fetch(feeds[0])]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(len(feeds), MAX_FEEDS)) as executor:
+            results = list(executor.map(fetch, feeds))
+
+    for feed, (data, response, error) in zip(feeds, results):
+        feed['data'] = data
+        feed['response'] = response
+        feed['error'] = error
+
+def stored_until(conn: sqlite3.Connection, series_id: int, slot_length: timedelta):
+    """Return the (UTC) end of the newest slot we hold for a series,
+    or None if we don't have any."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT MAX(valid_from) FROM readings WHERE series_id = ?', (series_id,))
+    newest = cursor.fetchone()[0]
+    if newest is None:
+        return None
+    return datetime.fromtimestamp(newest, timezone.utc) + slot_length
+
+def publication_horizon(kind: str, now: datetime) -> datetime:
+    """Work out how far ahead the API could possibly have data for a kind of tariff
+    ('agile' or 'tracker') at the moment, so we know when there's no point asking.
+    'now' must be timezone aware."""
+    local_now = now.astimezone()
+    today = local_now.date()
+
+    if kind == 'tracker':
+        # tomorrow's price is the most we can hope for
+        horizon_day = today + timedelta(days=2)
+        return datetime(horizon_day.year, horizon_day.month, horizon_day.day).astimezone()
+
+    if local_now.hour >= AGILE_PUBLISH_HOUR:
+        horizon_day = today + timedelta(days=1)
+    else:
+        horizon_day = today
+    return datetime(horizon_day.year, horizon_day.month, horizon_day.day,
+                    AGILE_LAST_SLOT_END_HOUR).astimezone()
+
+def retry_due(conn: sqlite3.Connection, upstream: str, now: float) -> bool:
+    """Check whether we're allowed to ask this API yet, or whether we're still waiting
+    to retry it after earlier failures."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT failures, next_attempt, last_error FROM fetch_retries '
+                   'WHERE upstream = ?', (upstream,))
+    retry = cursor.fetchone()
+    if retry is None or retry[1] <= now:
+        return True
+
+    failures, next_attempt, last_error = retry
+    if failures >= CIRCUIT_BREAKER_FAILURES:
+        print('The ' + upstream + ' API has failed ' + str(failures) + ' times in a row (' +
+              last_error + '), not trying it again until ' +
+              datetime.fromtimestamp(next_attempt).strftime("%H:%M on %A %d %b") + '.')
+    else:
+        print('Waiting to retry the ' + upstream + ' API until ' +
+              datetime.fromtimestamp(next_attempt).strftime("%H:%M:%S") + '.')
+    return False
 
-    while retry_count <= MAX_RETRIES:
+def record_fetch_result(conn: sqlite3.Connection, upstream: str, error: str, now: float,
+                        rng: random.Random = random):
+    """Remember how a request to this API went. A success clears any pending retry; a
+    failure schedules the next attempt with jittered exponential backoff, or opens the
+    circuit breaker if it keeps on failing. The caller commits."""
+    cursor = conn.cursor()
 
-        if retry_count == MAX_RETRIES:
-            raise SystemExit('API retry limit exceeded.')
+    if error is None:
+        cursor.execute('DELETE FROM fetch_retries WHERE upstream = ?', (upstream,))
+        return
 
-        try:
-            success = False
-            response = requests.get(_request_uri, timeout=5)
-            response.raise_for_status()
-            if response.status_code // 100 == 2:
-                success = True
-
-        except requests.exceptions.HTTPError as error:
-            print(('API HTTP error ' + str(response.status_code) +
-                   ',retrying in ' + str(2**retry_count) + 's'))
-            time.sleep(2**retry_count)
-            retry_count += 1
-
-        except requests.exceptions.ConnectionError as error:
-            print(('API connection error: ' + my_repr.repr(str(error)) +
-                   ', retrying in ' + str(2**retry_count) + 's'))
-            time.sleep(2**retry_count)
-            retry_count += 1
-
-        except requests.exceptions.Timeout:
-            print('API request timeout, retrying in ' + str(2**retry_count) + 's')
-            time.sleep(2**retry_count)
-            retry_count += 1
-
-        except requests.exceptions.RequestException as error:
-            raise SystemExit('API Request error: ' + str(error)) from error
-
-        if success:
-            print('API request successful, status ' + str(response.status_code) + '.')
-            if args.print: print(response.json())
-            return response.json()
-
-def insert_data(data: dict, is_gas: bool):
-    """Insert our data records one by one, keep track of how many were successfully inserted
-    and print the results of the insertion."""
-
-    num_rows_inserted = 0
-
-    if config['Mode'] == 'agile_import' or config['Mode'] == 'agile_export':
-        for result in data['results']:
-            # insert_record returns false if it was a duplicate record
-            # or true if a record was successfully entered.
-            if insert_record(result['valid_from'], result['value_inc_vat'], is_gas):
-                num_rows_inserted += 1
-
-        if num_rows_inserted > 0:
-            lastslot = datetime.strftime(datetime.strptime(
-                data['results'][0]['valid_to'], "%Y-%m-%dT%H:%M:%SZ"), "%H:%M on %A %d %b")
-            print(str(num_rows_inserted) + ' prices were inserted, ending at ' + lastslot + '.')
-        else:
-            print('No prices were inserted - maybe we have them'
-                  ' already, or Octopus are late with their update.')
-
-    if config['Mode'] == "tracker":
-        for result in data['results']:
-            # insert_record returns false if it was a duplicate record
-            # or true if a record was successfully entered.
-            if insert_record(result['valid_from'], result['value_inc_vat'], is_gas):
-                num_rows_inserted += 1
-
-        if num_rows_inserted > 0:
-            lastslot = datetime.strftime(datetime.strptime(
-                data['results'][0]['valid_to'], "%Y-%m-%dT%H:%M:%SZ"), "%H:%M on %A %d %b")
-            print(str(num_rows_inserted) + ' prices were inserted, ending at ' + lastslot + '.')
-        else:
-            print('No prices were inserted - maybe we have them'
-                  ' already, or Octopus are late with their update.')
+    cursor.execute('SELECT failures FROM fetch_retries WHERE upstream = ?', (upstream,))
+    retry = cursor.fetchone()
+    failures = retry[0] + 1 if retry else 1
 
-    if config['Mode'] == 'carbon':
-        if config['DNORegion'] == 'Z':
+    if failures >= CIRCUIT_BREAKER_FAILURES:
+        delay = CIRCUIT_BREAKER_COOL_OFF
+    else:
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**(failures - 1))
+    # "equal jitter" - somewhere between half and all of the delay
+    next_attempt = int(now + rng.uniform(delay / 2, delay))
+
+    cursor.execute('INSERT INTO fetch_retries(upstream, failures, next_attempt, last_error) '
+                   'VALUES (?, ?, ?, ?) ON CONFLICT(upstream) DO UPDATE SET '
+                   'failures=excluded.failures, next_attempt=excluded.next_attempt, '
+                   'last_error=excluded.last_error;',
+                   (upstream, failures, next_attempt, error))
+
+    print(error + ' from the ' + upstream + ' API (failure ' + str(failures) +
+          '), will try again after ' +
+          datetime.fromtimestamp(next_attempt).strftime("%H:%M:%S") + '.')
+
+def next_retry(conn: sqlite3.Connection):
+    """The earliest time (UNIX timestamp) any API is waiting to be retried, or None."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT MIN(next_attempt) FROM fetch_retries')
+    return cursor.fetchone()[0]
+
+def plan_feed(conn: sqlite3.Connection, series: dict, request_uri: str) -> dict:
+    """Describe one request to make for a series, along with anything we have cached
+    for it. The series' source names the API it goes to, for keeping track of retries."""
+    return {'uri': request_uri, 'series': series, 'series_id': eco_db.series_id(conn, series),
+            'upstream': series['source'], 'cached': load_cached_response(conn, request_uri)}
+
+def plan_octopus(conn: sqlite3.Connection, series: dict, api_base: str) -> dict:
+    """Plan to ask the Octopus API only for the slots we don't already have. Returns None
+    if we already have everything that could have been published so far."""
+
+    request_uri = api_base + series['path']
+    slot_length = timedelta(seconds=series['slot_length'])
+    period_from = period_to = None
+
+    if series['kind'] == 'tracker':
+        # Tracker prices change daily, so look from yesterday to the day after tomorrow
+        period_from = (datetime.now(timezone.utc) - timedelta(days=1)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        period_to = period_from + timedelta(days=3)
+
+    have_until = stored_until(conn, eco_db.series_id(conn, series), slot_length)
+
+    if have_until is not None:
+        if have_until >= publication_horizon(series['kind'], datetime.now(timezone.utc)):
+            print('We already have ' + series['tariff'] + ' data until ' +
+                  have_until.astimezone().strftime("%H:%M on %A %d %b") +
+                  ', no need to ask the API.')
+            return None
+        # start from the newest slot we already have - it's cheap to get it again
+        # and it keeps the URI the same between runs so the response can be cached
+        newest_slot = have_until - slot_length
+        if period_from is None or newest_slot > period_from:
+            period_from = newest_slot
+
+    params = []
+    if period_from is not None:
+        params.append('period_from=' + period_from.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+    if period_to is not None:
+        params.append('period_to=' + period_to.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+    if params:
+        request_uri = request_uri + '?' + '&'.join(params)
+
+    return plan_feed(conn, series, request_uri)
+
+def plan_carbon(conn: sqlite3.Connection, series: dict, api_base: str) -> dict:
+    """Plan to ask carbonintensity.org.uk for the forecast from the current half hour.
+    Forecasts are revised all the time, so we always ask (conditionally)."""
+
+    # Start from the current half hour so the URI (and so the cache entry) only
+    # changes once per slot.
+    request_time = datetime.now(timezone.utc)
+    request_time = request_time.replace(minute=request_time.minute // 30 * 30)
+    request_uri = (api_base + series['path'])
+    request_uri = request_uri.format(from_time=request_time.strftime("%Y-%m-%dT%H:%MZ"))
+    return plan_feed(conn, series, request_uri)
+
+def iso_to_epoch(timestamp: str) -> int:
+    """Convert an API timestamp such as 2023-03-01T12:30:00Z or 2023-03-01T12:30Z into
+    a UNIX timestamp by slicing the string, which is much cheaper than strptime."""
+    return timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                   int(timestamp[11:13]), int(timestamp[14:16]), 0))
+
+def normalise_data(series: dict, data: dict) -> list:
+    """Turn an API payload into a list of (valid_from, value) tuples ready for the database,
+    in one pass, with the slot start as a UNIX timestamp."""
+
+    if series['source'] == 'carbon':
+        if series['region'] == 'Z':
             carbon_data = data['data']
         else:
             carbon_data = data['data']['data']
 
-        for result in carbon_data:
-            if insert_record(result['from'], result['intensity']['forecast'], is_gas):
-                num_rows_inserted += 1
-
-        if num_rows_inserted > 0:
-            lastslot = datetime.strftime(datetime.strptime(
-                carbon_data[47]['from'], "%Y-%m-%dT%H:%MZ"), "%H:%M on %A %d %b")
-            print(str(num_rows_inserted) + ' intensities were inserted, '
-                  'ending at ' + lastslot + '.')
+        # carbonintensity.org.uk gives us e.g. 2023-03-01T12:30Z
+        return [(iso_to_epoch(result['from']), result['intensity']['forecast'])
+                for result in carbon_data]
+
+    # Octopus gives us e.g. 2023-03-01T12:30:00Z
+    return [(iso_to_epoch(result['valid_from']), result['value_inc_vat'])
+            for result in data['results']]
+
+def upsert_data(cursor: sqlite3.Cursor, series: dict, series_id: int, data: dict) -> tuple:
+    """Write a whole API payload for a series using one executemany upsert, and print the
+    results of the insertion. The caller is responsible for the transaction. Returns a
+    tuple of the number of rows (inserted, updated, unchanged)."""
+
+    rows = normalise_data(series, data)
+
+    if not rows:
+        print('The API returned no data - maybe the upstream service is late with its update.')
+        return 0, 0, 0
+
+    # find out what we already have for this range, so that we can tell genuinely
+    # new rows apart from ones which would just be overwritten with the same value
+    cursor.execute('SELECT valid_from, value FROM readings '
+                   'WHERE series_id = ? AND valid_from BETWEEN ? AND ?',
+                   (series_id, min(rows)[0], max(rows)[0]))
+    existing = dict(cursor.fetchall())
+
+    changed_rows = []
+    num_inserted = num_updated = num_unchanged = 0
+    for valid_from, value in rows:
+        if valid_from not in existing:
+            num_inserted += 1
+        elif existing[valid_from] != value:
+            num_updated += 1
         else:
-            print('No values were inserted - maybe we have them'
-                  ' already, or carbonintensity.org.uk are late with their update.')
-
-def insert_record(valid_from: str, data_value: float, is_gas: bool) -> bool:
-    """Assuming we still have a cursor, take a tuple and stick it into the database.
-       Return False if it was a duplicate record (not inserted) and True if a record
-       was successfully inserted."""
-    if not cursor:
-        raise SystemExit('Database connection lost!')
-
-    if config['Mode'] == 'agile_import' or config['Mode'] == 'agile_export':
-        # make the date/time work for SQLite, it's picky about the format,
-        # easier to use the built in SQLite datetime functions
-        # when figuring out what records we want rather than trying to roll our own
-        valid_from_formatted = datetime.strftime(
-            datetime.strptime(valid_from, "%Y-%m-%dT%H:%M:%SZ"), "%Y-%m-%d %H:%M:%S")
-
-        data_tuple = (valid_from_formatted, data_value)
-        # print(data_tuple) # debug
-
-        try:
-            cursor.execute(
-                "INSERT INTO 'eco'('valid_from', 'value_inc_vat') VALUES (?, ?) ON CONFLICT(valid_from) DO UPDATE SET value_inc_vat=excluded.value_inc_vat;", data_tuple)
-
-        except sqlite3.Error as error:
-            raise SystemError('Database error: ' + str(error)) from error
-
-        else:
-            return True # the record was inserted
-
-    if config['Mode'] == "tracker":
-        # make the date/time work for SQLite, it's picky about the format,
-        # easier to use the built in SQLite datetime functions
-        # when figuring out what records we want rather than trying to roll our own
-        valid_from_formatted = datetime.strftime(
-            datetime.strptime(valid_from, "%Y-%m-%dT%H:%M:%SZ"), "%Y-%m-%d %H:%M:%S")
-
-        data_tuple = (valid_from_formatted, data_value)
-        # print(data_tuple) # debug
-
-        if is_gas:
-            try:
-                cursor.execute(
-                    "INSERT INTO 'eco'('valid_from', 'gas_value_inc_vat') VALUES (?, ?) ON CONFLICT(valid_from) DO UPDATE SET gas_value_inc_vat=excluded.gas_value_inc_vat;", data_tuple)
+            num_unchanged += 1
+            continue
+        changed_rows.append((series_id, valid_from, value))
+
+    cursor.executemany(
+        'INSERT INTO readings(series_id, valid_from, value) VALUES (?, ?, ?) '
+        'ON CONFLICT(series_id, valid_from) DO UPDATE SET value=excluded.value;',
+        changed_rows)
+
+    if series['source'] == 'carbon':
+        noun = 'intensities'
+        upstream = 'carbonintensity.org.uk are'
+    else:
+        noun = 'prices'
+        upstream = 'Octopus are'
+
+    if num_inserted + num_updated > 0:
+        lastslot = datetime.strftime(datetime.fromtimestamp(max(rows)[0] + series['slot_length']),
+                                     "%H:%M on %A %d %b")
+        print(series['tariff'] + ' ' + series['region'] + ': ' +
+              str(num_inserted) + ' ' + noun + ' were inserted and ' + str(num_updated) +
+              ' were updated (' + str(num_unchanged) + ' unchanged), ending at ' + lastslot + '.')
+    else:
+        print(series['tariff'] + ' ' + series['region'] + ': ' +
+              'No ' + noun + ' were inserted - we have all ' + str(num_unchanged) +
+              ' already, or ' + upstream + ' late with their update.')
 
-            except sqlite3.Error as error:
-                raise SystemError('Database error: ' + str(error)) from error
+    return num_inserted, num_updated, num_unchanged
 
-            else:
-                return True # the record was inserted
-        elif not is_gas:
-            try:
-                cursor.execute(
-                    "INSERT INTO 'eco'('valid_from', 'value_inc_vat') VALUES (?, ?) ON CONFLICT(valid_from) DO UPDATE SET value_inc_vat=excluded.value_inc_vat;", data_tuple)
+def store_feeds(conn: sqlite3.Connection, feeds: list, config: dict = None) -> tuple:
+    """Write the results of every fetched feed, and their cache entries, in a single
+    transaction. Given the config, if anything changed the display's summaries are
+    worked out again in the same transaction, so they can't be left behind the data.
+    Returns the total (inserted, updated, unchanged) across all feeds."""
 
-            except sqlite3.Error as error:
-                raise SystemError('Database error: ' + str(error)) from error
+    if not conn:
+        raise SystemExit('Database connection lost!')
 
-            else:
-                return True # the record was inserted
+    totals = [0, 0, 0]
+    cursor = conn.cursor()
 
+    with eco_timing.Span('db_upsert', feeds=len(feeds)) as span:
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
 
-    if config['Mode'] == 'carbon':
-        valid_from_formatted = datetime.strftime(
-            datetime.strptime(valid_from, "%Y-%m-%dT%H:%MZ"), "%Y-%m-%d %H:%M:%S")
+            now = time.time()
+            for feed in feeds:
+                if 'upstream' in feed:
+                    record_fetch_result(conn, feed['upstream'], feed.get('error'), now)
+                if feed.get('error'):
+                    continue
+                counts = upsert_data(cursor, feed['series'], feed['series_id'], feed['data'])
+                totals = [total + count for total, count in zip(totals, counts)]
+                if feed['response'] is not None:
+                    store_cached_response(conn, feed['uri'], feed['response'])
 
-        data_tuple = (valid_from_formatted, data_value)
-        # print(data_tuple) # debug
+            if config is not None and totals[0] + totals[1] > 0:
+                write_summaries(conn, config, now)
 
-        try:
-            cursor.execute(
-                "INSERT INTO 'eco'('valid_from', 'intensity') VALUES (?, ?) ON CONFLICT(valid_from) DO UPDATE SET intensity=excluded.intensity;", data_tuple)
+            conn.commit()
 
         except sqlite3.Error as error:
+            conn.rollback()
             raise SystemError('Database error: ' + str(error)) from error
 
-        else:
-            return True # the record was inserted
+        span.fields['inserted'], span.fields['updated'], span.fields['unchanged'] = totals
 
-    return False
+    return tuple(totals)
 
-def remove_old_data(age: str):
-    """Delete old data from the database, we don't want to display those and we don't want it
-    to grow too big. 'age' must be a string that SQLite understands"""
-    if not cursor:
-        raise SystemExit('Database connection lost before pruning data!')
-    try:
-        cursor.execute("SELECT COUNT(*) FROM eco "
-                       "WHERE valid_from < datetime('now', '-" + age + "')")
-        selected_rows = cursor.fetchall()
-        num_old_rows = selected_rows[0][0]
-        # I don't know why this doesn't just return an int rather than a list of a list of an int
-        if num_old_rows > 0:
-            cursor.execute("DELETE FROM eco WHERE valid_from < datetime('now', '-" + age + "')")
-            print(str(num_old_rows) + ' unneeded data points from the past were deleted.')
-        else:
-            print('There were no old data points to delete.')
-    except sqlite3.Error as error:
-        print('Failed while trying to remove old data points from database: ', error)
-
-os.chdir(sys.path[0])
-config = eco_indicator.get_config(conf_file)
-
-# print('conf_file: ') # debug
-# print(conf_file) # debug
-# print('config: ') # debug
-# print(config) # debug
-
-try:
-    # connect to the database in rw mode so we can catch the error if it doesn't exist
-    DB_URI = 'file:{}?mode=rw'.format(pathname2url('eco_indicator.sqlite'))
-    conn = sqlite3.connect(DB_URI, uri=True)
-    cursor = conn.cursor()
-    print('Connected to database...')
-
-except sqlite3.OperationalError:
-    # handle missing database case
-    print('No database found. Creating a new one...')
-    conn = sqlite3.connect('eco_indicator.sqlite')
-    cursor = conn.cursor()
-    # UNIQUE constraint prevents duplication of data on multiple runs of this script
-    # ON CONFLICT FAIL allows us to count how many times this happens
-    cursor.execute('CREATE TABLE eco (valid_from STRING PRIMARY KEY ON CONFLICT REPLACE, '
-                   'value_inc_vat REAL, intensity REAL, gas_value_inc_vat REAL)')
+def insert_data(conn: sqlite3.Connection, series: dict, data: dict) -> tuple:
+    """Insert a single API payload for a series in its own transaction. Returns a tuple
+    of the number of rows (inserted, updated, unchanged)."""
+    feed = {'uri': None, 'series': series, 'series_id': eco_db.series_id(conn, series),
+            'data': data, 'response': None}
     conn.commit()
-    print('Database created... ')
-
-if config['Mode'] == 'agile_import':
-    DNO_REGION = config['DNORegion']
-    AGILE_CAP = config['AgileCap']
-
-    if DNO_REGION in AGILE_REGIONS:
-        print('Selected region ' + DNO_REGION)
-    else:
-        raise SystemExit('Error: DNO region ' + DNO_REGION + ' is not a valid choice.')
-
-    if AGILE_CAP == 35:
-        AGILE_VERSION = AGILE_IMPORT_35
-    elif AGILE_CAP == 55:
-        AGILE_VERSION = AGILE_IMPORT_55
-    elif AGILE_CAP == 78:
-        AGILE_VERSION = AGILE_IMPORT_78
-    elif AGILE_CAP == 100:
-        AGILE_VERSION = AGILE_IMPORT_VAR_100
-    elif AGILE_CAP == 101:
-        AGILE_VERSION = AGILE_IMPORT_FLEX_100
-    else:
-        raise SystemExit('Error: Agile cap of ' + str(AGILE_CAP) + ' refers to an unknown tariff.')
+    return store_feeds(conn, [feed])
+
+def prune_due(conn: sqlite3.Connection, config: dict, now: float) -> bool:
+    """Whether it's been Retention: PruneEveryHours since old data was last pruned."""
+    row = conn.execute("SELECT last_run FROM maintenance WHERE task = 'prune'").fetchone()
+    return row is None or now - row[0] >= config['Retention']['PruneEveryHours'] * 3600
+
+def prune_data(conn: sqlite3.Connection, config: dict, now: float):
+    """Move old data down the tiers of the configured retention: half hour slots older
+    than RawDays are rolled up into hourly min/mean/max, hours older than HourlyDays
+    into days, and days older than DailyDays are deleted. Cut-offs are at midnight UTC
+    so only whole hours and days are rolled up. Each tier's rows are found and deleted
+    with a single statement on its time index, all in one transaction."""
+    if not conn:
+        raise SystemExit('Database connection lost before pruning data!')
 
-    # Build the API for the request - public API so no authentication required
-    request_uri = (AGILE_API_BASE + AGILE_VERSION + DNO_REGION + AGILE_API_TAIL)
-    data_rows = get_data_from_api(request_uri)
-    insert_data(data_rows, False)
+    retention = config['Retention']
+    today = int(now) // ONE_DAY * ONE_DAY
+    raw_cutoff = today - retention['RawDays'] * ONE_DAY
+    hourly_cutoff = today - retention['HourlyDays'] * ONE_DAY
+    daily_cutoff = today - retention['DailyDays'] * ONE_DAY
 
-elif config['Mode'] == 'carbon':
-    DNO_REGION = config['DNORegion']
+    with eco_timing.Span('db_prune') as span:
+        try:
+            with conn:
+                conn.execute(HOURLY_ROLLUP, (raw_cutoff,))
+                num_old_rows = conn.execute('DELETE FROM readings WHERE valid_from < ?',
+                                            (raw_cutoff,)).rowcount
+                conn.execute(DAILY_ROLLUP, (hourly_cutoff,))
+                conn.execute('DELETE FROM readings_hourly WHERE period_start < ?', (hourly_cutoff,))
+                conn.execute('DELETE FROM readings_daily WHERE period_start < ?', (daily_cutoff,))
+                conn.execute("INSERT INTO maintenance VALUES ('prune', ?) ON CONFLICT(task) "
+                             "DO UPDATE SET last_run=excluded.last_run", (int(now),))
+        except sqlite3.Error as error:
+            span.fields['error'] = str(error)
+            print('Failed while trying to remove old data points from database: ', error)
+            return
+        span.fields['rows'] = num_old_rows
 
-    if DNO_REGION in CARBON_REGIONS:
-        print('Selected region ' + DNO_REGION)
+    if num_old_rows > 0:
+        print(str(num_old_rows) + ' data points from the past were rolled up into hourly history.')
     else:
-        raise SystemExit('Error: DNO region ' + DNO_REGION + ' is not a valid choice.')
+        print('There were no old data points to roll up.')
+
+def summary_shape(config: dict) -> tuple:
+    """How many slots the Inky pHAT shows and how many make up its cheapest/dearest
+    windows, for the config given or, if that's for another display, by default."""
+    inky = config.get('InkyPHAT') or {}
+    return (inky.get('DataDuration', eco_config.DEFAULT_DATADURATION) * 2,
+            int(2 * inky.get('LowSlotDuration', eco_config.DEFAULT_LOWSLOTDURATION)))
+
+def summaries_missing(conn: sqlite3.Connection, now: float) -> bool:
+    """Whether there are no summaries from the current slot on."""
+    current_slot = int(now) // eco_series.HALF_HOUR * eco_series.HALF_HOUR
+    return conn.execute('SELECT 1 FROM slot_summaries WHERE horizon_start >= ? LIMIT 1',
+                        (current_slot,)).fetchone() is None
+
+def summarise(conn: sqlite3.Connection, config: dict, now: float) -> list:
+    """Work out the summary the Inky pHAT shows (see eco_stats.window_stats) for every
+    stretch of slots it could be asked to show from now on - one starting at each slot
+    we have - for every configured half hourly series. Returns slot_summaries rows."""
+    slots, window = summary_shape(config)
+    current_slot = int(now) // eco_series.HALF_HOUR * eco_series.HALF_HOUR
+
+    summaries = []
+    for series in eco_series.configured_series(config):
+        if series['slot_length'] != eco_series.HALF_HOUR:
+            continue
+        series_id = eco_db.series_id(conn, series, create=False)
+        if series_id is None:
+            continue
+        rows = conn.execute('SELECT valid_from, value FROM readings WHERE series_id = ? '
+                            'AND valid_from >= ? ORDER BY valid_from',
+                            (series_id, current_slot)).fetchall()
+        starts = [row[0] for row in rows]
+        values = [row[1] for row in rows]
+
+        # each stretch has to be long enough to hold a window
+        for first in range(len(values) - window + 1):
+            shown = values[first:first + slots]
+            stats = eco_stats.window_stats(shown, window)
+            low_start, low_mean = stats['lowest_windows'][0]
+            high_start, high_mean = stats['highest_windows'][0]
+            summaries.append((series_id, starts[first], slots, window, len(shown),
+                              starts[first + len(shown) - 1], stats['min_index'],
+                              stats['max_index'], low_start, low_mean, high_start, high_mean,
+                              stats['trimmed_mean']))
+
+    return summaries
+
+def write_summaries(conn: sqlite3.Connection, config: dict, now: float):
+    """Replace the stored summaries with new ones, so the display only has to look its
+    summary up. The caller is responsible for the transaction."""
+
+    with eco_timing.Span('db_summaries') as span:
+        summaries = summarise(conn, config, now)
+        conn.execute('DELETE FROM slot_summaries')
+        conn.executemany('INSERT INTO slot_summaries VALUES '
+                         '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', summaries)
+        span.fields['rows'] = len(summaries)
+
+def update_summaries(conn: sqlite3.Connection, config: dict, now: float):
+    """Replace the stored summaries with new ones in a transaction of their own, e.g.
+    when there aren't any yet or after a backfill."""
+    try:
+        with conn:
+            write_summaries(conn, config, now)
+    except sqlite3.Error as error:
+        print('Failed to store summaries of the data: ', error)
 
-    # Build the API for the request - public API so no authentication required
-    request_time = datetime.now().astimezone(pytz.utc).isoformat()
-    request_uri = (CARBON_API_BASE + CARBON_REGIONS[DNO_REGION])
-    request_uri = request_uri.format(from_time=request_time)
-    data_rows = get_data_from_api(request_uri)
-    insert_data(data_rows, False)
+def open_database(config: dict = None) -> sqlite3.Connection:
+    """Connect to the database in the current directory, creating it if it doesn't exist."""
+    return eco_db.open_database(create=True, config=config)
 
-elif config['Mode'] == 'agile_export':
-    DNO_REGION = config['DNORegion']
+def plan_feeds(conn: sqlite3.Connection, config: dict) -> list:
+    """Work out which requests are needed to fill every configured series. The API base
+    URLs can be overridden in the config (OctopusAPIBase, CarbonAPIBase), e.g. to point
+    at a local test server."""
 
-    if DNO_REGION in AGILE_REGIONS:
-        print('Selected region ' + DNO_REGION)
-    else:
-        raise SystemExit('Error: DNO region ' + DNO_REGION + ' is not a valid choice.')
+    octopus_api_base = config.get('OctopusAPIBase', eco_series.OCTOPUS_API_BASE)
+    carbon_api_base = config.get('CarbonAPIBase', eco_series.CARBON_API_BASE)
 
-    # Build the API for the request - public API so no authentication required
-    request_uri = (AGILE_API_BASE + AGILE_EXPORT + DNO_REGION + AGILE_API_TAIL)
-    data_rows = get_data_from_api(request_uri)
-    insert_data(data_rows, False)
+    feeds = []
+    for series in eco_series.configured_series(config):
+        print('Selected ' + series['tariff'] + ' for region ' + series['region'])
+        if series['source'] == 'carbon':
+            feeds.append(plan_carbon(conn, series, carbon_api_base))
+        else:
+            feeds.append(plan_octopus(conn, series, octopus_api_base))
 
-elif config['Mode'] == 'tracker':
+    # keep any newly added series before we go off and fetch
+    conn.commit()
 
-    DNO_REGION = config['DNORegion']
+    # drop the feeds we already have everything for
+    return [feed for feed in feeds if feed is not None]
 
-    if DNO_REGION in AGILE_REGIONS:
-        print('Selected region ' + DNO_REGION)
-    else:
-        raise SystemExit('Error: DNO region ' + DNO_REGION + ' is not a valid choice.')
+def fetch_and_store(conn: sqlite3.Connection, config: dict, session=None, print_data: bool = False):
+    """Fetch whatever the configured mode needs from the relevant APIs all at once, store
+    it all in one go along with a summary of it for the display if anything changed,
+    then prune data we no longer need. Without a session, one is only made (and requests only imported)
+    if there turns out to be something to fetch."""
 
-    # Build the API for the request - public API so no authentication required
-    request_uri = (AGILE_API_BASE + TRACKER_ELECTRICITY + DNO_REGION + AGILE_API_TAIL)
+    now = time.time()
+    feeds = [feed for feed in plan_feeds(conn, config)
+             if retry_due(conn, feed['upstream'], now)]
 
-    period_from = datetime.now() - timedelta(days=1)
-    period_from = period_from.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if feeds:
+        own_session = session is None
+        if own_session:
+            session = make_session(len(feeds))
+        try:
+            fetch_feeds(feeds, session, print_data)
+        finally:
+            if own_session:
+                session.close()
+        store_feeds(conn, feeds, config)
 
-    period_to = datetime.now() + timedelta(days=2)
-    period_to = period_to.strftime("%Y-%m-%dT%H:%M:%SZ")
+    # catch up if there are no summaries yet, e.g. just after an upgrade
+    if summaries_missing(conn, now):
+        update_summaries(conn, config, now)
 
-    request_uri = request_uri + "?period_from=" + period_from + "&period_to=" + period_to
+    if prune_due(conn, config, now):
+        prune_data(conn, config, now)
 
-    data_rows = get_data_from_api(request_uri)
-    insert_data(data_rows, False)
+def main(argv: list = None):
+    """Run once from the command line (or cron): fetch, store, prune and exit."""
+    parser = argparse.ArgumentParser(description=('Read data from a remote API and store it in a local SQlite database'))
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    parser.add_argument('--print', '-p', action='store_true', help='print data which was retrieved (JSON format)')
+    eco_profile.add_argument(parser)
 
-    request_uri = (AGILE_API_BASE + TRACKER_GAS + DNO_REGION + AGILE_API_TAIL)
-    request_uri = request_uri + "?period_from=" + period_from + "&period_to=" + period_to
+    args = parser.parse_args(argv)
+    conf_file = args.conf
 
-    data_rows = get_data_from_api(request_uri)
-    insert_data(data_rows, True)
+    os.chdir(sys.path[0])
 
-else:
-    raise SystemExit('Error: Invalid mode ' + config['Mode'] + ' passed to store_data.py')
+    with eco_profile.profiling(args.profile, 'store'):
+        config = eco_config.get_config(conf_file)
 
-remove_old_data('3 days')
+        # print('conf_file: ') # debug
+        # print(conf_file) # debug
+        # print('config: ') # debug
+        # print(config) # debug
 
-# finish up the database operation
-if conn:
-    conn.commit()
-    conn.close()
+        try:
+            conn = open_database(config)
+            fetch_and_store(conn, config, print_data=args.print)
+
+            # finish up the database operation
+            if conn:
+                conn.commit()
+                conn.close()
+        finally:
+            eco_timing.write_metrics(config, 'store')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""Let the tests import the scripts and modules at the top of the repository."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
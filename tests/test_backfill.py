@@ -0,0 +1,147 @@
+"""Backfill from a local stub of the Octopus API's paged history."""
+
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+import backfill
+import eco_db
+import eco_series
+import store_data
+
+SERIES = eco_series.mode_series('agile_import', 'B', 101)[0]
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SLOTS = 96 # two days
+PER_PAGE = 40
+
+class StubHistory(BaseHTTPRequestHandler):
+    """Serves SLOTS made-up prices from START, PER_PAGE at a time, as ?page=N. While
+    sending each page it checks whether another connection could write to the database,
+    and it fails the pages listed in the server's 'fail'."""
+
+    def do_GET(self): # pylint: disable=invalid-name
+        page = int(self.path.split('page=')[1]) if 'page=' in self.path else 1
+        self.server.pages.append(page)
+        if page in self.server.fail:
+            self.send_error(503)
+            return
+
+        first = (page - 1) * PER_PAGE
+        slots = range(first, min(first + PER_PAGE, SLOTS))
+        base = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/v1/products/'
+        body = json.dumps({
+            'count': SLOTS,
+            'results': [{'valid_from': (START + timedelta(minutes=30 * slot)).strftime(
+                '%Y-%m-%dT%H:%M:%SZ'), 'value_inc_vat': float(slot)} for slot in slots],
+            'next': base + SERIES['path'] + '?page=' + str(page + 1)
+                    if first + PER_PAGE < SLOTS else None}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        half = len(body) // 2
+        self.wfile.write(body[:half])
+        self.wfile.flush()
+
+        # part way through the page: could store_data.py write now?
+        time.sleep(0.2)
+        other = sqlite3.connect(self.server.db_file, timeout=0)
+        try:
+            other.execute('BEGIN IMMEDIATE')
+            other.rollback()
+            self.server.locked_out.append(False)
+        except sqlite3.OperationalError:
+            self.server.locked_out.append(True)
+        finally:
+            other.close()
+
+        self.wfile.write(body[half:])
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+@pytest.fixture(name='api')
+def fixture_api(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = HTTPServer(('127.0.0.1', 0), StubHistory)
+    server.pages = []
+    server.fail = set()
+    server.locked_out = []
+    server.db_file = str(tmp_path / eco_db.DB_FILE)
+    server.base = 'http://127.0.0.1:' + str(server.server_address[1]) + '/v1/products/'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(name='conn')
+def fixture_conn(api): # pylint: disable=unused-argument
+    conn = store_data.open_database()
+    yield conn
+    conn.close()
+
+@pytest.fixture(name='session')
+def fixture_session():
+    session = store_data.make_session(1)
+    yield session
+    session.close()
+
+def stored(conn) -> list:
+    return conn.execute('SELECT valid_from, value FROM readings ORDER BY valid_from').fetchall()
+
+def expected() -> list:
+    return [(int((START + timedelta(minutes=30 * slot)).timestamp()), float(slot))
+            for slot in range(SLOTS)]
+
+def test_backfills_every_page_without_locking_out_writers(api, conn, session):
+    assert backfill.backfill_series(conn, session, SERIES, api.base, START,
+                                    START + timedelta(days=2)) == SLOTS
+    assert api.pages == [1, 2, 3]
+    assert stored(conn) == expected()
+    assert api.locked_out == [False, False, False]
+    assert conn.execute('SELECT COUNT(*) FROM backfill_progress').fetchone()[0] == 0
+
+def test_carries_on_the_next_day_without_a_to_date(api, conn, session, monkeypatch):
+    monkeypatch.setattr(backfill, 'today', lambda: START + timedelta(days=1))
+    api.fail = {2}
+    with pytest.raises(SystemExit):
+        backfill.backfill_series(conn, session, SERIES, api.base, START)
+
+    # run again a day later, which would have been a different end date
+    monkeypatch.setattr(backfill, 'today', lambda: START + timedelta(days=2))
+    api.fail = set()
+    assert backfill.backfill_series(conn, session, SERIES, api.base, START) == SLOTS - PER_PAGE
+    assert api.pages == [1, 2, 2, 3]
+    assert stored(conn) == expected()
+    assert conn.execute('SELECT COUNT(*) FROM backfill_progress').fetchone()[0] == 0
+
+def test_fills_in_what_the_history_is_missing(api, conn, session):
+    series_id = eco_db.series_id(conn, SERIES)
+    start = int(START.timestamp())
+    # the first day has only counted its first half, and the first hour of the second
+    # day only its first slot
+    conn.execute('INSERT INTO readings_daily VALUES (?, ?, 24, 0, 11.5, 23, ?)',
+                 (series_id, start, (1 << 24) - 1))
+    conn.execute('INSERT INTO readings_hourly VALUES (?, ?, 1, 48, 48, 48, 1)',
+                 (series_id, start + 86400))
+    conn.commit()
+
+    assert backfill.backfill_series(conn, session, SERIES, api.base, START,
+                                    START + timedelta(days=2)) == SLOTS - 25
+
+    # roll it all up: the first day into a day and the second into hours
+    config = {'Retention': {'RawDays': 1, 'HourlyDays': 2, 'DailyDays': 1000}}
+    store_data.prune_data(conn, config, start + 3 * 86400)
+    assert stored(conn) == []
+
+    assert conn.execute('SELECT period_start, slots, min_value, mean_value, max_value, slot_mask '
+                        'FROM readings_daily').fetchall() == [
+                            (start, 48, 0, pytest.approx(23.5), 47, (1 << 48) - 1)]
+    hours = conn.execute('SELECT period_start, slots, min_value, mean_value, max_value '
+                         'FROM readings_hourly ORDER BY period_start').fetchall()
+    assert hours == [(start + 86400 + hour * 3600, 2, 48 + 2 * hour,
+                      pytest.approx(48 + 2 * hour + 0.5), 48 + 2 * hour + 1) for hour in range(24)]
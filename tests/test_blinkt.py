@@ -0,0 +1,92 @@
+"""Look up Blinkt! colours, and animate a stand-in Blinkt! that keeps note of what it's sent."""
+
+import pytest
+import eco_blinkt
+
+RED, AMBER, GREEN = (255, 0, 0), (255, 128, 0), (0, 255, 0)
+TABLE = eco_blinkt.ColourTable([(200, 'Red', RED), (0, 'Green', GREEN), (100, 'Amber', AMBER)])
+
+class FakeBlinkt:
+    """Records the pixels set between each show()."""
+
+    def __init__(self):
+        self.pending = {}
+        self.shows = []
+
+    def set_clear_on_exit(self, value):
+        pass
+
+    def set_pixel(self, index, red, green, blue, brightness):
+        self.pending[index] = (red, green, blue, brightness)
+
+    def show(self):
+        self.shows.append(self.pending)
+        self.pending = {}
+
+@pytest.mark.parametrize('value, name', [
+    (-0.1, None), (0, 'Green'), (99.9, 'Green'), (100, 'Amber'), (199.99, 'Amber'),
+    (200, 'Red'), (1e6, 'Red')])
+def test_each_value_gets_the_highest_level_it_reaches(value, name):
+    level = TABLE.lookup(value)
+    assert (level and level[1]) == name
+
+def test_levels_must_be_listed_highest_first():
+    levels = {'Level1': {'Name': 'Red', 'Carbon': 200, 'R': 255, 'G': 0, 'B': 0},
+              'Level0': {'Name': 'Green', 'Carbon': 0, 'Price': 0, 'R': 0, 'G': 255, 'B': 0}}
+    tables = eco_blinkt.compile_colour_tables(levels)
+    assert list(tables) == ['Carbon'] # not every level has a Price
+    assert tables['Carbon'].levels == [(0, 'Green', GREEN), (200, 'Red', RED)]
+
+    with pytest.raises(ValueError, match='highest to lowest'):
+        eco_blinkt.compile_colour_tables(dict(reversed(levels.items())))
+    with pytest.raises(ValueError, match='needs G'):
+        eco_blinkt.compile_colour_tables({'Level0': {'Name': 'Green', 'R': 0, 'G': 256, 'B': 0}})
+
+def animator(transition: float = 0, animation: str = 'none') -> eco_blinkt.BlinktAnimator:
+    conf = {'Mode': 'carbon',
+            'Blinkt': {'ColourTables': {'Carbon': TABLE}, 'SlotsPerPixel': 2, 'Brightness': 10,
+                       'TransitionSeconds': transition, 'Animation': animation}}
+    return eco_blinkt.BlinktAnimator(conf, FakeBlinkt())
+
+def test_only_changed_pixels_are_sent():
+    blinkt = animator()
+    blinkt.set_values([50, 50, 150, 150] + [250] * 12, 0)
+    assert blinkt.frame(0) is None
+    assert blinkt.blinkt.shows == [{0: GREEN + (0.1,), 1: AMBER + (0.1,),
+                                    **{i: RED + (0.1,) for i in range(2, 8)}}]
+
+    # nothing new, nothing sent
+    assert blinkt.frame(1) is None
+    assert len(blinkt.blinkt.shows) == 1
+
+    # and pixels with no data go dark
+    blinkt.set_values([50, 50, 250, 250] + [250] * 8, 2)
+    blinkt.frame(2)
+    assert blinkt.blinkt.shows[1] == {1: RED + (0.1,), 6: (0, 0, 0, 0.1), 7: (0, 0, 0, 0.1)}
+
+def test_new_colours_fade_in():
+    blinkt = animator(transition=2)
+    blinkt.set_values([250] * 16, 0)
+    blinkt.frame(2)
+    blinkt.blinkt.shows.clear()
+
+    blinkt.set_values([0] * 2 + [250] * 14, 10)
+    assert blinkt.frame(10) == 10 + eco_blinkt.FRAME_INTERVAL
+    assert blinkt.blinkt.shows == [] # nothing's changed yet
+    assert blinkt.frame(11) == 11 + eco_blinkt.FRAME_INTERVAL
+    assert blinkt.blinkt.shows == [{0: (128, 128, 0, 0.1)}]
+    assert blinkt.frame(12) is None
+    assert blinkt.blinkt.shows[-1] == {0: GREEN + (0.1,)}
+
+def test_only_the_current_slot_pulses():
+    blinkt = animator(animation='pulse')
+    blinkt.set_values([250] * 16, 0)
+    assert blinkt.frame(0) == eco_blinkt.FRAME_INTERVAL
+    assert len(blinkt.blinkt.shows[0]) == 8
+
+    # halfway through a pulse it's as dim as it gets, but never off
+    assert blinkt.frame(eco_blinkt.PULSE_PERIOD / 2) == pytest.approx(
+        eco_blinkt.PULSE_PERIOD / 2 + eco_blinkt.FRAME_INTERVAL)
+    (index, (*colour, brightness)), = blinkt.blinkt.shows[1].items()
+    assert index == 0 and tuple(colour) == RED
+    assert 0 < brightness * eco_blinkt.BRIGHTNESS_STEPS < 0.1 * eco_blinkt.BRIGHTNESS_STEPS
@@ -0,0 +1,44 @@
+"""Clear eco_virtual's stand-in Inky pHAT, and check each frame shown is one solid colour."""
+
+import eco_indicator
+import eco_virtual
+import clear_display
+
+class RecordingInky(eco_virtual.VirtualInky):
+    """Keeps the border and the colours in every frame shown."""
+
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+
+    def show(self):
+        super().show()
+        self.frames.append((self.shown_border, {colour for _, colour in self.shown.getcolors()}))
+
+def solid(colours: list) -> list:
+    return [(colour, {colour}) for colour in colours]
+
+def test_each_cycle_is_a_solid_frame_of_each_colour():
+    display = RecordingInky()
+    eco_indicator.clear_display({'DisplayType': 'inkyphat'}, display, cycles=2)
+    assert display.frames == solid([display.RED, display.BLACK, display.WHITE] * 2)
+
+def test_cycles_default_to_the_config():
+    display = RecordingInky()
+    eco_indicator.clear_display({'DisplayType': 'inkyphat', 'InkyPHAT': {'ClearCycles': 3}},
+                                display)
+    assert len(display.frames) == 9
+    assert display.frames[-1] == (display.WHITE, {display.WHITE})
+
+def test_clearing_from_the_command_line(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.yaml').write_text('Mode: carbon\nDisplayType: inkyphat\nDNORegion: Z\n')
+    display = RecordingInky()
+    monkeypatch.setattr(eco_indicator, 'get_inky_display', lambda: display)
+
+    clear_display.main([])
+    assert len(display.frames) == 3
+
+    display.frames.clear()
+    clear_display.main(['--cycles', '2'])
+    assert display.frames == solid([display.RED, display.BLACK, display.WHITE] * 2)
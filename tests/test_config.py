@@ -0,0 +1,115 @@
+"""Check the config snapshot that get_config() saves, and when it's thrown away."""
+
+import os
+import sys
+import json
+import pickle
+import shutil
+import subprocess
+import pytest
+import eco_config
+
+CONFIG = ('Mode: carbon\nDisplayType: blinkt\nDNORegion: Z\n'
+          'Blinkt:\n  Colours:\n'
+          '    Level1: {Name: Red, Carbon: 200, R: 255, G: 0, B: 0}\n'
+          '    Level0: {Name: Green, Carbon: 0, R: 0, G: 255, B: 0}\n')
+
+@pytest.fixture(name='compiles')
+def fixture_compiles(tmp_path, monkeypatch):
+    """Count how often the config is actually read and checked rather than loaded from
+    the snapshot, with SNAPSHOT_SOURCES copied somewhere they can be touched."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.yaml').write_text(CONFIG)
+    sources = []
+    for source in eco_config.SNAPSHOT_SOURCES:
+        sources.append(str(tmp_path / ('source-' + str(len(sources)))))
+        shutil.copy(source, sources[-1])
+    monkeypatch.setattr(eco_config, 'SNAPSHOT_SOURCES', tuple(sources))
+
+    compiles = []
+    compile_config = eco_config.compile_config
+
+    def counting(filename, text):
+        compiles.append(filename)
+        return compile_config(filename, text)
+
+    monkeypatch.setattr(eco_config, 'compile_config', counting)
+    return compiles
+
+def touch(filename: str):
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_snapshot_is_used_until_the_config_changes(compiles):
+    eco_config.get_config('config.yaml')
+    eco_config.get_config('config.yaml')
+    assert len(compiles) == 1
+
+    # touched but not changed
+    touch('config.yaml')
+    eco_config.get_config('config.yaml')
+    assert len(compiles) == 1
+
+    with open('config.yaml', 'a', encoding='utf-8') as config_file:
+        config_file.write('AgileCap: 101\n')
+    assert eco_config.get_config('config.yaml')['AgileCap'] == 101
+    assert len(compiles) == 2
+
+@pytest.mark.parametrize('source', [0, 1])
+def test_snapshot_is_thrown_away_when_the_code_changes(compiles, source):
+    eco_config.get_config('config.yaml')
+    touch(eco_config.SNAPSHOT_SOURCES[source])
+    eco_config.get_config('config.yaml')
+    assert len(compiles) == 2
+
+def test_colour_tables_survive_the_snapshot(compiles):
+    eco_config.get_config('config.yaml')
+    table = eco_config.get_config('config.yaml')['Blinkt']['ColourTables']['Carbon']
+    assert len(compiles) == 1
+    assert table.lookup(250)[1] == 'Red'
+    assert table.lookup(100)[1] == 'Green'
+    assert table.lookup(-1) is None
+
+@pytest.mark.parametrize('text', [CONFIG, 'Mode: carbon\nDisplayType: inkyphat\nDNORegion: Z\n'
+                                          'InkyPHAT:\n  ClearAt: ["03:30", "15:00"]\n'])
+def test_snapshot_gives_the_same_config(compiles, text):
+    with open('config.yaml', 'w', encoding='utf-8') as config_file:
+        config_file.write(text)
+    checked = eco_config.get_config('config.yaml')
+    loaded = eco_config.get_config('config.yaml')
+    assert len(compiles) == 1
+
+    # it's plain JSON, and the same but for the colour tables being new objects
+    with open('config.yaml.cache', encoding='utf-8') as snapshot_file:
+        assert json.load(snapshot_file)['config']['Mode'] == 'carbon'
+    tables = [{name: table.levels for name, table in config['Blinkt'].pop('ColourTables').items()}
+              for config in (checked, loaded) if 'ColourTables' in config.get('Blinkt', {})]
+    assert tables[:1] == tables[1:]
+    assert loaded == checked
+
+class Exploit:
+    """Something that would run code if it was unpickled."""
+
+    def __reduce__(self):
+        return (open, ('exploited', 'w'))
+
+def test_snapshot_that_isnt_json_is_ignored(compiles):
+    eco_config.get_config('config.yaml')
+    with open('config.yaml.cache', 'wb') as snapshot_file:
+        pickle.dump({'key': eco_config.snapshot_key(), 'payload': Exploit()}, snapshot_file)
+
+    assert eco_config.get_config('config.yaml')['Mode'] == 'carbon'
+    assert len(compiles) == 2
+    assert not os.path.exists('exploited')
+
+def test_reading_the_config_leaves_the_display_code_alone(tmp_path):
+    (tmp_path / 'config.yaml').write_text('Mode: carbon\nDisplayType: inkyphat\nDNORegion: Z\n')
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run(
+        [sys.executable, '-c', 'import sys, store_data\n'
+         'store_data.eco_config.get_config(sys.argv[1])\n'
+         'print(sorted(name for name in sys.modules if name.startswith("eco_")))',
+         str(tmp_path / 'config.yaml')],
+        cwd=repo, capture_output=True, text=True, check=True).stdout.splitlines()[-1]
+    assert 'eco_blinkt' not in loaded
+    assert 'eco_indicator' not in loaded
@@ -0,0 +1,55 @@
+"""Check eco_graph draws the same pixels as the PIL calls it replaced."""
+
+import random
+import pytest
+from PIL import Image, ImageDraw
+import eco_graph
+
+WIDTH, HEIGHT = 160, 80
+BOTTOM = 70.4
+
+def drawn_with_pil(values: list, x_unit: float, y_unit: float, colours: bytes) -> bytes:
+    """The bars and outline as update_inky drew them with PIL, one slot at a time."""
+    img = Image.new('P', (WIDTH, HEIGHT))
+    draw = ImageDraw.Draw(img)
+    for i, value in enumerate(values):
+        top = BOTTOM - value * y_unit
+        draw.rectangle((i * x_unit, min(top, BOTTOM), (i + 1) * x_unit, max(top, BOTTOM)),
+                       colours[i])
+    for i, value in enumerate(values):
+        draw.line(((i + 1) * x_unit, BOTTOM - value * y_unit,
+                   i * x_unit, BOTTOM - value * y_unit), 3)
+        if i > 0:
+            draw.line((i * x_unit, BOTTOM - value * y_unit,
+                       i * x_unit, BOTTOM - values[i - 1] * y_unit), 3)
+    return img.tobytes()
+
+def drawn_with_canvas(values: list, x_unit: float, y_unit: float, colours: bytes) -> bytes:
+    canvas = eco_graph.Canvas(WIDTH, HEIGHT)
+    edges = eco_graph.bar_edges(len(values), x_unit)
+    tops = eco_graph.bar_tops(values, y_unit, BOTTOM)
+    eco_graph.fill_bars(canvas, edges, tops, int(BOTTOM), colours)
+    eco_graph.outline_bars(canvas, edges, tops, 3)
+    return bytes(canvas.pixels)
+
+@pytest.mark.parametrize('x_unit', [1.3, 2.6041666666666665, 3.0, 5.2083333333333333])
+def test_bars_and_outline_match_pil(x_unit):
+    rng = random.Random(x_unit)
+    slots = int((WIDTH - 1) / x_unit)
+    # some negative, and some off the top of the canvas
+    values = [rng.uniform(-10, 90) for _ in range(slots)]
+    colours = bytes(rng.randrange(3) for _ in range(slots))
+
+    assert drawn_with_canvas(values, x_unit, 1.0, colours) == drawn_with_pil(values, x_unit, 1.0,
+                                                                              colours)
+
+def test_each_column_shows_the_last_bar_drawn_over_it():
+    # bars from 0-2, 2-5 and 5-7, each sharing its last column with the next one
+    assert eco_graph.bar_edges(3, 2.5) == [0, 2, 5, 7]
+    assert eco_graph.column_slots([0, 2, 5, 7]) == [0, 0, 1, 1, 1, 2, 2, 2]
+    assert eco_graph.column_slots([0]) == []
+
+def test_dashed_line():
+    canvas = eco_graph.Canvas(12, 1)
+    eco_graph.dashed_hline(canvas, 2, 12, 0, 1)
+    assert bytes(canvas.pixels) == bytes([0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1, 0])
@@ -0,0 +1,36 @@
+"""Check when the Inky pHAT is refreshed, using eco_virtual's stand-in display."""
+
+from PIL import Image
+import eco_indicator
+import eco_virtual
+
+def frame(display: eco_virtual.VirtualInky, colour: int) -> Image.Image:
+    return Image.new('P', (display.WIDTH, display.HEIGHT), colour)
+
+def test_unchanged_frames_are_not_shown_again(tmp_path):
+    display = eco_virtual.VirtualInky()
+    display.frame_hash_file = str(tmp_path / 'frame.sha256')
+
+    assert eco_indicator.show_frame(display, frame(display, display.BLACK))
+    assert not eco_indicator.show_frame(display, frame(display, display.BLACK))
+    assert eco_indicator.show_frame(display, frame(display, display.RED))
+    assert display.show_count == 2
+
+def test_clearing_forgets_the_displays_own_frame(tmp_path):
+    display = eco_virtual.VirtualInky()
+    display.frame_hash_file = str(tmp_path / 'frame.sha256')
+
+    assert eco_indicator.show_frame(display, frame(display, display.BLACK))
+    eco_indicator.clear_display({'DisplayType': 'inkyphat'}, display, cycles=1)
+    # the panel is white now, so the same frame has to be shown again
+    assert eco_indicator.show_frame(display, frame(display, display.BLACK))
+
+def test_forgetting_a_display_without_a_hash_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / eco_indicator.FRAME_HASH_FILE).write_text('left alone\n')
+
+    eco_indicator.forget_frame(eco_virtual.VirtualInky())
+    assert (tmp_path / eco_indicator.FRAME_HASH_FILE).exists()
+
+    eco_indicator.forget_frame()
+    assert not (tmp_path / eco_indicator.FRAME_HASH_FILE).exists()
@@ -0,0 +1,35 @@
+"""Work out the Inky pHAT's layout for each size of panel."""
+
+import pytest
+import eco_layout
+
+def test_each_resolution_is_only_laid_out_once():
+    layout = eco_layout.inky_layout((250, 122))
+    assert eco_layout.inky_layout((250, 122)) is layout
+    assert eco_layout.inky_layout((212, 104)) is not layout
+
+def test_fonts_are_shared_and_scaled():
+    small = eco_layout.inky_layout((212, 104))
+    large = eco_layout.inky_layout((250, 122))
+
+    assert small.font('medium', 10).size == 10
+    assert large.font('medium', 10).size == 12
+    assert large.font('black', 45).size == 54
+    # the same face at the same size is the same font, whichever layout wants it
+    assert small.font('medium', 15) is large.font('medium', 13) is \
+        eco_layout.load_font(large.font('medium', 13).path, 15)
+
+def test_positions_are_scaled_to_the_panel():
+    small = eco_layout.inky_layout((212, 104))
+    large = eco_layout.inky_layout((250, 122))
+
+    assert (small.width, small.height) == (212, 104)
+    assert small.graph_bottom == 91
+    assert large.graph_bottom == pytest.approx(122 - 13 * 1.25)
+    assert large.graph_x_width == pytest.approx(126 * 1.25)
+    assert large.elec_x == pytest.approx(250 - 95 * 1.25)
+    assert small.next_slot_y == [3, 21, 39]
+
+def test_unknown_panels_are_refused():
+    with pytest.raises(SystemExit, match='unsupported Inky display resolution'):
+        eco_layout.inky_layout((400, 300))
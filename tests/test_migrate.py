@@ -0,0 +1,53 @@
+"""Bring a database from before schema versioning up to date."""
+
+import sqlite3
+import pytest
+import eco_db
+import eco_series
+
+LEGACY_ROWS = [('2023-03-01T12:00:00Z', 20.5, 150, None),
+               ('2023-03-01T12:30:00Z', 21.0, 160, None),
+               ('2023-03-01T13:00:00Z', 19.5, None, None)]
+
+@pytest.fixture(name='legacy')
+def fixture_legacy(tmp_path, monkeypatch):
+    """A database as the single-table, text-dated versions of this software left it."""
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect(eco_db.DB_FILE)
+    conn.execute('CREATE TABLE eco (valid_from STRING PRIMARY KEY ON CONFLICT REPLACE, '
+                 'value_inc_vat REAL, intensity REAL, gas_value_inc_vat REAL)')
+    conn.executemany('INSERT INTO eco VALUES (?, ?, ?, ?)', LEGACY_ROWS)
+    conn.commit()
+    conn.close()
+
+def readings(conn) -> list:
+    return conn.execute('SELECT tariff, region, valid_from, value FROM readings '
+                        'JOIN series USING (series_id) ORDER BY valid_from').fetchall()
+
+def test_legacy_readings_go_to_the_configured_series(legacy): # pylint: disable=unused-argument
+    conn = eco_db.open_database(create=False, config={'Mode': 'carbon', 'DNORegion': 'Z'})
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == eco_db.SCHEMA_VERSION
+    assert readings(conn) == [(eco_series.CARBON_TARIFF, 'Z', 1677672000, 150),
+                              (eco_series.CARBON_TARIFF, 'Z', 1677673800, 160)]
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'eco'").fetchone()
+    conn.close()
+
+def test_legacy_readings_are_not_dropped_without_a_config(legacy): # pylint: disable=unused-argument
+    with pytest.raises(SystemExit, match='with your config'):
+        eco_db.open_database(create=False)
+
+    # the readings are still there to be migrated properly
+    conn = sqlite3.connect(eco_db.DB_FILE)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM eco').fetchone()[0] == len(LEGACY_ROWS)
+    conn.close()
+
+    conn = eco_db.open_database(create=False, config={'Mode': 'agile_export', 'DNORegion': 'B'})
+    assert [value for _, _, _, value in readings(conn)] == [20.5, 21.0, 19.5]
+    conn.close()
+
+def test_a_new_database_needs_no_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = eco_db.open_database()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == eco_db.SCHEMA_VERSION
+    conn.close()
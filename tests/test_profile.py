@@ -0,0 +1,73 @@
+"""Profile some made-up work phase by phase, and compare two profiled runs."""
+
+import json
+import pstats
+import pytest
+import eco_profile
+import eco_timing
+
+def busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+def profile_run(directory, rounds: int) -> eco_profile.Profiler:
+    """Profile 'rounds' rounds of the phases a long-running process goes through."""
+    with eco_profile.Profiler(str(directory)) as profiler:
+        for _ in range(rounds):
+            with eco_timing.Span('db_query'):
+                busy(1000)
+            timer = eco_timing.PhaseTimer()
+            busy(2000)
+            timer.lap('bars')
+    return profiler
+
+@pytest.fixture(autouse=True, name='spans')
+def fixture_spans(monkeypatch):
+    monkeypatch.setattr(eco_timing, 'SPANS', [])
+
+def test_each_phase_is_profiled_and_written_out(tmp_path):
+    profiler = profile_run(tmp_path / 'run', 50)
+
+    phases = json.loads((tmp_path / 'run' / 'phases.json').read_text())
+    assert phases['db_query']['count'] == phases['bars']['count'] == 50
+    assert eco_timing.PROFILER is None
+
+    # however many times a phase ran, it's one set of stats
+    for name in ('db_query', 'bars'):
+        stats = profiler.phases[name]['stats']
+        assert isinstance(stats, pstats.Stats)
+        assert sum(calls for (_, _, function), (_, calls, _, _, _) in stats.stats.items()
+                   if function == 'busy') == 50
+        assert (tmp_path / 'run' / (name + '.prof')).exists()
+
+    merged = pstats.Stats(str(tmp_path / 'run' / 'all.prof'))
+    assert sum(calls for (_, _, function), (_, calls, _, _, _) in merged.stats.items()
+               if function == 'busy') == 100
+    assert 'db_query - ' in (tmp_path / 'run' / 'report.txt').read_text()
+
+def test_profiling_only_when_asked(tmp_path):
+    with eco_profile.profiling(None, 'store'):
+        assert eco_timing.PROFILER is None
+
+    with eco_profile.profiling(str(tmp_path), 'store'):
+        assert eco_timing.PROFILER is not None
+    assert [path.name.split('-')[0] for path in tmp_path.iterdir()] == ['store']
+
+def test_comparing_two_runs(tmp_path, capsys):
+    profile_run(tmp_path / 'old', 1)
+    profile_run(tmp_path / 'new', 3)
+    capsys.readouterr()
+
+    eco_profile.main([str(tmp_path / 'old'), str(tmp_path / 'new'), '--top', '5'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split()[:3] == ['phase', 'old', 's']
+    assert any(line.startswith('db_query') for line in lines)
+    assert any(line.startswith('test_profile.py:busy') for line in lines)
+
+    with pytest.raises(SystemExit, match="doesn't look like a profile"):
+        eco_profile.main([str(tmp_path / 'old'), str(tmp_path / 'missing')])
+
+def test_change():
+    assert eco_profile.change(2, 3) == '+50%'
+    assert eco_profile.change(4, 1) == '-75%'
+    assert eco_profile.change(0, 1) == 'new'
+    assert eco_profile.change(0, 0) == ''
@@ -0,0 +1,67 @@
+"""Roll old slots up into the long-term history with store_data.prune_data, storing
+some of them again in between, and check every slot is counted exactly once."""
+
+import pytest
+import eco_db
+import store_data
+
+DAY = 86400
+NOW = 1717243800 # 2024-06-01 12:10 UTC
+TODAY = NOW // DAY * DAY
+CONFIG = {'Retention': {'RawDays': 1, 'HourlyDays': 3, 'DailyDays': 366, 'PruneEveryHours': 24}}
+
+@pytest.fixture(name='conn')
+def fixture_conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = eco_db.open_database()
+    conn.execute("INSERT INTO series VALUES (1, 'tariff', 'A', 'value_inc_vat')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+def store(conn, slots: dict):
+    conn.executemany('INSERT INTO readings VALUES (1, ?, ?) ON CONFLICT(series_id, valid_from) '
+                     'DO UPDATE SET value=excluded.value', slots.items())
+    conn.commit()
+
+def hourly(conn, period_start: int) -> tuple:
+    return conn.execute('SELECT slots, min_value, mean_value, max_value FROM readings_hourly '
+                        'WHERE series_id = 1 AND period_start = ?', (period_start,)).fetchone()
+
+def daily(conn, period_start: int) -> tuple:
+    return conn.execute('SELECT slots, min_value, mean_value, max_value FROM readings_daily '
+                        'WHERE series_id = 1 AND period_start = ?', (period_start,)).fetchone()
+
+def test_slots_stored_again_are_not_counted_twice(conn):
+    hour = TODAY - 2 * DAY + 3600 # older than RawDays, so rolled up into hours
+    store(conn, {hour: 10.0, hour + 1800: 20.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert hourly(conn, hour) == (2, 10.0, 15.0, 20.0)
+
+    # e.g. fetched again: already counted, so the hour stays as it was
+    store(conn, {hour: 10.0, hour + 1800: 20.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert hourly(conn, hour) == (2, 10.0, 15.0, 20.0)
+    assert conn.execute('SELECT COUNT(*) FROM readings').fetchone()[0] == 0
+
+def test_slots_that_turn_up_later_are_added(conn):
+    hour = TODAY - 2 * DAY + 3600
+    store(conn, {hour: 10.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert hourly(conn, hour) == (1, 10.0, 10.0, 10.0)
+
+    store(conn, {hour: 10.0, hour + 1800: 20.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert hourly(conn, hour) == (2, 10.0, 15.0, 20.0)
+
+def test_days_count_each_slot_once(conn):
+    day = TODAY - 5 * DAY # older than HourlyDays, so rolled up into days
+    store(conn, {day: 10.0, day + 1800: 20.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert daily(conn, day) == (2, 10.0, 15.0, 20.0)
+
+    # stored again, and another hour that's new
+    store(conn, {day: 10.0, day + 1800: 20.0, day + 7200: 30.0})
+    store_data.prune_data(conn, CONFIG, NOW)
+    assert daily(conn, day) == (3, 10.0, 20.0, 30.0)
+    assert conn.execute('SELECT COUNT(*) FROM readings_hourly').fetchone()[0] == 0
@@ -0,0 +1,194 @@
+"""Drive eco_scheduler.Scheduler, and run_daemon's loop, from a fake clock."""
+
+import random
+from datetime import datetime, timedelta, timezone
+import pytest
+import eco_scheduler
+import run_daemon
+import store_data
+
+UTC = timezone.utc
+
+def at(*when) -> float:
+    """A UNIX timestamp for a UTC date and time."""
+    return datetime(*when, tzinfo=UTC).timestamp()
+
+def scheduler(mode: str) -> eco_scheduler.Scheduler:
+    return eco_scheduler.Scheduler(mode, rng=random.Random(1), tz=UTC)
+
+def test_carbon_fetches_every_half_hour_at_its_offset():
+    carbon = scheduler('carbon')
+    offset = carbon.fetch_offset
+    assert 0 <= offset < 60
+
+    assert carbon.next_fetch(at(2024, 6, 1, 12, 0)) == at(2024, 6, 1, 12, 0) + offset
+    # strictly after now, so a fetch made on time isn't made again
+    assert carbon.next_fetch(at(2024, 6, 1, 12, 0) + offset) == at(2024, 6, 1, 12, 30) + offset
+    assert carbon.next_fetch(at(2024, 6, 1, 23, 59)) == at(2024, 6, 2, 0, 0) + offset
+
+@pytest.mark.parametrize('mode', ['agile_import', 'agile_export'])
+def test_agile_fetches_in_the_publication_window(mode):
+    agile = scheduler(mode)
+    minute = agile.fetch_offset
+    assert 30 <= minute < 59
+
+    assert agile.next_fetch(at(2024, 6, 1, 9, 0)) == at(2024, 6, 1, 16, minute)
+    assert agile.next_fetch(at(2024, 6, 1, 16, minute)) == at(2024, 6, 1, 18, minute)
+    assert agile.next_fetch(at(2024, 6, 1, 19, 0)) == at(2024, 6, 1, 20, minute)
+    # and then not until tomorrow's prices are due
+    assert agile.next_fetch(at(2024, 6, 1, 20, minute)) == at(2024, 6, 2, 16, minute)
+
+def test_tracker_fetches_every_hour():
+    tracker = scheduler('tracker')
+    minute = tracker.fetch_offset
+
+    assert tracker.next_fetch(at(2024, 6, 1, 12, 0)) == at(2024, 6, 1, 12, minute)
+    assert tracker.next_fetch(at(2024, 6, 1, 12, minute)) == at(2024, 6, 1, 13, minute)
+    assert tracker.next_fetch(at(2024, 6, 1, 23, 59)) == at(2024, 6, 2, 0, minute)
+
+def test_fetch_times_follow_the_local_timezone():
+    # 16:xx in British Summer Time is 15:xx UTC
+    agile = eco_scheduler.Scheduler('agile_import', rng=random.Random(1),
+                                    tz=timezone(timedelta(hours=1)))
+    assert agile.next_fetch(at(2024, 6, 1, 9, 0)) == at(2024, 6, 1, 15, agile.fetch_offset)
+
+def test_repaints_on_slot_boundaries():
+    carbon = scheduler('carbon')
+    assert carbon.next_repaint(at(2024, 6, 1, 12, 0)) == at(2024, 6, 1, 12, 30)
+    assert carbon.next_repaint(at(2024, 6, 1, 12, 29) + 59.9) == at(2024, 6, 1, 12, 30)
+    assert carbon.next_repaint(at(2024, 6, 1, 23, 45)) == at(2024, 6, 2, 0, 0)
+
+def test_clears_at_the_next_clear_time():
+    carbon = scheduler('carbon')
+    clear_times = [(3, 0), (15, 30)]
+    assert carbon.next_clear(at(2024, 6, 1, 12, 0), clear_times) == at(2024, 6, 1, 15, 30)
+    assert carbon.next_clear(at(2024, 6, 1, 15, 30), clear_times) == at(2024, 6, 2, 3, 0)
+    assert carbon.next_clear(at(2024, 6, 1, 12, 0), []) is None
+
+def test_retries_back_off_up_to_a_slot():
+    carbon = scheduler('carbon')
+    now = at(2024, 6, 1, 12, 0)
+    assert [carbon.next_retry(now, failures) - now for failures in range(1, 8)] == \
+        [60, 120, 240, 480, 960, 1800, 1800]
+
+def test_unknown_mode():
+    with pytest.raises(SystemExit):
+        eco_scheduler.Scheduler('solar')
+
+class Clock:
+    """A fake clock that only moves when slept on, and stops the loop after a while."""
+
+    def __init__(self, now: float, until: float):
+        self.now = now
+        self.until = until
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        assert seconds >= 0
+        self.now += seconds
+        if self.now >= self.until:
+            raise KeyboardInterrupt
+
+def config(mode: str = 'carbon', display: str = 'blinkt') -> dict:
+    return {'DisplayType': display, 'Mode': mode, 'Metrics': {'LogFile': None}}
+
+@pytest.fixture(name='calls')
+def fixture_calls(monkeypatch):
+    """Record when the loop fetches, repaints and clears, and what with."""
+    calls = {'fetch': [], 'repaint': [], 'clear': [], 'fail_fetch': 0, 'retry': None}
+    clock = {}
+
+    def fetch(_conn, config_used, _session):
+        calls['fetch'].append((clock['clock'](), config_used['Mode']))
+        if calls['fail_fetch']:
+            calls['fail_fetch'] -= 1
+            return False
+        return True
+
+    def repaint(_conn, _config, _inky_display, _demo, _animator=None):
+        calls['repaint'].append(clock['clock']())
+        return True
+
+    monkeypatch.setattr(run_daemon, 'fetch', fetch)
+    monkeypatch.setattr(run_daemon, 'repaint', repaint)
+    monkeypatch.setattr(run_daemon, 'clear',
+                        lambda _config, _inky: calls['clear'].append(clock['clock']()))
+    monkeypatch.setattr(store_data, 'next_retry', lambda _conn: calls['retry'])
+    calls['clock'] = clock
+    return calls
+
+def run(calls, clock: Clock, mode: str = 'carbon', **kwargs):
+    calls['clock']['clock'] = clock
+    with pytest.raises(KeyboardInterrupt):
+        run_daemon.run(None, kwargs.pop('config', config(mode)), None, None, scheduler(mode),
+                       clock=clock, sleep=clock.sleep, **kwargs)
+
+def test_loop_fetches_and_repaints_on_time(calls):
+    start = at(2024, 6, 1, 12, 10)
+    carbon = scheduler('carbon')
+    run(calls, Clock(start, at(2024, 6, 1, 13, 15)))
+
+    assert calls['fetch'] == [(start, 'carbon'),
+                              (at(2024, 6, 1, 12, 30) + carbon.fetch_offset, 'carbon'),
+                              (at(2024, 6, 1, 13, 0) + carbon.fetch_offset, 'carbon')]
+    assert calls['repaint'] == [start, at(2024, 6, 1, 12, 30), at(2024, 6, 1, 13, 0)]
+
+def test_loop_retries_a_failed_request_sooner(calls):
+    start = at(2024, 6, 1, 9, 0)
+    calls['retry'] = start + 300
+    run(calls, Clock(start, start + 400), mode='agile_import')
+    assert [when for when, _ in calls['fetch']] == [start, start + 300]
+
+def test_loop_backs_off_after_failed_fetches(calls):
+    start = at(2024, 6, 1, 9, 0)
+    calls['fail_fetch'] = 3
+    run(calls, Clock(start, start + 1000), mode='agile_import')
+    # the next scheduled fetch isn't until 16:xx, so only the backoff brings it forward
+    assert [when - start for when, _ in calls['fetch']] == [0, 60, 180, 420]
+
+def test_loop_clears_and_repaints(calls):
+    start = at(2024, 6, 1, 12, 10)
+    inky_config = config(display='inkyphat')
+    inky_config['InkyPHAT'] = {'ClearAt': [(12, 20)]}
+    run(calls, Clock(start, at(2024, 6, 1, 12, 25)), config=inky_config)
+
+    assert calls['clear'] == [at(2024, 6, 1, 12, 20)]
+    assert calls['repaint'] == [start, at(2024, 6, 1, 12, 20)]
+
+def test_loop_reloads_an_edited_config(calls, monkeypatch):
+    start = at(2024, 6, 1, 12, 10)
+    edited = start + 100
+    clock = Clock(start, start + 200)
+    monkeypatch.setattr(run_daemon.eco_config, 'config_stamp',
+                        lambda _conf_file: 'old' if clock() < edited else 'new')
+    monkeypatch.setattr(run_daemon.eco_config, 'get_config',
+                        lambda _conf_file: config('agile_import'))
+
+    run(calls, clock, conf_file='config.yaml')
+
+    # noticed on the next config check, then fetched and repainted for the new mode
+    assert edited % run_daemon.CONFIG_CHECK_SECONDS == start % run_daemon.CONFIG_CHECK_SECONDS
+    assert calls['fetch'] == [(start, 'carbon'), (edited, 'agile_import')]
+    assert calls['repaint'] == [start, edited]
+
+@pytest.mark.parametrize('new_config', [config(display='inkyphat'), SystemExit('bad YAML')])
+def test_loop_keeps_the_old_config_if_the_new_one_wont_do(calls, monkeypatch, new_config):
+    start = at(2024, 6, 1, 12, 10)
+    clock = Clock(start, start + 200)
+    monkeypatch.setattr(run_daemon.eco_config, 'config_stamp',
+                        lambda _conf_file: 'old' if clock() < start + 100 else 'new')
+
+    def get_config(_conf_file):
+        if isinstance(new_config, SystemExit):
+            raise new_config
+        return new_config
+
+    monkeypatch.setattr(run_daemon.eco_config, 'get_config', get_config)
+
+    run(calls, clock, conf_file='config.yaml')
+
+    # a DisplayType change needs a restart, and a broken config is ignored
+    assert calls['fetch'] == [(start, 'carbon')]
+    assert calls['repaint'] == [start]
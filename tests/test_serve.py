@@ -0,0 +1,108 @@
+"""Ask serve.py's slot server for slots over HTTP and a Unix socket, as indicators do."""
+
+import json
+import time
+import threading
+import pytest
+import eco_db
+import eco_series
+import serve
+import store_data
+import update_display
+
+CARBON = eco_series.mode_series('carbon', 'Z')[0]
+SLOTS = 8
+
+def store_slots(conn, first_value: float):
+    """SLOTS made-up carbon intensities from the current slot on."""
+    series_id = eco_db.series_id(conn, CARBON)
+    current_slot = int(time.time()) // eco_series.HALF_HOUR * eco_series.HALF_HOUR
+    conn.executemany('INSERT INTO readings VALUES (?, ?, ?) ON CONFLICT(series_id, valid_from) '
+                     'DO UPDATE SET value=excluded.value',
+                     [(series_id, current_slot + slot * eco_series.HALF_HOUR, first_value + slot)
+                      for slot in range(SLOTS)])
+    conn.commit()
+
+@pytest.fixture(name='conn')
+def fixture_conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = store_data.open_database()
+    store_slots(conn, 100)
+    yield conn
+    conn.close()
+
+def start(listen: str):
+    server = serve.make_server(listen)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.fixture(name='server')
+def fixture_server(conn): # pylint: disable=unused-argument
+    server = start('127.0.0.1:0')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get(address: str, path: str, etag: str = None) -> tuple:
+    """(status, ETag, body) from a GET."""
+    conn = update_display.connect_to_server(address, timeout=5)
+    try:
+        conn.request('GET', path, headers={'If-None-Match': etag} if etag else {})
+        response = conn.getresponse()
+        return response.status, response.getheader('ETag'), response.read()
+    finally:
+        conn.close()
+
+def address(server) -> str:
+    return 'http://127.0.0.1:' + str(server.server_address[1])
+
+def test_slots_are_sent_only_when_they_change(conn, server):
+    status, etag, body = get(address(server), '/slots?mode=carbon&region=Z&limit=4')
+    assert status == 200
+    answer = json.loads(body)
+    assert answer['roles'] == ['carbon']
+    assert [row[1] for row in answer['rows']] == [100, 101, 102, 103]
+
+    assert get(address(server), '/slots?mode=carbon&region=Z&limit=4', etag) == (304, etag, b'')
+
+    # new data gets a new answer
+    store_slots(conn, 200)
+    status, new_etag, body = get(address(server), '/slots?mode=carbon&region=Z&limit=4', etag)
+    assert status == 200 and new_etag != etag
+    assert [row[1] for row in json.loads(body)['rows']] == [200, 201, 202, 203]
+
+@pytest.mark.parametrize('path, status', [
+    ('/slots?mode=carbon&region=Z', 400),
+    ('/slots?mode=carbon&region=Z&limit=0', 400),
+    ('/slots?mode=carbon&region=Z&limit=lots', 400),
+    ('/slots?mode=carbon&region=X&limit=4', 400),
+    ('/slots?mode=agile_import&region=B&limit=4', 400),
+    ('/slots?mode=agile_import&region=B&cap=101&limit=4', 404),
+    ('/readings', 404)])
+def test_bad_requests(server, path, status):
+    assert get(address(server), path)[0] == status
+
+def test_serving_on_a_unix_socket(conn, tmp_path): # pylint: disable=unused-argument
+    socket_file = str(tmp_path / 'eco.sock')
+    server = start('unix:' + socket_file)
+    try:
+        status, _, body = get('unix:' + socket_file, '/slots?mode=carbon&region=Z&limit=2')
+        assert status == 200
+        assert [row[1] for row in json.loads(body)['rows']] == [100, 101]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_only_so_many_answers_are_kept(conn):
+    cache = serve.SlotCache()
+    first = cache.answer({'mode': 'carbon', 'region': 'Z', 'limit': '1'})
+    for limit in range(2, serve.MAX_ANSWERS + 10):
+        cache.answer({'mode': 'carbon', 'region': 'Z', 'limit': str(limit)})
+    assert len(cache.answers) == serve.MAX_ANSWERS
+    assert ('carbon', 'Z', None, 1) not in cache.answers
+
+    # and none are kept once the data's changed
+    store_slots(conn, 200)
+    assert cache.answer({'mode': 'carbon', 'region': 'Z', 'limit': '1'}) != first
+    assert list(cache.answers) == [('carbon', 'Z', None, 1)]
+    cache.conn.close()
@@ -0,0 +1,48 @@
+"""Turn database rows into SlotSeries, as update_display.py does when it reads them."""
+
+import time
+import sqlite3
+import pytest
+import eco_slots
+
+# 2024-06-01 11:00 UTC, which is 12:00 in London
+START = 1717239600
+
+@pytest.fixture(name='london', autouse=True)
+def fixture_london(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/London')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_rows_are_split_into_series_sharing_the_slots():
+    electricity, gas = eco_slots.from_rows(
+        iter([(START, 20.5, 7.1), (START + 1800, 21.0, None)]), 2)
+
+    assert list(electricity.starts) == list(gas.starts) == [START, START + 1800]
+    assert list(electricity.values) == [20.5, 21.0]
+    assert gas.values[0] == 7.1 and gas.has_value(0)
+    # a missing value is NaN, which is never equal to anything, even itself
+    assert not gas.has_value(1)
+    assert len(electricity) == len(gas) == 2
+
+def test_slot_times_are_local():
+    slots, = eco_slots.from_rows([(START, 1), (START + 1800, 2)], 1)
+    assert [slots.hhmm(0), slots.hhmm(1)] == ['12:00', '12:30']
+    assert slots.local_times[0].utcoffset().total_seconds() == 3600
+
+def test_rows_straight_from_the_database():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE readings (valid_from INTEGER, value REAL)')
+    conn.executemany('INSERT INTO readings VALUES (?, ?)',
+                     [(START + slot * 1800, slot) for slot in range(48)])
+
+    slots, = eco_slots.from_rows(conn.execute('SELECT * FROM readings ORDER BY valid_from'), 1)
+    assert len(slots) == 48
+    assert slots.hhmm(47) == '11:30'
+    assert list(slots.values) == list(range(48))
+
+def test_no_rows():
+    slots, = eco_slots.from_rows([], 1)
+    assert len(slots) == 0
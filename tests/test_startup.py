@@ -0,0 +1,31 @@
+"""Check that each command only imports what it needs, which is what keeps eco.py's
+start-up time down. How long that actually takes depends on the machine, so it's left
+to ./eco.py startup-check rather than timed here."""
+
+import os
+import sys
+import subprocess
+import pytest
+import eco
+
+HEAVY = {'requests', 'yaml', 'PIL', 'inky', 'blinkt'}
+
+def imported_by(module: str) -> set:
+    """Every module loaded by importing 'module' in a fresh interpreter."""
+    return set(subprocess.run([sys.executable, '-c', 'import sys, ' + module + '\n'
+                               'print(" ".join(sys.modules))'],
+                              cwd=os.path.dirname(os.path.abspath(eco.__file__)),
+                              capture_output=True, text=True, check=True).stdout.split())
+
+def test_the_entry_point_imports_no_commands():
+    loaded = imported_by('eco')
+    assert not HEAVY & loaded
+    assert not {module for module, _ in eco.COMMANDS.values()} & loaded
+
+@pytest.mark.parametrize('module', sorted({module for module, _ in eco.COMMANDS.values()}))
+def test_heavy_libraries_are_only_imported_when_needed(module):
+    assert not HEAVY & imported_by(module)
+
+def test_over_budget_fails():
+    with pytest.raises(SystemExit, match='store'):
+        eco.startup_check(['store', '--budget', '0', '--repeat', '1'])
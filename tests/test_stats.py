@@ -0,0 +1,48 @@
+"""Check eco_stats' windows against working them out the slow way."""
+
+import random
+import pytest
+import eco_stats
+
+def slow_means(values: list, window: int) -> list:
+    return [sum(values[start:start + window]) / window
+            for start in range(len(values) - window + 1)]
+
+@pytest.mark.parametrize('window', [1, 2, 6, 10])
+def test_every_window_is_averaged_up_to_the_last_slot(window):
+    values = [random.Random(window).uniform(-5, 40) for _ in range(10)]
+    assert eco_stats.window_means(values, window) == pytest.approx(slow_means(values, window))
+    assert len(eco_stats.window_means(values, window)) == 11 - window
+
+def test_no_windows_longer_than_the_values():
+    assert not eco_stats.window_means([1, 2, 3], 4)
+    assert not eco_stats.best_windows(eco_stats.window_means([1, 2, 3], 4), 4, 1, False)
+
+def test_the_last_block_may_be_short():
+    assert eco_stats.block_means([1, 3, 5, 7, 9], 2) == [2, 6, 9]
+    assert eco_stats.block_means([1, 3, 5, 7], 2) == [2, 6]
+
+def test_windows_are_picked_without_overlapping():
+    values = [5, 1, 1, 5, 5, 2, 2, 5, 0, 9]
+    means = eco_stats.window_means(values, 2)
+    assert eco_stats.best_windows(means, 2, 3, False) == [(1, 1), (5, 2), (7, 2.5)]
+    # the windows at 0, 2, 4 and 6 are cheaper than the one at 3, but each overlaps one
+    # already picked, and the one at 8 overlaps 7's - so only four fit
+    assert eco_stats.best_windows(means, 2, 5, False) == [(1, 1), (5, 2), (7, 2.5), (3, 5)]
+    assert eco_stats.best_windows(means, 2, 2, True) == [(3, 5), (8, 4.5)]
+
+def test_ties_go_to_the_earliest_window():
+    assert eco_stats.best_windows([3, 1, 2, 1, 1], 1, 2, False) == [(1, 1), (3, 1)]
+    assert eco_stats.best_windows([3, 1, 2, 1, 1], 2, 2, False) == [(1, 1), (3, 1)]
+    assert eco_stats.best_windows([3, 1, 2, 1, 1], 3, 2, False) == [(1, 1), (4, 1)]
+
+def test_window_stats():
+    values = [10, 20, 5, 5, 30, 40, 5, 50]
+    stats = eco_stats.window_stats(values, 2, trim_highest=2)
+    assert stats['lowest_windows'] == [(2, 5)]
+    assert stats['highest_windows'] == [(4, 35)]
+    assert (stats['min_index'], stats['max_index']) == (2, 7)
+    assert stats['trimmed_mean'] == pytest.approx((10 + 20 + 5 + 5 + 30 + 5) / 6)
+
+    # with no more values than are trimmed, nothing is
+    assert eco_stats.window_stats([1, 2, 6], 1)['trimmed_mean'] == 3
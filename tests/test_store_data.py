@@ -0,0 +1,316 @@
+"""Fetch from a local stub of the Octopus and carbonintensity.org.uk APIs, pointed at
+with OctopusAPIBase and CarbonAPIBase, and check what ends up in the database."""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import eco_config
+import eco_db
+import eco_series
+import eco_stats
+import store_data
+import update_display
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Answers every GET with the server's 'responses' for the API asked, as a
+    (status, ETag, body) tuple, and keeps a note of each request and the client port it
+    came from. Connections are kept alive, as the real APIs' are. Given a 'barrier',
+    each request waits there for the others."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        api = 'octopus' if self.path.startswith('/v1/products/') else 'carbon'
+        if_none_match = self.headers.get('If-None-Match')
+        self.server.requests.append((api, self.path, if_none_match))
+        self.server.clients.append((api, self.client_address[1]))
+        if self.server.barrier is not None:
+            self.server.barrier.wait()
+
+        status, etag, body = self.server.responses[api]
+        if etag is not None and if_none_match == etag:
+            status, body = 304, None
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if body is not None:
+            body = body.encode('utf-8')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+@pytest.fixture(name='api')
+def fixture_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPI)
+    server.requests = []
+    server.clients = []
+    server.barrier = None
+    server.responses = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+class FrozenDatetime(datetime):
+    """datetime, stopped at NOW so that the URIs asked for don't change between runs."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return NOW.astimezone(tz) if tz is not None else NOW.astimezone().replace(tzinfo=None)
+
+@pytest.fixture(name='config')
+def fixture_config(api, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(store_data, 'datetime', FrozenDatetime)
+    base = 'http://127.0.0.1:' + str(api.server_address[1])
+    (tmp_path / 'config.yaml').write_text(
+        'Mode: agile_import\nAgileCap: 101\nDisplayType: inkyphat\nDNORegion: B\n'
+        'ExtraSeries:\n  - Mode: carbon\n    DNORegion: Z\n'
+        'OctopusAPIBase: ' + base + '/v1/products/\nCarbonAPIBase: ' + base + '\n')
+    return eco_config.get_config('config.yaml')
+
+def slot_starts(until: datetime) -> list:
+    """Half hour slots from a couple of hours ago up to 'until'."""
+    start = NOW.replace(minute=NOW.minute // 30 * 30, second=0) - timedelta(hours=2)
+    return [start + timedelta(minutes=30 * slot)
+            for slot in range(int((until - start).total_seconds()) // 1800)]
+
+def octopus_body(until: datetime) -> str:
+    return json.dumps({'results': [
+        {'valid_from': slot.strftime('%Y-%m-%dT%H:%M:%SZ'), 'value_inc_vat': 10 + slot.hour}
+        for slot in reversed(slot_starts(until))]})
+
+def carbon_body() -> str:
+    return json.dumps({'data': [
+        {'from': slot.strftime('%Y-%m-%dT%H:%MZ'), 'intensity': {'forecast': 100 + slot.hour}}
+        for slot in slot_starts(NOW + timedelta(hours=24))]})
+
+def run(conn, config: dict):
+    store_data.fetch_and_store(conn, config)
+
+def rows(conn, source: str) -> int:
+    tariff = 'carbon-intensity' if source == 'carbon' else 'E-1R-AGILE-24-04-03-B'
+    return conn.execute('SELECT COUNT(*) FROM readings JOIN series USING (series_id) '
+                        'WHERE tariff = ?', (tariff,)).fetchone()[0]
+
+def retries(conn) -> dict:
+    return {upstream: failures for upstream, failures in
+            conn.execute('SELECT upstream, failures FROM fetch_retries')}
+
+def test_fetches_conditionally_and_retries_later(api, config):
+    horizon = store_data.publication_horizon('agile', NOW).astimezone(timezone.utc)
+    api.responses['octopus'] = (200, '"octopus-1"', octopus_body(horizon))
+    api.responses['carbon'] = (503, None, 'Service Unavailable')
+
+    conn = store_data.open_database(config)
+
+    # the prices are stored, and the carbon intensity API's failure is kept for later
+    run(conn, config)
+    assert rows(conn, 'octopus') == len(slot_starts(horizon))
+    assert rows(conn, 'carbon') == 0
+    assert retries(conn) == {'carbon': 1}
+    assert sorted(api for api, _, _ in api.requests) == ['carbon', 'octopus']
+
+    # we have every price there could be, and it's too soon to ask for carbon again
+    api.requests.clear()
+    run(conn, config)
+    assert not api.requests
+
+    # once the retry is due, carbon is asked again
+    conn.execute('UPDATE fetch_retries SET next_attempt = 0')
+    conn.commit()
+    api.responses['carbon'] = (200, '"carbon-1"', carbon_body())
+    run(conn, config)
+    assert [(api, etag) for api, _, etag in api.requests] == [('carbon', None)]
+    assert rows(conn, 'carbon') == len(slot_starts(NOW + timedelta(hours=24)))
+    assert retries(conn) == {}
+
+    # and then only conditionally, getting a 304 and keeping what we have
+    api.requests.clear()
+    run(conn, config)
+    assert [(api, etag) for api, _, etag in api.requests] == [('carbon', '"carbon-1"')]
+    assert rows(conn, 'carbon') == len(slot_starts(NOW + timedelta(hours=24)))
+    assert retries(conn) == {}
+
+    conn.close()
+
+def test_asks_only_for_newer_prices(api, config):
+    horizon = store_data.publication_horizon('agile', NOW).astimezone(timezone.utc)
+    partial = horizon - timedelta(hours=3)
+    api.responses['octopus'] = (200, '"octopus-1"', octopus_body(partial))
+    api.responses['carbon'] = (200, None, carbon_body())
+
+    conn = store_data.open_database(config)
+    run(conn, config)
+    assert rows(conn, 'octopus') == len(slot_starts(partial))
+
+    api.requests.clear()
+    api.responses['octopus'] = (200, '"octopus-2"', octopus_body(horizon))
+    run(conn, config)
+    newest = (partial - timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    assert [path.split('?')[1] for api, path, _ in api.requests if api == 'octopus'] == \
+        ['period_from=' + newest]
+    assert rows(conn, 'octopus') == len(slot_starts(horizon))
+
+    conn.close()
+
+def test_a_bad_body_is_retried_without_losing_the_other_feeds(api, config):
+    api.responses['octopus'] = (200, None, '<html><body>Bad gateway</body></html>')
+    api.responses['carbon'] = (503, None, 'Service Unavailable')
+
+    conn = store_data.open_database(config)
+    run(conn, config)
+    assert retries(conn) == {'octopus': 1, 'carbon': 1}
+    assert rows(conn, 'octopus') == rows(conn, 'carbon') == 0
+
+    conn.execute('UPDATE fetch_retries SET next_attempt = 0')
+    conn.commit()
+    api.responses['carbon'] = (200, None, carbon_body())
+    run(conn, config)
+    assert retries(conn) == {'octopus': 2}
+    assert rows(conn, 'carbon') == len(slot_starts(NOW + timedelta(hours=24)))
+
+    conn.close()
+
+def test_feeds_are_fetched_together_over_one_session(api, config):
+    api.responses['octopus'] = (200, None, '<html><body>Bad gateway</body></html>')
+    api.responses['carbon'] = (200, None, carbon_body())
+    # neither request is answered until both have been made
+    api.barrier = threading.Barrier(2, timeout=5)
+
+    conn = store_data.open_database(config)
+    feeds = store_data.plan_feeds(conn, config)
+    session = store_data.make_session()
+    store_data.fetch_feeds(feeds, session)
+    assert {feed['upstream']: feed['error'] for feed in feeds} == {
+        'octopus': "API returned something other than JSON: '<html><body>Bad gateway</body></html>'",
+        'carbon': None}
+
+    # the failing feed doesn't stop the other being stored
+    store_data.store_feeds(conn, feeds, config)
+    assert rows(conn, 'octopus') == 0
+    assert rows(conn, 'carbon') == len(slot_starts(NOW + timedelta(hours=24)))
+    assert retries(conn) == {'octopus': 1}
+
+    # and next time the same connections are used again
+    api.barrier = None
+    first_clients = {port for _, port in api.clients}
+    api.clients.clear()
+    store_data.fetch_feeds(store_data.plan_feeds(conn, config), session)
+    assert len(api.clients) == 2
+    assert {port for _, port in api.clients} <= first_clients
+
+    session.close()
+    conn.close()
+
+def summary_of(stats: dict) -> tuple:
+    return (stats['lowest_windows'][0], stats['highest_windows'][0], stats['min_index'],
+            stats['max_index'], stats['trimmed_mean'])
+
+def test_new_data_is_summarised_for_the_display(api, config):
+    api.responses['octopus'] = (200, None, octopus_body(NOW + timedelta(hours=30)))
+    api.responses['carbon'] = (200, None, carbon_body())
+
+    conn = store_data.open_database(config)
+    run(conn, config)
+
+    slots = update_display.read_data(conn, config)
+    shown = slots['electricity']
+    assert len(shown) == config['InkyPHAT']['DataDuration'] * 2
+    expected = summary_of(eco_stats.window_stats(shown.values, 6))
+    assert summary_of(update_display.read_summary(conn, config, slots)) == expected
+
+    # a summary of a different stretch of slots is no use
+    for change in ('count = count - 1', 'last_start = last_start - 1800'):
+        conn.execute('UPDATE slot_summaries SET ' + change)
+        assert update_display.read_summary(conn, config, slots) is None
+        conn.rollback()
+
+    # and they're worked out again if they go missing
+    conn.execute('DELETE FROM slot_summaries')
+    conn.commit()
+    assert store_data.summaries_missing(conn, NOW.timestamp())
+    store_data.update_summaries(conn, config, NOW.timestamp())
+    assert summary_of(update_display.read_summary(conn, config, slots)) == expected
+
+    conn.close()
+
+def test_data_is_only_stored_along_with_its_summaries(api, config, monkeypatch):
+    api.responses['octopus'] = (200, None, octopus_body(NOW + timedelta(hours=30)))
+    api.responses['carbon'] = (200, None, carbon_body())
+
+    def broken(conn, config, now):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    summarise = store_data.summarise
+    monkeypatch.setattr(store_data, 'summarise', broken)
+
+    conn = store_data.open_database(config)
+    with pytest.raises(SystemError):
+        run(conn, config)
+    # nothing was kept, so the next run fetches it all again
+    assert rows(conn, 'octopus') == rows(conn, 'carbon') == 0
+
+    monkeypatch.setattr(store_data, 'summarise', summarise)
+    run(conn, config)
+    assert rows(conn, 'octopus') > 0
+    assert update_display.read_summary(conn, config, update_display.read_data(conn, config))
+
+    conn.close()
+
+def carbon_feed(conn, values: list) -> dict:
+    """A fetched feed of national carbon intensities, one a slot from NOW's."""
+    series = eco_series.mode_series('carbon', 'Z')[0]
+    return {'uri': None, 'series': series, 'series_id': eco_db.series_id(conn, series),
+            'response': None, 'data': {'data': [
+                {'from': slot.strftime('%Y-%m-%dT%H:%MZ'), 'intensity': {'forecast': value}}
+                for slot, value in zip(slot_starts(NOW + timedelta(days=2))[4:], values)]}}
+
+def test_upserts_are_counted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = store_data.open_database()
+    series = eco_series.mode_series('carbon', 'Z')[0]
+
+    assert store_data.insert_data(conn, series, carbon_feed(conn, [1, 2, 3])['data']) == (3, 0, 0)
+    assert store_data.insert_data(conn, series, carbon_feed(conn, [1, 5, 3, 4])['data']) == \
+        (1, 1, 2)
+    assert store_data.insert_data(conn, series, {'data': []}) == (0, 0, 0)
+    assert [value for value, in conn.execute('SELECT value FROM readings ORDER BY valid_from')] == \
+        [1, 5, 3, 4]
+
+    conn.close()
+
+def test_every_feed_is_stored_in_one_transaction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = store_data.open_database()
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    feeds = [carbon_feed(conn, [1, 2, 3]), carbon_feed(conn, [1, 2, 3, 4, 5])]
+    conn.commit()
+    statements.clear()
+    assert store_data.store_feeds(conn, feeds) == (5, 0, 3)
+    assert [statement for statement in statements
+            if statement.startswith(('BEGIN', 'COMMIT', 'ROLLBACK'))] == ['BEGIN IMMEDIATE', 'COMMIT']
+
+    # so if one feed can't be stored, none of them are
+    conn.execute("CREATE TEMP TRIGGER refuse BEFORE INSERT ON readings WHEN NEW.value = 99 "
+                 "BEGIN SELECT RAISE(ABORT, 'refused'); END")
+    feeds = [carbon_feed(conn, [6, 7, 8, 9, 10, 11]), carbon_feed(conn, [1, 2, 3, 4, 5, 6, 99])]
+    with pytest.raises(SystemError, match='refused'):
+        store_data.store_feeds(conn, feeds)
+    assert [value for value, in conn.execute('SELECT value FROM readings ORDER BY valid_from')] == \
+        [1, 2, 3, 4, 5]
+
+    conn.close()
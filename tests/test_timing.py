@@ -0,0 +1,82 @@
+"""Time some made-up spans and check what's written to the log and the Prometheus textfile."""
+
+import json
+import pytest
+import eco_timing
+
+@pytest.fixture(autouse=True, name='spans')
+def fixture_spans(monkeypatch):
+    monkeypatch.setattr(eco_timing, 'SPANS', [])
+    monkeypatch.setattr(eco_timing, 'LATEST', {})
+
+def metrics(tmp_path, **settings) -> dict:
+    return {'Metrics': dict({'LogFile': str(tmp_path / 'timings.log'), 'LogMaxKB': 1,
+                             'LogBackups': 2, 'TextfileDir': None}, **settings)}
+
+def test_spans_are_logged_once(tmp_path):
+    with eco_timing.Span('db_query', mode='carbon') as span:
+        span.fields['rows'] = 48
+    with pytest.raises(ValueError):
+        with eco_timing.Span('api_request', upstream='octopus'):
+            raise ValueError('bad gateway')
+    timer = eco_timing.PhaseTimer()
+    timer.lap('data prep')
+    timer.lap('data prep')
+    timer.record('render')
+
+    eco_timing.write_metrics(metrics(tmp_path), 'display')
+    eco_timing.write_metrics(metrics(tmp_path), 'display') # nothing new to write
+
+    lines = [json.loads(line) for line in (tmp_path / 'timings.log').read_text().splitlines()]
+    assert [(line['span'], line['command']) for line in lines] == [
+        ('db_query', 'display'), ('api_request', 'display'), ('render_data_prep', 'display')]
+    assert lines[0]['mode'] == 'carbon' and lines[0]['rows'] == 48
+    assert lines[1]['error'] == 'bad gateway'
+    assert not eco_timing.SPANS
+
+def test_the_log_is_rotated_once_its_big(tmp_path):
+    log = tmp_path / 'timings.log'
+    for run, filler in enumerate('abc'):
+        log.write_text(filler * 2000)
+        eco_timing.record('render', 0.1, run=run)
+        eco_timing.write_metrics(metrics(tmp_path), 'display')
+
+    # only the two newest old logs are kept
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'timings.log', 'timings.log.1', 'timings.log.2']
+    assert json.loads(log.read_text())['run'] == 2
+    assert (tmp_path / 'timings.log.1').read_text() == 'c' * 2000
+    assert (tmp_path / 'timings.log.2').read_text() == 'b' * 2000
+
+    # and a log that's still small is added to
+    eco_timing.record('render', 0.1, run=3)
+    eco_timing.write_metrics(metrics(tmp_path), 'display')
+    assert [json.loads(line)['run'] for line in log.read_text().splitlines()] == [2, 3]
+
+def test_no_backups_means_starting_again(tmp_path):
+    log = tmp_path / 'timings.log'
+    log.write_text('x' * 2048)
+    eco_timing.record('render', 0.1)
+    eco_timing.write_metrics(metrics(tmp_path, LogBackups=0), 'display')
+    assert json.loads(log.read_text())['span'] == 'render'
+    assert [path.name for path in tmp_path.iterdir()] == ['timings.log']
+
+def test_the_textfile_has_the_latest_of_every_span(tmp_path):
+    settings = metrics(tmp_path, LogFile=None, TextfileDir=str(tmp_path))
+    eco_timing.record('api_request', 0.5, upstream='octopus')
+    eco_timing.record('api_request', 0.25, upstream='carbon', error='timeout')
+    eco_timing.write_metrics(settings, 'daemon')
+    eco_timing.record('render', 1.5)
+    eco_timing.write_metrics(settings, 'daemon')
+
+    assert [path.name for path in tmp_path.iterdir()] == ['eco_indicator_daemon.prom']
+    samples = {line.split(' ')[0]: float(line.split(' ')[1])
+               for line in (tmp_path / 'eco_indicator_daemon.prom').read_text().splitlines()
+               if not line.startswith('#')}
+    # the fetches are still there after a round that only drew
+    assert samples['eco_indicator_span_seconds{command="daemon",span="api_request"}'] == 0.75
+    assert samples['eco_indicator_span_count{command="daemon",span="api_request"}'] == 2
+    assert samples['eco_indicator_span_errors{command="daemon",span="api_request"}'] == 1
+    assert samples['eco_indicator_span_seconds{command="daemon",span="render"}'] == 1.5
+    assert '# TYPE eco_indicator_span_count gauge' in \
+        (tmp_path / 'eco_indicator_daemon.prom').read_text()
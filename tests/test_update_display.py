@@ -0,0 +1,84 @@
+"""Read slots for the display straight from the database, as update_display.py does
+without a data server."""
+
+import sys
+import time
+import sqlite3
+import pytest
+import eco_db
+import eco_series
+import store_data
+import update_display
+
+CARBON = eco_series.mode_series('carbon', 'Z')[0]
+
+@pytest.fixture(name='conn')
+def fixture_conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = store_data.open_database()
+    yield conn
+    conn.close()
+
+def store_slots(conn, first: int, count: int):
+    """'count' made-up carbon intensities, one a slot from 'first' slots after the
+    current one (so negative for past slots)."""
+    series_id = eco_db.series_id(conn, CARBON)
+    current_slot = int(time.time()) // eco_series.HALF_HOUR * eco_series.HALF_HOUR
+    conn.executemany('INSERT INTO readings VALUES (?, ?, ?)',
+                     [(series_id, current_slot + slot * eco_series.HALF_HOUR, 100 + slot)
+                      for slot in range(first, first + count)])
+    conn.commit()
+
+def test_only_an_up_to_date_database_is_read(conn):
+    update_display.open_database().close()
+
+    conn.execute('PRAGMA user_version = ' + str(eco_db.SCHEMA_VERSION - 1))
+    with pytest.raises(SystemExit, match='needs updating'):
+        update_display.open_database()
+
+    conn.execute('PRAGMA user_version = ' + str(eco_db.SCHEMA_VERSION + 1))
+    with pytest.raises(SystemExit, match='newer version'):
+        update_display.open_database()
+
+def test_no_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit, match='Database not found'):
+        update_display.open_database()
+    assert not (tmp_path / eco_db.DB_FILE).exists()
+
+def test_only_the_slots_asked_for_are_read(conn):
+    store_slots(conn, -4, 10)
+
+    roles, rows = update_display.select_slots(conn, [CARBON], False, 3)
+    assert roles == ['carbon']
+    assert [value for _, value in rows] == [100, 101, 102]
+
+    # the latest ones in tracker mode
+    _, rows = update_display.select_slots(conn, [CARBON], True, 2)
+    assert [value for _, value in rows] == [105, 104]
+
+    # and never more than there are
+    _, rows = update_display.select_slots(conn, [CARBON], False, 100)
+    assert len(rows.fetchall()) == 6
+
+class Connection(sqlite3.Connection):
+    """Keeps a note of whether it's been closed."""
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+def test_the_database_is_closed_when_there_is_nothing_to_show(conn, tmp_path, monkeypatch):
+    (tmp_path / 'config.yaml').write_text('Mode: carbon\nDisplayType: inkyphat\nDNORegion: Z\n')
+    monkeypatch.setattr(sys, 'path', [str(tmp_path)] + sys.path)
+    opened = []
+
+    def open_database():
+        opened.append(sqlite3.connect(eco_db.DB_FILE, factory=Connection))
+        return opened[-1]
+
+    monkeypatch.setattr(update_display, 'open_database', open_database)
+    with pytest.raises(SystemExit, match='No data found'):
+        update_display.main([])
+    assert opened[0].closed
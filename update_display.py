@@ -7,9 +7,18 @@
 import sqlite3
 import os
 import sys
-from urllib.request import pathname2url
 import argparse
 import eco_indicator
+import eco_blinkt
+import eco_config
+import eco_db
+import eco_profile
+import eco_series
+import eco_slots
+import eco_timing
+
+# where the last answer from a data server is kept, to ask it only for what's changed
+SERVER_CACHE_FILE = 'data_server_cache.json'
 
 # Blinkt! defaults
 DEFAULT_BRIGHTNESS = 10
@@ -18,61 +27,229 @@ DEFAULT_BRIGHTNESS = 10
 DEFAULT_HIGHPRICE = 30.0
 DEFAULT_LOWSLOTDURATION = 3
 
-parser = argparse.ArgumentParser(description=('Update Eco Indicator display using SQLite data'))
-parser.add_argument('--demo', '-d', action='store_true', help='display demo data')
-parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
-
-args = parser.parse_args()
-conf_file = args.conf
+def open_database() -> sqlite3.Connection:
+    """Connect to the existing database to read from it, bailing out if store_data.py
+    hasn't created it (or brought it up to date) yet."""
+    return eco_db.open_read_only()
+
+def slots_needed(config: dict) -> int:
+    """The most slots the configured display can show, so we never read more."""
+    if config['Mode'] == 'tracker':
+        return 2 # tomorrow's prices (if we have them) and today's
+    if config['DisplayType'] == 'blinkt':
+        return eco_blinkt.PIXELS * config['Blinkt']['SlotsPerPixel']
+    return config['InkyPHAT']['DataDuration'] * 2
+
+def select_slots(conn: sqlite3.Connection, series_list: list, tracker: bool, limit: int) -> tuple:
+    """Select up to 'limit' slots of the given series, picking them out by their
+    (tariff, region, measure) key: the latest ones for tracker mode, otherwise the ones
+    from the current slot on. Returns the series' roles and a cursor giving
+    (valid_from, value for each role) rows."""
+
+    roles = []
+    columns = []
+    series_ids = []
+
+    for series in series_list:
+        series_id = eco_db.series_id(conn, series, create=False)
+        if series_id is None:
+            raise SystemExit('Error: No data found for ' + series['tariff'] +
+                             ' - perhaps you need to run store_data.py.')
+        series_ids.append(str(series_id))
+        roles.append(series['role'])
+        columns.append('MAX(CASE WHEN series_id = ' + str(series_id) + ' THEN value END)')
+
+    select = ("SELECT valid_from, " + ', '.join(columns) + " FROM readings "
+              "WHERE series_id IN (" + ', '.join(series_ids) + ") ")
+
+    limit = " LIMIT " + str(limit)
 
-os.chdir(sys.path[0])
-
-try:
-    # connect to the database in rw mode so we can catch the error if it doesn't exist
-    DB_URI = 'file:{}?mode=rw'.format(pathname2url('eco_indicator.sqlite'))
-    conn = sqlite3.connect(DB_URI, uri=True)
     cursor = conn.cursor()
-    print('Connected to database...')
-
-except sqlite3.OperationalError as error:
-    # handle missing database case
-    raise SystemExit('Database not found - you need to run store_data.py first.') from error
-
-config = eco_indicator.get_config(conf_file)
-
-if 'agile' in config['Mode'] or config['Mode'] == 'tracker':
-    field_name = 'value_inc_vat'
-
-elif config['Mode'] == 'carbon':
-    field_name = 'intensity'
-
-else:
-    raise SystemExit('Error: invalid mode ' + config['Mode'] + ' in config.')
-
-if config['Mode'] == "tracker":
-    cursor.execute("SELECT * FROM eco ORDER BY valid_from DESC")
-else:
-    cursor.execute("SELECT * FROM eco WHERE valid_from > datetime('now', '-30 minutes') AND " + field_name + " IS NOT NULL")
-
-data_rows = cursor.fetchall()
-
-if len(data_rows) == 0:
-    raise SystemExit('Error: No data found - perhaps you need to run store_data.py.')
-
-if config['DisplayType'] == 'blinkt':
-    eco_indicator.update_blinkt(config, data_rows, args.demo)
-
-elif config['DisplayType'] == 'inkyphat':
-    if 'agile' in config['Mode'] or config['Mode'] == 'carbon':
-        eco_indicator.update_inky(config, data_rows, args.demo)
-    elif config['Mode'] == 'tracker':
-        eco_indicator.update_inky_tracker(config, data_rows, args.demo)
-
-else:
-    raise SystemExit('Error: invalid display type ' + config['DisplayType'] + 'in config.')
-
-# finish up the database operation
-if conn:
-    conn.commit()
-    conn.close()
 
+    if tracker:
+        cursor.execute(select + "GROUP BY valid_from ORDER BY valid_from DESC" + limit)
+    else:
+        cursor.execute(select + "AND valid_from > CAST(strftime('%s', 'now', '-30 minutes') AS INTEGER) "
+                       "GROUP BY valid_from ORDER BY valid_from" + limit)
+
+    return roles, cursor
+
+def to_slots(roles: list, rows) -> dict:
+    """Parse the slot times once here rather than every time the display code needs
+    one, straight from the rows. Returns a SlotSeries for each role, all covering the
+    same slots."""
+
+    slots = dict(zip(roles, eco_slots.from_rows(rows, len(roles))))
+
+    if len(slots[roles[0]]) == 0:
+        raise SystemExit('Error: No data found - perhaps you need to run store_data.py.')
+
+    return slots
+
+def read_data(conn: sqlite3.Connection, config: dict) -> dict:
+    """Select the slots the configured mode needs to draw the display. Returns a
+    SlotSeries for each role ('electricity', 'carbon' or 'gas'), all covering the same slots."""
+
+    with eco_timing.Span('db_query', mode=config['Mode']):
+        roles, cursor = select_slots(conn, eco_series.display_series(config),
+                                     config['Mode'] == 'tracker', slots_needed(config))
+        return to_slots(roles, cursor)
+
+def connect_to_server(address: str, timeout: float = 30):
+    """An HTTP connection to a data server given as http://host:port or as
+    unix:/path/to/socket."""
+    import http.client
+    import socket
+
+    if not address.startswith('unix:'):
+        return http.client.HTTPConnection(address.split('://', 1)[-1].rstrip('/'), timeout=timeout)
+
+    class UnixConnection(http.client.HTTPConnection):
+        """HTTP over a Unix socket rather than TCP."""
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(address[len('unix:'):])
+
+    return UnixConnection('localhost', timeout=timeout)
+
+def read_summary(conn: sqlite3.Connection, config: dict, slots: dict):
+    """Look up the summary of the slots about to be shown on an Inky pHAT that
+    store_data.py worked out when they arrived, in the form eco_stats.window_stats gives.
+    Returns None if there isn't one for exactly these slots and these settings."""
+
+    if config['DisplayType'] != 'inkyphat' or config['Mode'] == 'tracker':
+        return None
+
+    series = eco_series.display_series(config)[0]
+    series_id = eco_db.series_id(conn, series, create=False)
+    shown = slots[series['role']]
+    row = conn.execute('SELECT count, last_start, min_index, max_index, low_start, low_mean, '
+                       'high_start, high_mean, trimmed_mean FROM slot_summaries '
+                       'WHERE series_id = ? AND horizon_start = ? AND slots = ? AND window_slots = ?',
+                       (series_id, shown.starts[0], slots_needed(config),
+                        int(2 * config['InkyPHAT']['LowSlotDuration']))).fetchone()
+
+    if row is None or row[0] != len(shown) or row[1] != shown.starts[-1]:
+        return None
+
+    return {'lowest_windows': [(row[4], row[5])],
+            'highest_windows': [(row[6], row[7])],
+            'min_index': row[2],
+            'max_index': row[3],
+            'trimmed_mean': row[8]}
+
+def server_query(config: dict) -> str:
+    """The request for the slots the configured display needs from a data server."""
+    from urllib.parse import urlencode
+
+    query = {'mode': config['Mode'], 'region': config['DNORegion'], 'limit': slots_needed(config)}
+    if config['Mode'] == 'agile_import':
+        query['cap'] = config['AgileCap']
+    return '/slots?' + urlencode(query)
+
+def read_remote(config: dict) -> dict:
+    """Get the slots the configured display needs from the data server (see serve.py)
+    instead of a local database. The last answer is kept in SERVER_CACHE_FILE along
+    with its ETag, so when nothing has changed the server only has to say so."""
+    import json
+
+    path = server_query(config)
+
+    try:
+        with open(SERVER_CACHE_FILE, encoding='utf-8') as cache_file:
+            cached = json.load(cache_file)
+        if cached.get('path') != path:
+            cached = None
+    except (OSError, ValueError):
+        cached = None
+
+    headers = {'If-None-Match': cached['etag']} if cached is not None else {}
+
+    conn = connect_to_server(config['DataServer'])
+    try:
+        with eco_timing.Span('server_request', mode=config['Mode']) as span:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            body = response.read().decode('utf-8')
+            etag = response.getheader('ETag')
+            span.fields['status'] = response.status
+    except OSError as error:
+        raise SystemExit('Error: Unable to reach the data server at ' + config['DataServer'] +
+                         ': ' + str(error)) from error
+    finally:
+        conn.close()
+
+    if response.status == 304 and cached is not None:
+        print('No new data from the data server.')
+        body = cached['body']
+    elif response.status == 200:
+        print('New data from the data server.')
+        if etag is not None:
+            try:
+                with open(SERVER_CACHE_FILE + '.tmp', 'w', encoding='utf-8') as cache_file:
+                    json.dump({'path': path, 'etag': etag, 'body': body}, cache_file)
+                os.replace(SERVER_CACHE_FILE + '.tmp', SERVER_CACHE_FILE)
+            except OSError as error:
+                print('Unable to keep a copy of the data: ' + str(error))
+    else:
+        raise SystemExit('Error: the data server said ' + str(response.status) + ' ' + response.reason)
+
+    try:
+        data = json.loads(body)
+        return to_slots(data['roles'], data['rows'])
+    except (ValueError, KeyError, TypeError) as error:
+        raise SystemExit('Error: the data server sent something unexpected: ' + str(error)) from error
+
+def update_display(config: dict, slots: dict, demo: bool, inky_display=None,
+                   blinkt_animator=None, stats: dict = None):
+    """Hand the data to whichever display is configured. An already-initialised Inky
+    display can be passed in so that a long-running process doesn't probe for it again,
+    or the BlinktAnimator a long-running process is animating the Blinkt! with, and
+    the Inky pHAT's summary of the slots if it's been looked up (see read_summary)."""
+
+    if config['DisplayType'] == 'blinkt':
+        eco_indicator.update_blinkt(config, slots, demo, blinkt_animator)
+
+    elif config['DisplayType'] == 'inkyphat':
+        if 'agile' in config['Mode'] or config['Mode'] == 'carbon':
+            eco_indicator.update_inky(config, slots, demo, inky_display, stats=stats)
+        elif config['Mode'] == 'tracker':
+            eco_indicator.update_inky_tracker(config, slots, demo, inky_display)
+
+    else:
+        raise SystemExit('Error: invalid display type ' + config['DisplayType'] + 'in config.')
+
+def main(argv: list = None):
+    """Run once from the command line (or cron): read the database, draw, and exit."""
+    parser = argparse.ArgumentParser(description=('Update Eco Indicator display using SQLite data'))
+    parser.add_argument('--demo', '-d', action='store_true', help='display demo data')
+    parser.add_argument('--conf', '-c', default='config.yaml', help='specify config file')
+    eco_profile.add_argument(parser)
+
+    args = parser.parse_args(argv)
+    conf_file = args.conf
+
+    os.chdir(sys.path[0])
+
+    with eco_profile.profiling(args.profile, 'display'):
+        config = eco_config.get_config(conf_file)
+
+        try:
+            stats = None
+            if 'DataServer' in config:
+                slots = read_remote(config)
+            else:
+                conn = open_database()
+                try:
+                    slots = read_data(conn, config)
+                    stats = read_summary(conn, config, slots)
+                finally:
+                    conn.close()
+
+            update_display(config, slots, args.demo, stats=stats)
+        finally:
+            eco_timing.write_metrics(config, 'display')
+
+if __name__ == '__main__':
+    main()